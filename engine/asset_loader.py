@@ -0,0 +1,114 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from .mesh import Mesh
+from .mesh_cache import load_mesh_data
+from .model import Model
+from .obj_loader import parse_mtl_textures
+from .texture import Texture
+from .texture_manager import TextureManager, get_texture_manager
+
+
+#worker side of a model load: file reads, parsing and image decoding, no GL calls
+def _read_model(path):
+    lower = path.lower()
+    if not lower.endswith(('.obj', '.ply', '.stl')):
+        raise ValueError(f"Unsupported model format: {path}")
+    vertices, indices = load_mesh_data(path)
+    #copy out of the memory map here so the GL thread never waits on page faults
+    vertices = np.array(vertices)
+    indices = np.array(indices)
+
+    textures = []
+    if lower.endswith('.obj'):
+        texture_manager = get_texture_manager()
+        for tex_path, type_name in parse_mtl_textures(path, os.path.dirname(path)):
+            #already resident textures are just referenced again on upload
+            if TextureManager.make_key(tex_path) in texture_manager:
+                textures.append((tex_path, type_name, None))
+            else:
+                textures.append((tex_path, type_name, Texture.decode(tex_path)))
+    return vertices, indices, textures
+
+
+def _read_texture(path):
+    return (Texture.decode(path),)
+
+
+class AssetLoader:
+    #use_processes moves parsing out of this interpreter entirely, threads are
+    #enough when the heavy lifting happens in Open3D, PIL and NumPy
+    def __init__(self, max_workers=None, use_processes=False, upload_budget_ms=4.0):
+        executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor_type(max_workers=max_workers or os.cpu_count())
+        self.upload_budget_ms = upload_budget_ms
+        self._pending = 0
+        #finished cpu work waiting for its GL upload, filled from worker callbacks
+        self._ready = deque()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _submit(self, job, path, on_ready):
+        self._pending += 1
+        future = self.executor.submit(job, path)
+        future.add_done_callback(lambda done: self._ready.append((done, on_ready)))
+
+    #returns an empty placeholder model right away, its meshes show up once uploaded
+    def load_model(self, path, on_loaded=None):
+        model = Model(meshes=[])
+        model.loaded = False
+
+        def upload(vertices, indices, textures):
+            texture_manager = get_texture_manager()
+            textures = [texture_manager.acquire(tex_path, type_name, image_data)
+                        for tex_path, type_name, image_data in textures]
+            model.set_meshes([Mesh(vertices=vertices, indices=indices, textures=textures)])
+            model.loaded = True
+            if on_loaded:
+                on_loaded(model)
+
+        def fail(error):
+            model.load_error = error
+
+        self._submit(_read_model, path, (upload, fail))
+        return model
+
+    #returns a Future that resolves to a shared Texture after its upload on the GL thread,
+    #release it through its manager when done
+    def load_texture(self, path, type_name="texture_diffuse"):
+        result = Future()
+
+        def upload(image_data):
+            result.set_result(get_texture_manager().acquire(path, type_name, image_data))
+
+        self._submit(_read_texture, path, (upload, result.set_exception))
+        return result
+
+    #call once per frame on the GL thread, uploads finished assets until the budget is spent
+    def process_uploads(self, budget_ms=None):
+        budget = (self.upload_budget_ms if budget_ms is None else budget_ms) / 1000.0
+        start = time.perf_counter()
+        uploaded = 0
+        while self._ready:
+            #always upload at least one asset so a tight budget still makes progress
+            if uploaded and time.perf_counter() - start >= budget:
+                break
+            future, (upload, fail) = self._ready.popleft()
+            self._pending -= 1
+            uploaded += 1
+            error = future.exception()
+            if error is not None:
+                fail(error)
+                continue
+            try:
+                upload(*future.result())
+            except Exception as upload_error:
+                fail(upload_error)
+        return uploaded
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,253 @@
+from OpenGL.GL import *
+import bisect
+import numpy as np
+import ctypes
+from .gl_state import bind_vertex_array
+
+#every mesh uses the same interleaved layout: position, normal, uv
+VERTEX_FLOATS = 8
+VERTEX_STRIDE = VERTEX_FLOATS * 4
+INDEX_SIZE = 4
+
+
+#points attributes 0-2 of the bound VAO at the interleaved vertex layout
+def setup_vertex_layout(vbo, ebo):
+    glBindBuffer(GL_ARRAY_BUFFER, vbo)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+    glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, ctypes.c_void_p(0))
+    glEnableVertexAttribArray(0)
+
+    glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, ctypes.c_void_p(3 * 4))
+    glEnableVertexAttribArray(1)
+
+    glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, ctypes.c_void_p(6 * 4))
+    glEnableVertexAttribArray(2)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+#first fit allocator over [0, capacity), free blocks are kept sorted by offset
+#and merged with their neighbours when released
+class FreeList:
+    def __init__(self, capacity=0):
+        self.capacity = 0
+        self.offsets = []
+        self.sizes = []
+        self.grow(capacity)
+
+    @property
+    def free(self):
+        return sum(self.sizes)
+
+    def allocate(self, size):
+        for i, block_size in enumerate(self.sizes):
+            if block_size >= size:
+                offset = self.offsets[i]
+                if block_size == size:
+                    del self.offsets[i], self.sizes[i]
+                else:
+                    self.offsets[i] += size
+                    self.sizes[i] -= size
+                return offset
+        return None
+
+    def release(self, offset, size):
+        i = bisect.bisect_left(self.offsets, offset)
+        if i > 0 and self.offsets[i - 1] + self.sizes[i - 1] == offset:
+            i -= 1
+            self.sizes[i] += size
+        else:
+            self.offsets.insert(i, offset)
+            self.sizes.insert(i, size)
+        if i + 1 < len(self.offsets) and self.offsets[i] + self.sizes[i] == self.offsets[i + 1]:
+            self.sizes[i] += self.sizes.pop(i + 1)
+            del self.offsets[i + 1]
+
+    def grow(self, capacity):
+        if capacity > self.capacity:
+            self.release(self.capacity, capacity - self.capacity)
+            self.capacity = capacity
+
+    #everything below used is taken, everything above is one free block
+    def reset(self, used):
+        self.offsets = [used] if used < self.capacity else []
+        self.sizes = [self.capacity - used] if used < self.capacity else []
+
+
+class BufferAllocation:
+    def __init__(self, arena, vertex_offset, vertex_count, index_offset, index_count):
+        self.arena = arena
+        #offsets are in vertices and indices, not bytes
+        self.vertex_offset = vertex_offset
+        self.vertex_count = vertex_count
+        self.index_offset = index_offset
+        self.index_count = index_count
+
+    @property
+    def VAO(self):
+        return self.arena.VAO
+
+    @property
+    def index_pointer(self):
+        return ctypes.c_void_p(self.index_offset * INDEX_SIZE)
+
+    def bind(self):
+        self.arena.bind()
+
+    def release(self):
+        if self.arena is not None:
+            self.arena.release(self)
+            self.arena = None
+
+
+#sub allocates vertices and indices of many meshes from one large VBO and EBO
+#sharing a single VAO, meshes draw with base vertex offsets instead of rebinding
+class BufferArena:
+    def __init__(self, vertex_capacity=1 << 16, index_capacity=1 << 18):
+        self.VAO = glGenVertexArrays(1)
+        self.VBO = 0
+        self.EBO = 0
+        self.vertices = FreeList()
+        self.indices = FreeList()
+        self.allocations = set()
+        self._reallocate(vertex_capacity, index_capacity)
+
+    @property
+    def used_bytes(self):
+        return ((self.vertices.capacity - self.vertices.free) * VERTEX_STRIDE
+                + (self.indices.capacity - self.indices.free) * INDEX_SIZE)
+
+    @property
+    def capacity_bytes(self):
+        return self.vertices.capacity * VERTEX_STRIDE + self.indices.capacity * INDEX_SIZE
+
+    def bind(self):
+        bind_vertex_array(self.VAO)
+
+    #indices stay local to the mesh, draws add vertex_offset as the base vertex
+    def allocate(self, vertices, indices):
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, VERTEX_FLOATS)
+        indices = np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1)
+        allocation = BufferAllocation(self, 0, 0, 0, 0)
+        #registered before the second allocation so a defragment on the way moves it too
+        allocation.vertex_offset = self._allocate(self.vertices, len(vertices), grow_vertices=True)
+        allocation.vertex_count = len(vertices)
+        self.allocations.add(allocation)
+        allocation.index_offset = self._allocate(self.indices, len(indices), grow_vertices=False)
+        allocation.index_count = len(indices)
+        self.write(allocation, vertices, indices)
+        return allocation
+
+    def _allocate(self, free_list, count, grow_vertices):
+        if count == 0:
+            return 0
+        offset = free_list.allocate(count)
+        if offset is None and free_list.free >= count:
+            #enough room, just scattered between other meshes
+            self.defragment()
+            offset = free_list.allocate(count)
+        if offset is None:
+            capacity = max(free_list.capacity * 2, free_list.capacity + count)
+            if grow_vertices:
+                self._reallocate(capacity, self.indices.capacity)
+            else:
+                self._reallocate(self.vertices.capacity, capacity)
+            offset = free_list.allocate(count)
+        return offset
+
+    #overwrites part of an allocation in place, the ranges must stay inside it
+    def write(self, allocation, vertices=None, indices=None, vertex_start=0, index_start=0):
+        if vertices is not None and len(vertices):
+            vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, self.VBO)
+            glBufferSubData(GL_COPY_WRITE_BUFFER, (allocation.vertex_offset + vertex_start) * VERTEX_STRIDE,
+                            vertices.nbytes, vertices)
+        if indices is not None and len(indices):
+            indices = np.ascontiguousarray(indices, dtype=np.uint32)
+            #the copy target leaves the element buffer binding of the bound VAO alone
+            glBindBuffer(GL_COPY_WRITE_BUFFER, self.EBO)
+            glBufferSubData(GL_COPY_WRITE_BUFFER, (allocation.index_offset + index_start) * INDEX_SIZE,
+                            indices.nbytes, indices)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+    def release(self, allocation):
+        if allocation not in self.allocations:
+            return
+        self.allocations.remove(allocation)
+        if allocation.vertex_count:
+            self.vertices.release(allocation.vertex_offset, allocation.vertex_count)
+        if allocation.index_count:
+            self.indices.release(allocation.index_offset, allocation.index_count)
+
+    #packs every live allocation to the front of the buffers, the allocation
+    #objects are updated in place so meshes keep working
+    def defragment(self):
+        allocations = sorted(self.allocations, key=lambda allocation: allocation.vertex_offset)
+        vertex_moves, vertex_end = [], 0
+        for allocation in allocations:
+            vertex_moves.append((allocation.vertex_offset, vertex_end, allocation.vertex_count))
+            allocation.vertex_offset = vertex_end
+            vertex_end += allocation.vertex_count
+
+        allocations.sort(key=lambda allocation: allocation.index_offset)
+        index_moves, index_end = [], 0
+        for allocation in allocations:
+            index_moves.append((allocation.index_offset, index_end, allocation.index_count))
+            allocation.index_offset = index_end
+            index_end += allocation.index_count
+
+        self.VBO = self._copy_buffer(self.VBO, self.vertices.capacity * VERTEX_STRIDE, vertex_moves, VERTEX_STRIDE)
+        self.EBO = self._copy_buffer(self.EBO, self.indices.capacity * INDEX_SIZE, index_moves, INDEX_SIZE)
+        self.vertices.reset(vertex_end)
+        self.indices.reset(index_end)
+        self._setup_vertex_array()
+
+    #only the buffer whose capacity changes is reallocated and copied
+    def _reallocate(self, vertex_capacity, index_capacity):
+        old_vertices, old_indices = self.vertices.capacity, self.indices.capacity
+        if vertex_capacity != old_vertices or not self.VBO:
+            self.VBO = self._copy_buffer(self.VBO, vertex_capacity * VERTEX_STRIDE,
+                                         [(0, 0, old_vertices)], VERTEX_STRIDE)
+        if index_capacity != old_indices or not self.EBO:
+            self.EBO = self._copy_buffer(self.EBO, index_capacity * INDEX_SIZE,
+                                         [(0, 0, old_indices)], INDEX_SIZE)
+        self.vertices.grow(vertex_capacity)
+        self.indices.grow(index_capacity)
+        self._setup_vertex_array()
+
+    #new buffer of the given size with the (source, target, count) ranges copied over on the GPU
+    @staticmethod
+    def _copy_buffer(source, size, moves, item_size):
+        target = glGenBuffers(1)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, target)
+        glBufferData(GL_COPY_WRITE_BUFFER, size, None, GL_STATIC_DRAW)
+        if source:
+            glBindBuffer(GL_COPY_READ_BUFFER, source)
+            for source_offset, target_offset, count in moves:
+                if count:
+                    glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, source_offset * item_size,
+                                        target_offset * item_size, count * item_size)
+            glBindBuffer(GL_COPY_READ_BUFFER, 0)
+            glDeleteBuffers(1, [source])
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        return target
+
+    def _setup_vertex_array(self):
+        self.bind()
+        setup_vertex_layout(self.VBO, self.EBO)
+
+    def delete(self):
+        bind_vertex_array(0)
+        glDeleteVertexArrays(1, [self.VAO])
+        glDeleteBuffers(2, [self.VBO, self.EBO])
+        self.VAO = self.VBO = self.EBO = 0
+        self.allocations.clear()
+
+
+_buffer_arena = None
+
+
+def get_buffer_arena():
+    global _buffer_arena
+    if _buffer_arena is None:
+        _buffer_arena = BufferArena()
+    return _buffer_arena
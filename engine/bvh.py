@@ -0,0 +1,183 @@
+import numpy as np
+
+
+def _surface_area(mins, maxs):
+    size = np.maximum(maxs - mins, 0.0)
+    return 2.0 * (size[..., 0] * size[..., 1] + size[..., 1] * size[..., 2] + size[..., 2] * size[..., 0])
+
+
+#bounding volume hierarchy over axis aligned boxes, nodes are stored in flat arrays
+class BVH:
+    def __init__(self, leaf_size=8, rebuild_threshold=1.5):
+        self.leaf_size = leaf_size
+        #rebuild once refitting made the tree this much worse than when it was built
+        self.rebuild_threshold = rebuild_threshold
+        self.item_mins = np.zeros((0, 3), dtype=np.float32)
+        self.item_maxs = np.zeros((0, 3), dtype=np.float32)
+        self.order = np.zeros(0, dtype=np.int64)
+        self.node_mins = np.zeros((0, 3), dtype=np.float32)
+        self.node_maxs = np.zeros((0, 3), dtype=np.float32)
+        self.node_left = np.zeros(0, dtype=np.int64)
+        self.node_right = np.zeros(0, dtype=np.int64)
+        self.node_start = np.zeros(0, dtype=np.int64)
+        self.node_count = np.zeros(0, dtype=np.int64)
+        self.build_cost = 0.0
+        self._levels = []
+        self._leaves = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.item_mins)
+
+    def build(self, mins, maxs):
+        self.item_mins = np.asarray(mins, dtype=np.float32).reshape(-1, 3)
+        self.item_maxs = np.asarray(maxs, dtype=np.float32).reshape(-1, 3)
+        self.order = np.arange(len(self.item_mins))
+        self._centroids = (self.item_mins + self.item_maxs) * 0.5
+
+        self._nodes = []
+        if len(self.item_mins):
+            self._build_node(0, len(self.item_mins), 0)
+        nodes = np.array(self._nodes, dtype=np.int64).reshape(-1, 5)
+        del self._nodes, self._centroids
+
+        self.node_left, self.node_right, self.node_start, self.node_count, depth = nodes.T.copy()
+        self.node_mins = np.zeros((len(nodes), 3), dtype=np.float32)
+        self.node_maxs = np.zeros((len(nodes), 3), dtype=np.float32)
+        self._leaves = np.flatnonzero(self.node_left < 0)
+        internal = self.node_left >= 0
+        max_depth = depth.max() if len(depth) else -1
+        #internal nodes grouped by depth, deepest first, so refit can go level by level
+        self._levels = [np.flatnonzero(internal & (depth == d)) for d in range(max_depth, -1, -1)]
+
+        self._refit_nodes()
+        self.build_cost = self._cost()
+
+    def _build_node(self, start, end, depth):
+        index = len(self._nodes)
+        self._nodes.append([-1, -1, start, end - start, depth])
+        if end - start <= self.leaf_size:
+            return index
+
+        items = self.order[start:end]
+        centroids = self._centroids[items]
+        axis = np.argmax(centroids.max(axis=0) - centroids.min(axis=0))
+        mid = (start + end) // 2
+        self.order[start:end] = items[np.argpartition(centroids[:, axis], mid - start)]
+
+        self._nodes[index][0] = self._build_node(start, mid, depth + 1)
+        self._nodes[index][1] = self._build_node(mid, end, depth + 1)
+        return index
+
+    def _refit_nodes(self):
+        if len(self._leaves) == 0:
+            return
+        starts = self.node_start[self._leaves]
+        self.node_mins[self._leaves] = np.minimum.reduceat(self.item_mins[self.order], starts, axis=0)
+        self.node_maxs[self._leaves] = np.maximum.reduceat(self.item_maxs[self.order], starts, axis=0)
+        for nodes in self._levels:
+            left = self.node_left[nodes]
+            right = self.node_right[nodes]
+            self.node_mins[nodes] = np.minimum(self.node_mins[left], self.node_mins[right])
+            self.node_maxs[nodes] = np.maximum(self.node_maxs[left], self.node_maxs[right])
+
+    def _cost(self):
+        return float(_surface_area(self.node_mins, self.node_maxs).sum())
+
+    #keeps the tree topology and only recomputes node boxes for moved items
+    def refit(self, mins, maxs):
+        self.item_mins = np.asarray(mins, dtype=np.float32).reshape(-1, 3)
+        self.item_maxs = np.asarray(maxs, dtype=np.float32).reshape(-1, 3)
+        self._refit_nodes()
+
+    def needs_rebuild(self):
+        if self.build_cost <= 0.0:
+            return len(self.item_mins) > 0
+        return self._cost() > self.build_cost * self.rebuild_threshold
+
+    #items of the given nodes, every node covers a contiguous range of self.order
+    def _gather(self, nodes):
+        starts = self.node_start[nodes]
+        counts = self.node_count[nodes]
+        first = np.cumsum(counts) - counts
+        return self.order[np.repeat(starts - first, counts) + np.arange(counts.sum())]
+
+    #walks the tree one level at a time so every level is a single vectorized test,
+    #node_test returns (hit, contained) and contained nodes take their whole subtree
+    def _traverse(self, node_test, item_test):
+        if len(self.node_mins) == 0:
+            return np.zeros(0, dtype=np.int64)
+        found = []
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            hit, contained = node_test(self.node_mins[frontier], self.node_maxs[frontier])
+            found.append(self._gather(frontier[hit & contained]))
+
+            partial = frontier[hit & ~contained]
+            is_leaf = self.node_left[partial] < 0
+            items = self._gather(partial[is_leaf])
+            found.append(items[item_test(self.item_mins[items], self.item_maxs[items])])
+
+            inner = partial[~is_leaf]
+            frontier = np.concatenate([self.node_left[inner], self.node_right[inner]])
+        return np.concatenate(found)
+
+    def query_frustum(self, planes):
+        normals = planes[:, 0:3]
+        abs_normals = np.abs(normals)
+
+        def distances(mins, maxs):
+            centers = (mins + maxs) * 0.5
+            extents = (maxs - mins) * 0.5
+            return centers @ normals.T + planes[:, 3], extents @ abs_normals.T
+
+        def node_test(mins, maxs):
+            distance, radius = distances(mins, maxs)
+            return np.all(distance + radius >= 0.0, axis=-1), np.all(distance - radius >= 0.0, axis=-1)
+
+        def item_test(mins, maxs):
+            distance, radius = distances(mins, maxs)
+            return np.all(distance + radius >= 0.0, axis=-1)
+
+        return self._traverse(node_test, item_test)
+
+    def query_sphere(self, center, radius):
+        center = np.asarray(center, dtype=np.float32)
+        radius_sq = radius * radius
+
+        def item_test(mins, maxs):
+            closest = np.clip(center, mins, maxs)
+            return ((closest - center) ** 2).sum(axis=-1) <= radius_sq
+
+        def node_test(mins, maxs):
+            farthest = np.maximum(np.abs(mins - center), np.abs(maxs - center))
+            return item_test(mins, maxs), (farthest ** 2).sum(axis=-1) <= radius_sq
+
+        return self._traverse(node_test, item_test)
+
+    #returns (items, distances) sorted from nearest to farthest hit
+    def query_ray(self, origin, direction, max_distance=np.inf):
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        with np.errstate(divide="ignore"):
+            inv_direction = 1.0 / direction
+
+        def slabs(mins, maxs):
+            with np.errstate(invalid="ignore"):
+                t0 = (mins - origin) * inv_direction
+                t1 = (maxs - origin) * inv_direction
+            t_near = np.nan_to_num(np.minimum(t0, t1), nan=-np.inf).max(axis=-1)
+            t_far = np.nan_to_num(np.maximum(t0, t1), nan=np.inf).min(axis=-1)
+            return np.maximum(t_near, 0.0), t_far
+
+        def item_test(mins, maxs):
+            t_near, t_far = slabs(mins, maxs)
+            return (t_near <= t_far) & (t_near <= max_distance)
+
+        def node_test(mins, maxs):
+            hit = item_test(mins, maxs)
+            return hit, np.zeros_like(hit)
+
+        items = self._traverse(node_test, item_test)
+        distances, _ = slabs(self.item_mins[items], self.item_maxs[items])
+        order = np.argsort(distances, kind="stable")
+        return items[order], distances[order]
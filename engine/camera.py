@@ -6,12 +6,15 @@ class Camera:
     def __init__(self, position=np.array([0.0, 0.0, 3.0], dtype=np.float32),
                  target=np.array([0.0, 0.0, 0.0], dtype=np.float32),
                  up=np.array([0.0, 1.0, 0.0], dtype=np.float32),
-                 yaw=-90.0, pitch=0.0):
+                 yaw=-90.0, pitch=0.0, near=0.1, far=100.0):
         self.position = np.array(position, dtype=np.float32)
         self.world_up = np.array(up, dtype=np.float32)
         self.yaw = yaw
         self.pitch = pitch
         self.zoom = 45.0
+        #clip planes, light clusters slice the depth range between them
+        self.near = near
+        self.far = far
 
         if target is not None:
             target = np.array(target, dtype=np.float32)
@@ -41,7 +44,7 @@ class Camera:
 
     def get_projection_matrix(self, aspect_ratio):
         return pyrr.matrix44.create_perspective_projection(
-            self.zoom, aspect_ratio, 0.1, 100.0
+            self.zoom, aspect_ratio, self.near, self.far
         )
 
     def set_position(self, position):
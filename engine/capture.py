@@ -0,0 +1,207 @@
+import ctypes
+import os
+import queue
+import subprocess
+import threading
+import numpy as np
+from OpenGL.GL import *
+from PIL import Image
+
+#readbacks in flight before capture() has to create another buffer or wait
+RING_SIZE = 3
+MAX_RING_SIZE = 8
+_FENCE_DONE = (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED)
+
+
+#writes every frame as a numbered png file, low compression keeps the encoder ahead of the renderer
+class PngSequenceWriter:
+    ordered = False
+
+    def __init__(self, output_dir, name="frame_{:05d}.png", compress_level=1):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.name = name
+        self.compress_level = compress_level
+
+    def path(self, index):
+        return os.path.join(self.output_dir, self.name.format(index))
+
+    def write(self, index, pixels):
+        Image.fromarray(pixels).save(self.path(index), compress_level=self.compress_level)
+
+    def close(self):
+        pass
+
+
+#pipes raw frames into an encoder process, e.g. ffmpeg_command("out.mp4", 1280, 720)
+class PipeWriter:
+    ordered = True
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, index, pixels):
+        self.process.stdin.write(pixels.data)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+#keeps the frames in memory, in frame order
+class FrameCollector:
+    ordered = True
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, index, pixels):
+        self.frames.append(pixels)
+
+    def close(self):
+        pass
+
+
+def ffmpeg_command(path, width, height, fps=60, alpha=False, codec="libx264"):
+    return ["ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgba" if alpha else "rgb24",
+            "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-c:v", codec, "-pix_fmt", "yuv420p", path]
+
+
+#reads frames back without stalling: glReadPixels goes into a ring of pixel pack
+#buffers, each guarded by a fence, and a buffer is only mapped once its fence has
+#signaled a few frames later. Mapped frames go to writer threads for encoding.
+class FrameCapture:
+    def __init__(self, window, writer, alpha=False, threads=1, queue_size=8, ring_size=RING_SIZE):
+        self.window = window
+        self.writer = writer
+        self.alpha = alpha
+        self.ring_size = ring_size
+        self.frame_count = 0
+        self.width = 0
+        self.height = 0
+        self._buffers = []
+        self._free = []
+        #(buffer, fence, frame index) oldest first
+        self._in_flight = []
+        self._error = None
+
+        #ordered writers need the frames in sequence, so only one thread may feed them
+        threads = 1 if writer.ordered else max(1, threads)
+        #a full queue throttles the renderer instead of dropping frames
+        self._queue = queue.Queue(queue_size)
+        self._threads = [threading.Thread(target=self._write_frames, daemon=True) for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def frame_bytes(self):
+        return self.width * self.height * 4
+
+    #call after rendering and before swap_buffers
+    def capture(self):
+        if self._error is not None:
+            raise self._error
+        width, height = self.window.width, self.window.height
+        if (width, height) != (self.width, self.height):
+            self._resize(width, height)
+
+        self._collect(wait=False)
+        if not self._free:
+            if len(self._buffers) < MAX_RING_SIZE:
+                self._add_buffer()
+            else:
+                #the gpu is a whole ring behind, only now is waiting unavoidable
+                self._collect_one(wait=True)
+        buffer = self._free.pop()
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.window.framebuffer)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        #rgba is the layout drivers copy fastest, the writer thread drops alpha if unwanted
+        glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self._in_flight.append((buffer, fence, self.frame_count))
+        self.frame_count += 1
+
+    def _add_buffer(self):
+        buffer = glGenBuffers(1)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        glBufferData(GL_PIXEL_PACK_BUFFER, self.frame_bytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self._buffers.append(buffer)
+        self._free.append(buffer)
+
+    def _resize(self, width, height):
+        self._collect(wait=True)
+        self._delete_buffers()
+        self.width, self.height = width, height
+        for _ in range(self.ring_size):
+            self._add_buffer()
+
+    #hands every finished readback to the writers, in frame order
+    def _collect(self, wait):
+        while self._in_flight and self._collect_one(wait):
+            pass
+
+    #waiting goes on until the readback is done, a slow frame may take more than one timeout
+    def _collect_one(self, wait):
+        buffer, fence, index = self._in_flight[0]
+        while True:
+            status = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000 if wait else 0)
+            if status in _FENCE_DONE:
+                break
+            if status == GL_WAIT_FAILED:
+                raise RuntimeError("Waiting for a captured frame failed")
+            if not wait:
+                return False
+        glDeleteSync(fence)
+        self._in_flight.pop(0)
+
+        pixels = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.frame_bytes, GL_MAP_READ_BIT)
+        ctypes.memmove(pixels.ctypes.data, pointer, self.frame_bytes)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self._free.append(buffer)
+        self._queue.put((index, pixels))
+        return True
+
+    def _write_frames(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                index, pixels = item
+                #gl rows start at the bottom
+                pixels = pixels[::-1] if self.alpha else pixels[::-1, :, 0:3]
+                self.writer.write(index, np.ascontiguousarray(pixels))
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _delete_buffers(self):
+        for _, fence, _ in self._in_flight:
+            glDeleteSync(fence)
+        self._in_flight = []
+        if self._buffers:
+            glDeleteBuffers(len(self._buffers), self._buffers)
+        self._buffers = []
+        self._free = []
+
+    #waits for the outstanding readbacks and encodes, then closes the writer
+    def close(self):
+        self._collect(wait=True)
+        self._delete_buffers()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.writer.close()
+        if self._error is not None:
+            raise self._error
\ No newline at end of file
@@ -0,0 +1,237 @@
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_1_0 import glTexImage2D as _glTexImage2D
+import os
+import ctypes
+import numpy as np
+from . import gl_state
+from .gl_state import bind_vertex_array
+from .light_clusters import light_bounds
+from .mesh import Mesh
+from .profiler import get_profiler
+from .shader import Shader
+
+#G-buffer color attachments: normal + shininess, albedo. Positions are rebuilt from the depth texture
+GBUFFER_FORMATS = (
+    (GL_RGBA16F, GL_RGBA, GL_FLOAT),
+    (GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE),
+)
+#lights add up in float, rounding every light to 8 bits would lose the dim ones
+LIGHT_ACCUMULATION_FORMAT = (GL_RGBA32F, GL_RGBA, GL_FLOAT)
+#units the G-buffer textures are bound to for the lighting passes, clear of the light buffer
+#textures. Same order as GBuffer.textures
+GBUFFER_TEXTURE_UNITS = {
+    "gNormal": 9,
+    "gAlbedo": 10,
+    "gDepth": 11,
+    "lightAccumulation": 12,
+}
+#light volumes are spheres of this resolution, their flat facets sit inside the unit
+#sphere so the volume is scaled up until it encloses the light's radius
+VOLUME_RESOLUTION = 8
+VOLUME_SCALE = 1.1
+#per light: bounding sphere (center, radius) and index into lightData, see light_volume.vert
+VOLUME_FLOATS = 5
+VOLUME_SPHERE_LOCATION = 3
+VOLUME_INDEX_LOCATION = 4
+
+_profiler = get_profiler()
+
+
+#the geometry pass draws into framebuffer, the lighting passes into light_framebuffer
+class GBuffer:
+    def __init__(self, width, height):
+        self.width = 0
+        self.height = 0
+        self.framebuffer = 0
+        self.light_framebuffer = 0
+        self.textures = []
+        self.resize(width, height)
+
+    @staticmethod
+    def _create_texture(internal_format, format, type, width, height):
+        texture = glGenTextures(1)
+        gl_state.bind_texture(texture)
+        #the PyOpenGL wrapper has no array type for GL_UNSIGNED_INT_24_8, nothing is uploaded anyway
+        _glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, format, type, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        return texture
+
+    def resize(self, width, height):
+        self.delete()
+        self.width = width
+        self.height = height
+        self.textures = [self._create_texture(*formats, width, height) for formats in GBUFFER_FORMATS]
+        depth_texture = self._create_texture(GL_DEPTH24_STENCIL8, GL_DEPTH_STENCIL, GL_UNSIGNED_INT_24_8, width, height)
+        light_texture = self._create_texture(*LIGHT_ACCUMULATION_FORMAT, width, height)
+        self.textures += [depth_texture, light_texture]
+
+        self.framebuffer, self.light_framebuffer = glGenFramebuffers(2)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        attachments = [GL_COLOR_ATTACHMENT0 + i for i in range(len(GBUFFER_FORMATS))]
+        for attachment, texture in zip(attachments, self.textures):
+            glFramebufferTexture2D(GL_FRAMEBUFFER, attachment, GL_TEXTURE_2D, texture, 0)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_TEXTURE_2D, depth_texture, 0)
+        glDrawBuffers(len(attachments), attachments)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("G-buffer framebuffer is incomplete")
+
+        #no depth attachment, the depth texture is sampled while lighting
+        glBindFramebuffer(GL_FRAMEBUFFER, self.light_framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, light_texture, 0)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Light accumulation framebuffer is incomplete")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def bind_textures(self):
+        for unit, texture in zip(GBUFFER_TEXTURE_UNITS.values(), self.textures):
+            gl_state.bind_texture(texture, unit=unit)
+        gl_state.active_texture(0)
+
+    def delete(self):
+        if self.framebuffer:
+            glDeleteFramebuffers(2, [self.framebuffer, self.light_framebuffer])
+        if self.textures:
+            gl_state.delete_textures(self.textures)
+        self.framebuffer = self.light_framebuffer = 0
+        self.textures = []
+
+
+#Deferred shading: the scene is drawn once into a G-buffer, then lit in screen space.
+#The directional light is one fullscreen pass, every point and spot light draws the back
+#faces of a sphere around its reach so only the pixels it can touch get shaded. The
+#summed light is resolved into the window's framebuffer together with the scene depth.
+#Light volumes read the same lightData buffer texture as clustered forward shading.
+class DeferredRenderer:
+    def __init__(self):
+        shaders_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
+        self.geometry_shader = Shader(os.path.join(shaders_dir, "phong.vert"), os.path.join(shaders_dir, "gbuffer.frag"))
+        self.directional_shader = Shader(os.path.join(shaders_dir, "fullscreen.vert"),
+                                         os.path.join(shaders_dir, "deferred_directional.frag"))
+        self.volume_shader = Shader(os.path.join(shaders_dir, "light_volume.vert"),
+                                    os.path.join(shaders_dir, "light_volume.frag"))
+        self.resolve_shader = Shader(os.path.join(shaders_dir, "fullscreen.vert"),
+                                     os.path.join(shaders_dir, "deferred_resolve.frag"))
+        for shader in (self.directional_shader, self.volume_shader, self.resolve_shader):
+            shader.use()
+            for name, unit in GBUFFER_TEXTURE_UNITS.items():
+                shader.set_int(name, unit)
+
+        self.gbuffer = None
+        self.volume_mesh = Mesh.create_sphere(1.0, VOLUME_RESOLUTION)
+        self.volume_VBO = glGenBuffers(1)
+        self._volume_capacity = 0
+        #core profile draws need a VAO even when the vertex shader reads no attributes
+        self.empty_VAO = glGenVertexArrays(1)
+
+    #forward_shader draws the scene's transparent models on top, with blending
+    def render(self, scene, window, aspect_ratio, forward_shader=None):
+        width, height = window.width, window.height
+        if self.gbuffer is None:
+            self.gbuffer = GBuffer(width, height)
+        elif (self.gbuffer.width, self.gbuffer.height) != (width, height):
+            self.gbuffer.resize(width, height)
+
+        with _profiler.section("geometry_pass", gpu=True):
+            glBindFramebuffer(GL_FRAMEBUFFER, self.gbuffer.framebuffer)
+            glViewport(0, 0, width, height)
+            #zero albedo alpha marks the pixels nothing was drawn to
+            glClearColor(0.0, 0.0, 0.0, 0.0)
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            self.geometry_shader.use()
+            scene.render(self.geometry_shader, aspect_ratio, deferred=True)
+
+        with _profiler.section("lighting_pass", gpu=True):
+            #pixels without geometry are never lit or resolved, so this needs no clear
+            glBindFramebuffer(GL_FRAMEBUFFER, self.gbuffer.light_framebuffer)
+            glViewport(0, 0, width, height)
+            self.gbuffer.bind_textures()
+            camera = scene.camera
+            #pyrr matrices are row vector, so view @ projection is projection * view in glsl
+            view_projection = np.asarray(camera.get_view_matrix()) @ np.asarray(camera.get_projection_matrix(aspect_ratio))
+            inverse_view_projection = np.linalg.inv(view_projection).astype(np.float32)
+
+            #the lighting passes only read depth, volumes test it in the fragment shader
+            gl_state.set_capability(GL_DEPTH_TEST, False)
+            self.directional_shader.use()
+            self.directional_shader.set_mat4("inverseViewProjection", inverse_view_projection)
+            bind_vertex_array(self.empty_VAO)
+            glDrawArrays(GL_TRIANGLES, 0, 3)
+            _profiler.count("draw_calls")
+
+            light_clusters = scene.light_clusters
+            if light_clusters is not None and light_clusters.light_count:
+                gl_state.set_capability(GL_BLEND, True)
+                gl_state.blend_func(GL_ONE, GL_ONE)
+                #back faces stay visible with the camera inside a volume, depth clamping
+                #keeps the parts behind the far plane
+                gl_state.cull_face(GL_FRONT)
+                gl_state.set_capability(GL_DEPTH_CLAMP, True)
+                self.volume_shader.use()
+                self.volume_shader.set_mat4("inverseViewProjection", inverse_view_projection)
+                self._draw_volumes(light_clusters.data)
+                bind_vertex_array(self.empty_VAO)
+                gl_state.set_capability(GL_DEPTH_CLAMP, False)
+                gl_state.cull_face(GL_BACK)
+                gl_state.set_capability(GL_BLEND, False)
+
+        with _profiler.section("resolve", gpu=True):
+            glBindFramebuffer(GL_FRAMEBUFFER, window.framebuffer)
+            self.resolve_shader.use()
+            glDrawArrays(GL_TRIANGLES, 0, 3)
+            _profiler.count("draw_calls")
+            gl_state.set_capability(GL_DEPTH_TEST, True)
+
+            #anything drawn after the scene still depth tests against it
+            glBindFramebuffer(GL_READ_FRAMEBUFFER, self.gbuffer.framebuffer)
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, window.framebuffer)
+            glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+            glBindFramebuffer(GL_FRAMEBUFFER, window.framebuffer)
+
+        #the lights were left in a single cluster, forward shading still finds all of them
+        if forward_shader is not None:
+            scene.draw_transparent(forward_shader)
+
+    def _draw_volumes(self, data):
+        centers, radii = light_bounds(data)
+        volumes = np.empty((len(data), VOLUME_FLOATS), dtype=np.float32)
+        volumes[:, 0:3] = centers
+        volumes[:, 3] = radii * VOLUME_SCALE
+        volumes[:, 4] = np.arange(len(data))
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.volume_VBO)
+        if volumes.nbytes > self._volume_capacity:
+            self._volume_capacity = max(volumes.nbytes, self._volume_capacity * 2)
+        #orphan so the driver does not wait on last frames draws
+        glBufferData(GL_ARRAY_BUFFER, self._volume_capacity, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, volumes.nbytes, volumes)
+
+        allocation = self.volume_mesh.allocation
+        allocation.bind()
+        glBindBuffer(GL_ARRAY_BUFFER, self.volume_VBO)
+        stride = VOLUME_FLOATS * 4
+        glVertexAttribPointer(VOLUME_SPHERE_LOCATION, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(0))
+        glVertexAttribPointer(VOLUME_INDEX_LOCATION, 1, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(16))
+        for location in (VOLUME_SPHERE_LOCATION, VOLUME_INDEX_LOCATION):
+            glEnableVertexAttribArray(location)
+            glVertexAttribDivisor(location, 1)
+        glDrawElementsInstancedBaseVertex(GL_TRIANGLES, allocation.index_count, GL_UNSIGNED_INT,
+                                          allocation.index_pointer, len(volumes), allocation.vertex_offset)
+        for location in (VOLUME_SPHERE_LOCATION, VOLUME_INDEX_LOCATION):
+            glDisableVertexAttribArray(location)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        _profiler.count("draw_calls")
+        _profiler.count("instances", len(volumes))
+
+    def delete(self):
+        if self.gbuffer is not None:
+            self.gbuffer.delete()
+            self.gbuffer = None
+        self.volume_mesh.delete()
+        glDeleteBuffers(1, [self.volume_VBO])
+        glDeleteVertexArrays(1, [self.empty_VAO])
+        for shader in (self.geometry_shader, self.directional_shader, self.volume_shader, self.resolve_shader):
+            glDeleteProgram(shader.program)
+        self.volume_VBO = self.empty_VAO = 0
@@ -1,19 +1,59 @@
 import os
+import time
+import numpy as np
 from .window import Window
+from .capture import FrameCapture, FrameCollector, PipeWriter, PngSequenceWriter
+from .deferred import DeferredRenderer
 from .scene import Scene
 from .shader import Shader
+from .uniform_buffer import UniformBuffer, FRAME_BLOCK_FLOATS
+from .asset_loader import AssetLoader
+from .profiler import get_profiler
+
+#forward shades every fragment as it is drawn, deferred lights a G-buffer afterwards (engine/deferred.py)
+RENDERERS = ("forward", "deferred")
 
 
 class Engine:
-    def __init__(self, width=800, height=600, title="3D Game Render Engine"):
-        self.window = Window(width, height, title)
+    #headless renders into an offscreen framebuffer on an EGL or OSMesa context,
+    #see engine/offscreen.py for the PYOPENGL_PLATFORM it needs
+    def __init__(self, width=800, height=600, title="3D Game Render Engine", headless=False, backend=None,
+                 renderer="forward"):
+        if headless:
+            from .offscreen import OffscreenWindow
+            self.window = OffscreenWindow(width, height, title, backend)
+        else:
+            self.window = Window(width, height, title)
+        self.headless = headless
         self.scene = Scene()
         self.running = False
         self.last_time = 0
         self.delta_time = 0
+        self.asset_loader = AssetLoader()
+        self.capture = None
+        #enable with engine.profiler.enable(), show_profiler puts its summary in the window title
+        self.profiler = get_profiler()
+        self.show_profiler = False
+        self.profiler_interval = 0.5
+        self._profiler_shown = 0.0
 
         self.default_shader = None
         self._init_default_shader()
+        self.frame_buffer = UniformBuffer("Frame", FRAME_BLOCK_FLOATS * 4)
+        self._frame_data = np.zeros(FRAME_BLOCK_FLOATS, dtype=np.float32)
+
+        self.renderer = None
+        self.deferred_renderer = None
+        self.set_renderer(renderer)
+
+    #switches between forward and deferred shading, both draw the same scene
+    def set_renderer(self, renderer):
+        if renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer: {renderer}")
+        if renderer == "deferred" and self.deferred_renderer is None:
+            self.deferred_renderer = DeferredRenderer()
+        self.renderer = renderer
+
     #get shaders from shader dir
     def _init_default_shader(self):
         shaders_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
@@ -22,20 +62,39 @@ class Engine:
         self.default_shader = Shader(vert_shader, frag_shader)
 
     def start(self):
-        import glfw
         self.running = True
-        self.last_time = glfw.get_time()
+        self.last_time = time.perf_counter()
 
         while self.running and not self.window.should_close():
-            current_time = glfw.get_time()
+            current_time = time.perf_counter()
             self.delta_time = current_time - self.last_time
             self.last_time = current_time
+            self._run_frame(self.delta_time)
+
+        self.shutdown()
+
+    #one iteration of the main loop, every stage timed when the profiler is enabled
+    def _run_frame(self, delta_time):
+        profiler = self.profiler
+        profiler.begin_frame()
+        with profiler.section("poll_events"):
             self.window.poll_events()
-            self.update(self.delta_time)
+        with profiler.section("uploads", gpu=True):
+            self.asset_loader.process_uploads()
+        with profiler.section("update"):
+            self.update(delta_time)
+        with profiler.section("render", gpu=True):
             self.render()
+        if self.capture:
+            with profiler.section("capture", gpu=True):
+                self.capture.capture()
+        with profiler.section("swap_buffers"):
             self.window.swap_buffers()
+        profiler.end_frame()
 
-        self.shutdown()
+        if self.show_profiler and profiler.enabled and self.last_time - self._profiler_shown >= self.profiler_interval:
+            self._profiler_shown = self.last_time
+            self.window.set_title(profiler.summary())
 
     def stop(self):
         self.running = False
@@ -54,13 +113,68 @@ class Engine:
         view_matrix = camera.get_view_matrix()
         projection_matrix = camera.get_projection_matrix(aspect_ratio)
 
-        self.default_shader.use()
-        self.default_shader.set_mat4("view", view_matrix)
-        self.default_shader.set_mat4("projection", projection_matrix)
-        self.default_shader.set_vec3("viewPos", camera.position)
-        self.scene.render(self.default_shader)
+        #view, projection and viewPos are shared by every shader through the Frame block
+        self._frame_data[0:16] = view_matrix.flatten()
+        self._frame_data[16:32] = projection_matrix.flatten()
+        self._frame_data[32:35] = camera.position
+        self._frame_data[36:40] = (self.window.width, self.window.height, camera.near, camera.far)
+        with self.profiler.section("frame_uniforms"):
+            self.frame_buffer.update(self._frame_data)
+
+        if self.renderer == "deferred":
+            self.deferred_renderer.render(self.scene, self.window, aspect_ratio, self.default_shader)
+        else:
+            self.default_shader.use()
+            self.scene.render(self.default_shader, aspect_ratio)
+
+    #records every rendered frame until stop_capture: a png sequence into output_dir,
+    #raw frames piped into command (see capture.ffmpeg_command) or any custom writer
+    def start_capture(self, output_dir=None, command=None, writer=None, **options):
+        self.stop_capture()
+        if writer is None:
+            if command is not None:
+                writer = PipeWriter(command)
+            elif output_dir is not None:
+                writer = PngSequenceWriter(output_dir)
+            else:
+                raise ValueError("start_capture needs an output_dir, a command or a writer")
+        self.capture = FrameCapture(self.window, writer, **options)
+        return self.capture
+
+    #blocks until the captured frames are written
+    def stop_capture(self):
+        capture, self.capture = self.capture, None
+        if capture:
+            capture.close()
+
+    #renders frame_count frames with a fixed time step, for batch rendering and tests.
+    #Returns the frames as (height, width, 3) uint8 arrays, or writes them as numbered
+    #png files into output_dir and returns the paths instead
+    def render_frames(self, frame_count, output_dir=None, delta_time=1.0 / 60.0, name="frame_{:05d}.png"):
+        #it records through its own capture, which would end the caller's
+        if self.capture is not None:
+            raise RuntimeError("render_frames can not run during a capture, call stop_capture first")
+        if output_dir is None:
+            writer = FrameCollector()
+        else:
+            writer = PngSequenceWriter(output_dir, name)
+        #threads only matter for the png writer, the collector needs its frames in order
+        self.start_capture(writer=writer, threads=os.cpu_count() or 1)
+        for frame in range(frame_count):
+            self.delta_time = delta_time
+            self._run_frame(delta_time)
+        self.stop_capture()
+        if output_dir is None:
+            return writer.frames
+        return [writer.path(frame) for frame in range(frame_count)]
 
     def shutdown(self):
+        self.stop_capture()
+        self.asset_loader.shutdown()
+        if self.deferred_renderer is not None:
+            self.deferred_renderer.delete()
+            self.deferred_renderer = None
+        self.scene.delete()
         self.window.terminate()
 
     def get_delta_time(self):
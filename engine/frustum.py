@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def extract_frustum_planes(view_matrix, projection_matrix):
+    #matrices follow pyrr's row vector convention, so the clip space rows
+    #are the columns of view * projection
+    clip = np.dot(view_matrix, projection_matrix).T
+    planes = np.array([
+        clip[3] + clip[0],  # left
+        clip[3] - clip[0],  # right
+        clip[3] + clip[1],  # bottom
+        clip[3] - clip[1],  # top
+        clip[3] + clip[2],  # near
+        clip[3] - clip[2],  # far
+    ], dtype=np.float32)
+    planes /= np.linalg.norm(planes[:, 0:3], axis=1)[:, np.newaxis]
+    return planes
+
+
+#tests every box against all six planes at once, boxes are (center, half extents)
+def boxes_in_frustum(planes, centers, extents):
+    if len(centers) == 0:
+        return np.zeros(0, dtype=bool)
+    distances = centers @ planes[:, 0:3].T + planes[:, 3]
+    radii = extents @ np.abs(planes[:, 0:3]).T
+    return np.all(distances + radii >= 0.0, axis=1)
@@ -0,0 +1,145 @@
+from OpenGL.GL import *
+from .profiler import get_profiler
+
+#Shadow copy of the GL state the draw loop keeps changing. Route every change of it
+#through here: setting a value that is already current costs a dict lookup instead of
+#a driver call, and only real changes show up as state_changes in the profiler.
+#Call reset() after GL code that changes this state behind the cache's back.
+_vertex_array = None
+_program = None
+_active_unit = None
+#(unit, target) -> texture
+_textures = {}
+#glEnable / glDisable capability -> enabled
+_capabilities = {}
+_depth_mask = None
+_depth_func = None
+_color_mask = None
+_blend_func = None
+_cull_face = None
+#version and extensions of the context, read on first use
+_version = None
+_extensions = None
+
+_profiler = get_profiler()
+
+
+def reset():
+    global _vertex_array, _program, _active_unit, _depth_mask, _depth_func, _color_mask, _blend_func, _cull_face
+    global _version, _extensions
+    _vertex_array = _program = _active_unit = None
+    _depth_mask = _depth_func = _color_mask = _blend_func = _cull_face = None
+    _version = _extensions = None
+    _textures.clear()
+    _capabilities.clear()
+
+
+#True when the context is at least version (major, minor) or has the extension, version
+#is None for extensions that never became core. A resolved PyOpenGL entry point tells
+#nothing, it can exist on a context without it
+def context_supports(version, extension):
+    global _version, _extensions
+    if _version is None:
+        _version = (int(glGetIntegerv(GL_MAJOR_VERSION)), int(glGetIntegerv(GL_MINOR_VERSION)))
+        _extensions = {glGetStringi(GL_EXTENSIONS, i).decode() for i in range(glGetIntegerv(GL_NUM_EXTENSIONS))}
+    return (version is not None and _version >= tuple(version)) or extension in _extensions
+
+
+def bind_vertex_array(vao):
+    global _vertex_array
+    if vao != _vertex_array:
+        glBindVertexArray(vao)
+        _vertex_array = vao
+        _profiler.count("state_changes")
+
+
+def use_program(program):
+    global _program
+    if program != _program:
+        glUseProgram(program)
+        _program = program
+        _profiler.count("state_changes")
+
+
+def current_program():
+    return _program
+
+
+def active_texture(unit):
+    global _active_unit
+    if unit != _active_unit:
+        glActiveTexture(GL_TEXTURE0 + unit)
+        _active_unit = unit
+
+
+#binds texture to unit, or to the active unit when unit is None. The active unit
+#stays switched, draws put it back to 0 when they are done
+def bind_texture(texture, target=GL_TEXTURE_2D, unit=None):
+    if unit is None:
+        unit = _active_unit or 0
+    key = (unit, target)
+    if _textures.get(key) != texture:
+        active_texture(unit)
+        glBindTexture(target, texture)
+        _textures[key] = texture
+        _profiler.count("state_changes")
+
+
+#deleting a bound texture unbinds it, so its name must not stay cached
+def delete_textures(textures):
+    textures = list(textures)
+    for key, texture in list(_textures.items()):
+        if texture in textures:
+            _textures[key] = 0
+    glDeleteTextures(textures)
+
+
+def set_capability(capability, enabled):
+    if _capabilities.get(capability) != enabled:
+        if enabled:
+            glEnable(capability)
+        else:
+            glDisable(capability)
+        _capabilities[capability] = enabled
+        _profiler.count("state_changes")
+
+
+def depth_mask(enabled):
+    global _depth_mask
+    if enabled != _depth_mask:
+        glDepthMask(GL_TRUE if enabled else GL_FALSE)
+        _depth_mask = enabled
+        _profiler.count("state_changes")
+
+
+def depth_func(func):
+    global _depth_func
+    if func != _depth_func:
+        glDepthFunc(func)
+        _depth_func = func
+        _profiler.count("state_changes")
+
+
+def color_mask(enabled):
+    global _color_mask
+    if enabled != _color_mask:
+        flag = GL_TRUE if enabled else GL_FALSE
+        glColorMask(flag, flag, flag, flag)
+        _color_mask = enabled
+        _profiler.count("state_changes")
+
+
+def blend_func(source, destination):
+    global _blend_func
+    if (source, destination) != _blend_func:
+        glBlendFunc(source, destination)
+        _blend_func = (source, destination)
+        _profiler.count("state_changes")
+
+
+def cull_face(mode):
+    global _cull_face
+    if mode != _cull_face:
+        glCullFace(mode)
+        _cull_face = mode
+        _profiler.count("state_changes")
@@ -0,0 +1,170 @@
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_4_2 import glDrawElementsInstancedBaseVertexBaseInstance
+from OpenGL.raw.GL.VERSION.GL_4_3 import glMultiDrawElementsIndirect
+import ctypes
+import numpy as np
+from .buffer_arena import INDEX_SIZE
+from .gl_state import context_supports
+from .instancing import InstanceBuffer
+from .profiler import get_profiler
+
+#layout of DrawElementsIndirectCommand as the GL reads it from the indirect buffer
+DRAW_COMMAND = np.dtype([
+    ("count", np.uint32),
+    ("instanceCount", np.uint32),
+    ("firstIndex", np.uint32),
+    ("baseVertex", np.int32),
+    ("baseInstance", np.uint32),
+])
+
+_profiler = get_profiler()
+
+
+#Draws many models from a command buffer on the GPU. The model matrix and color of every
+#drawn (model, mesh) pair go into one instance buffer, sorted by material and mesh, so
+#each mesh is one command whose baseInstance points the instanced attributes of phong.vert
+#at its own rows. All commands of a material are submitted with one
+#glMultiDrawElementsIndirect; contexts without it loop over the same commands with
+#base instance draws, or move the attribute pointers to the rows on plain GL 3.3.
+class IndirectDraws:
+    def __init__(self):
+        self.multi_draw = context_supports((4, 3), "GL_ARB_multi_draw_indirect")
+        self.base_instance = context_supports((4, 2), "GL_ARB_base_instance")
+        #multi draw reads baseInstance from the commands, it is useless without it
+        self.multi_draw = self.multi_draw and self.base_instance
+        self.instance_buffer = InstanceBuffer()
+        self.command_buffer = glGenBuffers(1) if self.multi_draw else 0
+        self._command_capacity = 0
+        self.commands = np.zeros(0, dtype=DRAW_COMMAND)
+        #(first command, command count, mesh with the batch's textures, model with its shininess)
+        self.batches = []
+        self._models = None
+
+    #the next draw rebuilds the commands, call once per frame before drawing
+    def reset(self):
+        self._models = None
+
+    #the depth pre-pass and the shading pass draw the same models, so the commands
+    #are only built by the first of them
+    def draw(self, shader, models):
+        if models != self._models:
+            self._build(models)
+            self._models = list(models)
+        if not self.batches:
+            return
+
+        shader.set_bool("useInstancing", True)
+        shader.set_float("opacity", 1.0)
+        if self.multi_draw:
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+        for first, count, mesh, model in self.batches:
+            shader.set_float("material.shininess", model.shininess)
+            shader.set_bool("hasTexture", len(mesh.textures) > 0)
+            mesh._bind_textures(shader)
+            mesh.allocation.bind()
+            self._submit(first, count)
+        if self.multi_draw:
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+        shader.set_bool("useInstancing", False)
+
+        commands = self.commands
+        _profiler.count("indirect_commands", len(commands))
+        _profiler.count("instances", int(commands["instanceCount"].sum()))
+        _profiler.count("triangles", int((commands["count"].astype(np.int64) // 3 * commands["instanceCount"]).sum()))
+
+    def _submit(self, first, count):
+        if self.multi_draw:
+            self.instance_buffer.attach()
+            glMultiDrawElementsIndirect(GL_TRIANGLES, GL_UNSIGNED_INT,
+                                        ctypes.c_void_p(first * DRAW_COMMAND.itemsize), count, 0)
+            self.instance_buffer.detach()
+            _profiler.count("draw_calls")
+            return
+        if self.base_instance:
+            self.instance_buffer.attach()
+        for index_count, instance_count, first_index, base_vertex, base_instance in self.commands[first:first + count].tolist():
+            if self.base_instance:
+                glDrawElementsInstancedBaseVertexBaseInstance(GL_TRIANGLES, index_count, GL_UNSIGNED_INT,
+                                                              ctypes.c_void_p(first_index * INDEX_SIZE),
+                                                              instance_count, base_vertex, base_instance)
+            else:
+                self.instance_buffer.attach(base_instance)
+                glDrawElementsInstancedBaseVertex(GL_TRIANGLES, index_count, GL_UNSIGNED_INT,
+                                                  ctypes.c_void_p(first_index * INDEX_SIZE),
+                                                  instance_count, base_vertex)
+        self.instance_buffer.detach()
+        _profiler.count("draw_calls", count)
+
+    def _build(self, models):
+        self.batches = []
+        self.commands = np.zeros(0, dtype=DRAW_COMMAND)
+        owners, mesh_ids, material_ids = [], [], []
+        meshes, mesh_index = [], {}
+        materials, material_index = [], {}
+        #one entry per (model, mesh) pair, meshes and materials get ids in first seen order
+        for owner, model in enumerate(models):
+            for mesh in model.active_meshes:
+                mesh_id = mesh_index.get(mesh)
+                if mesh_id is None:
+                    mesh_id = mesh_index[mesh] = len(meshes)
+                    meshes.append(mesh)
+                #a batch shares textures, shininess and the vertex array its meshes live in
+                material = (mesh.allocation.VAO, float(model.shininess),
+                            tuple((texture.id, texture.type) for texture in mesh.textures))
+                material_id = material_index.get(material)
+                if material_id is None:
+                    material_id = material_index[material] = len(materials)
+                    materials.append((mesh, model))
+                owners.append(owner)
+                mesh_ids.append(mesh_id)
+                material_ids.append(material_id)
+        if not owners:
+            return
+
+        owners = np.array(owners)
+        mesh_ids = np.array(mesh_ids)
+        material_ids = np.array(material_ids)
+        order = np.lexsort((mesh_ids, material_ids))
+        owners, mesh_ids, material_ids = owners[order], mesh_ids[order], material_ids[order]
+
+        matrices = np.array([model.get_model_matrix() for model in models], dtype=np.float32)
+        colors = np.array([model.color for model in models], dtype=np.float32)
+        self.instance_buffer.update(matrices[owners], colors[owners])
+
+        #every run of the same material and mesh is one command over its instances
+        starts = np.flatnonzero(np.r_[True, (mesh_ids[1:] != mesh_ids[:-1]) | (material_ids[1:] != material_ids[:-1])])
+        run_meshes = mesh_ids[starts]
+        allocations = [mesh.allocation for mesh in meshes]
+        commands = np.zeros(len(starts), dtype=DRAW_COMMAND)
+        commands["count"] = np.array([allocation.index_count for allocation in allocations])[run_meshes]
+        commands["instanceCount"] = np.diff(np.r_[starts, len(owners)])
+        commands["firstIndex"] = np.array([allocation.index_offset for allocation in allocations])[run_meshes]
+        commands["baseVertex"] = np.array([allocation.vertex_offset for allocation in allocations])[run_meshes]
+        commands["baseInstance"] = starts
+        self.commands = commands
+        if self.multi_draw:
+            self._upload_commands(commands)
+
+        run_materials = material_ids[starts]
+        batch_starts = np.flatnonzero(np.r_[True, run_materials[1:] != run_materials[:-1]])
+        batch_counts = np.diff(np.r_[batch_starts, len(commands)])
+        for first, count in zip(batch_starts.tolist(), batch_counts.tolist()):
+            mesh, model = materials[run_materials[first]]
+            self.batches.append((first, count, mesh, model))
+
+    def _upload_commands(self, commands):
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+        if commands.nbytes > self._command_capacity:
+            self._command_capacity = max(commands.nbytes, self._command_capacity * 2, 256)
+        #orphan so the driver does not wait on last frames draws
+        glBufferData(GL_DRAW_INDIRECT_BUFFER, self._command_capacity, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_DRAW_INDIRECT_BUFFER, 0, commands.nbytes, commands.view(np.uint32))
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+
+    def delete(self):
+        self.instance_buffer.delete()
+        if self.command_buffer:
+            glDeleteBuffers(1, [self.command_buffer])
+        self.command_buffer = 0
+        self.batches = []
+        self._models = None
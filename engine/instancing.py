@@ -0,0 +1,71 @@
+from OpenGL.GL import *
+import numpy as np
+import ctypes
+
+#per instance data is a mat4 model matrix followed by a vec3 color
+INSTANCE_FLOATS = 16 + 3
+INSTANCE_STRIDE = INSTANCE_FLOATS * 4
+
+#mat4 attributes take four consecutive locations (3, 4, 5, 6)
+MODEL_MATRIX_LOCATION = 3
+COLOR_LOCATION = 7
+
+
+class InstanceBuffer:
+    def __init__(self, capacity=64):
+        self.VBO = glGenBuffers(1)
+        self.capacity = 0
+        self.count = 0
+        self.data = np.zeros((0, INSTANCE_FLOATS), dtype=np.float32)
+        self._reserve(capacity)
+
+    def _reserve(self, capacity):
+        capacity = max(capacity, self.capacity * 2)
+        data = np.zeros((capacity, INSTANCE_FLOATS), dtype=np.float32)
+        data[:self.count] = self.data[:self.count]
+        self.data = data
+        self.capacity = capacity
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferData(GL_ARRAY_BUFFER, self.capacity * INSTANCE_STRIDE, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    #points the instance attributes of the bound VAO at this buffer, instance 0 reads row first
+    def attach(self, first=0):
+        offset = first * INSTANCE_STRIDE
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        for i in range(4):
+            location = MODEL_MATRIX_LOCATION + i
+            glVertexAttribPointer(location, 4, GL_FLOAT, GL_FALSE, INSTANCE_STRIDE, ctypes.c_void_p(offset + i * 4 * 4))
+            glEnableVertexAttribArray(location)
+            glVertexAttribDivisor(location, 1)
+
+        glVertexAttribPointer(COLOR_LOCATION, 3, GL_FLOAT, GL_FALSE, INSTANCE_STRIDE, ctypes.c_void_p(offset + 16 * 4))
+        glEnableVertexAttribArray(COLOR_LOCATION)
+        glVertexAttribDivisor(COLOR_LOCATION, 1)
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    #turns the instance attributes of the bound VAO off again for plain draws
+    def detach(self):
+        for location in range(MODEL_MATRIX_LOCATION, COLOR_LOCATION + 1):
+            glDisableVertexAttribArray(location)
+
+    def update(self, matrices, colors):
+        count = len(matrices)
+        if count > self.capacity:
+            self._reserve(count)
+
+        self.data[:count, 0:16] = np.asarray(matrices, dtype=np.float32).reshape(count, 16)
+        self.data[:count, 16:19] = colors
+        self.count = count
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        #orphan the old storage so the driver does not wait on last frames draws
+        glBufferData(GL_ARRAY_BUFFER, self.capacity * INSTANCE_STRIDE, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, count * INSTANCE_STRIDE, self.data[:count])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        glDeleteBuffers(1, [self.VBO])
+        self.VBO = 0
@@ -1,12 +1,35 @@
 import numpy as np
 
+#std140 layout of the Lights uniform block in phong.frag, every member is a vec4.
+#Point and spot lights are not in the block, they live in the light cluster buffer textures
+DIR_LIGHT_FLOATS = 4 * 4
+
+DIR_LIGHT_OFFSET = 0
+#ivec4 lightCounts: local light count, has dir light
+LIGHT_COUNTS_OFFSET = DIR_LIGHT_OFFSET + DIR_LIGHT_FLOATS
+#ivec4 clusterSize: cluster grid x, y, z
+CLUSTER_SIZE_OFFSET = LIGHT_COUNTS_OFFSET + 4
+#vec4 clusterDepth: scale and bias turning log(view depth) into a depth slice
+CLUSTER_DEPTH_OFFSET = CLUSTER_SIZE_OFFSET + 4
+LIGHTS_BLOCK_FLOATS = CLUSTER_DEPTH_OFFSET + 4
+
+#texels per point or spot light in the light data buffer texture, see phong.frag
+LOCAL_LIGHT_TEXELS = 6
+#attenuated light below this fraction is treated as none when deriving light radii,
+#phong.frag fades every light to exactly zero at its radius
+LIGHT_CUTOFF = 1.0 / 256.0
+#stands in for the radius of lights without falloff
+UNBOUNDED_RADIUS = 1e6
+
+
 class Light:
     def __init__(self, ambient, diffuse, specular):
         self.ambient = ambient
         self.diffuse = diffuse
         self.specular = specular
 
-    def apply(self, shader, index):
+    #writes the light into its slice of the Lights block
+    def pack(self, data):
         pass
 
 #here comes the sun duh duh duh duh
@@ -15,34 +38,28 @@ class DirectionalLight(Light):
         super().__init__(ambient, diffuse, specular)
         self.direction = direction
 
-    def apply(self, shader, index):
-        shader.set_vec3(f"dirLight.direction", self.direction)
-        shader.set_vec3(f"dirLight.ambient", self.ambient)
-        shader.set_vec3(f"dirLight.diffuse", self.diffuse)
-        shader.set_vec3(f"dirLight.specular", self.specular)
+    def pack(self, data):
+        data[0:3] = self.direction
+        data[4:7] = self.ambient
+        data[8:11] = self.diffuse
+        data[12:15] = self.specular
 
-#point light implementation
+#point light implementation. radius limits which clusters the light reaches, by default
+#it is where the attenuation drops below LIGHT_CUTOFF
 class PointLight(Light):
-    def __init__(self, position, ambient, diffuse, specular, constant, linear, quadratic):
+    def __init__(self, position, ambient, diffuse, specular, constant, linear, quadratic, radius=None):
         super().__init__(ambient, diffuse, specular)
         self.position = position
         self.constant = constant
         self.linear = linear
         self.quadratic = quadratic
-
-    def apply(self, shader, index):
-        shader.set_vec3(f"pointLights[{index}].position", self.position)
-        shader.set_vec3(f"pointLights[{index}].ambient", self.ambient)
-        shader.set_vec3(f"pointLights[{index}].diffuse", self.diffuse)
-        shader.set_vec3(f"pointLights[{index}].specular", self.specular)
-        shader.set_float(f"pointLights[{index}].constant", self.constant)
-        shader.set_float(f"pointLights[{index}].linear", self.linear)
-        shader.set_float(f"pointLights[{index}].quadratic", self.quadratic)
+        self.radius = radius
 
 
+#cut_off and outer_cut_off are cosines of the cone angles
 class SpotLight(Light):
     def __init__(self, position, direction, ambient, diffuse, specular,
-                 constant, linear, quadratic, cut_off, outer_cut_off):
+                 constant, linear, quadratic, cut_off, outer_cut_off, radius=None):
         super().__init__(ambient, diffuse, specular)
         self.position = position
         self.direction = direction
@@ -51,15 +68,62 @@ class SpotLight(Light):
         self.quadratic = quadratic
         self.cut_off = cut_off
         self.outer_cut_off = outer_cut_off
+        self.radius = radius
+
+
+#distance at which 1 / (constant + linear * d + quadratic * d^2) times the brightest
+#channel falls below LIGHT_CUTOFF, UNBOUNDED_RADIUS when the light does not fall off
+def attenuation_radii(attenuation, intensity):
+    constant, linear, quadratic = attenuation.T
+    target = np.maximum(intensity / LIGHT_CUTOFF, constant)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        quadratic_root = (-linear + np.sqrt(linear * linear + 4.0 * quadratic * (target - constant))) / (2.0 * quadratic)
+        linear_root = (target - constant) / linear
+    radii = np.where(quadratic > 0.0, quadratic_root, np.where(linear > 0.0, linear_root, UNBOUNDED_RADIUS))
+    return np.minimum(radii, UNBOUNDED_RADIUS).astype(np.float32)
+
+
+def pack_lights_block(lights):
+    data = np.zeros(LIGHTS_BLOCK_FLOATS, dtype=np.float32)
+    has_dir_light = 0
+    local_light_count = 0
+
+    for light in lights:
+        if isinstance(light, (PointLight, SpotLight)):
+            local_light_count += 1
+        elif isinstance(light, DirectionalLight):
+            light.pack(data[DIR_LIGHT_OFFSET:DIR_LIGHT_OFFSET + DIR_LIGHT_FLOATS])
+            has_dir_light = 1
+
+    data[LIGHT_COUNTS_OFFSET:LIGHT_COUNTS_OFFSET + 4].view(np.int32)[:] = (local_light_count, has_dir_light, 0, 0)
+    return data
+
+
+#point and spot lights as (count, LOCAL_LIGHT_TEXELS, 4) rows of the light data texture:
+#position + radius, direction + is spot, ambient + cutOff, diffuse + outerCutOff,
+#specular, attenuation. Filled a field at a time so hundreds of lights stay cheap
+def pack_local_lights(lights):
+    data = np.zeros((len(lights), LOCAL_LIGHT_TEXELS, 4), dtype=np.float32)
+    if not lights:
+        return data
+    data[:, 0, 0:3] = [light.position for light in lights]
+    data[:, 2, 0:3] = [light.ambient for light in lights]
+    data[:, 3, 0:3] = [light.diffuse for light in lights]
+    data[:, 4, 0:3] = [light.specular for light in lights]
+    data[:, 5, 0:3] = [(light.constant, light.linear, light.quadratic) for light in lights]
+
+    spots = np.array([isinstance(light, SpotLight) for light in lights])
+    if spots.any():
+        spot_lights = [light for light in lights if isinstance(light, SpotLight)]
+        directions = np.array([light.direction for light in spot_lights], dtype=np.float32)
+        data[spots, 1, 0:3] = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        data[spots, 1, 3] = 1.0
+        data[spots, 2, 3] = [light.cut_off for light in spot_lights]
+        data[spots, 3, 3] = [light.outer_cut_off for light in spot_lights]
 
-    def apply(self, shader, index):
-        shader.set_vec3(f"spotLight.position", self.position)
-        shader.set_vec3(f"spotLight.direction", self.direction)
-        shader.set_vec3(f"spotLight.ambient", self.ambient)
-        shader.set_vec3(f"spotLight.diffuse", self.diffuse)
-        shader.set_vec3(f"spotLight.specular", self.specular)
-        shader.set_float(f"spotLight.constant", self.constant)
-        shader.set_float(f"spotLight.linear", self.linear)
-        shader.set_float(f"spotLight.quadratic", self.quadratic)
-        shader.set_float(f"spotLight.cutOff", self.cut_off)
-        shader.set_float(f"spotLight.outerCutOff", self.outer_cut_off)
\ No newline at end of file
+    radii = attenuation_radii(data[:, 5, 0:3], data[:, 2:5, 0:3].max(axis=(1, 2)))
+    explicit = np.array([light.radius is not None for light in lights])
+    if explicit.any():
+        radii[explicit] = [light.radius for light in lights if light.radius is not None]
+    data[:, 0, 3] = radii
+    return data
\ No newline at end of file
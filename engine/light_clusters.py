@@ -0,0 +1,163 @@
+from OpenGL.GL import *
+import numpy as np
+from . import gl_state
+from .light import CLUSTER_DEPTH_OFFSET, CLUSTER_SIZE_OFFSET, PointLight, SpotLight, pack_local_lights
+
+#screen tiles across and down, then exponential depth slices between the near and far plane
+CLUSTER_GRID = (16, 9, 24)
+#texture units the light buffer textures stay bound to, every shader that samples them
+#gets its sampler uniforms pointed here when it is linked
+LIGHT_TEXTURE_UNITS = {
+    "lightData": 13,
+    "clusterLights": 14,
+    "lightIndices": 15,
+}
+
+
+#a buffer object seen by shaders as a samplerBuffer
+class TextureBuffer:
+    def __init__(self, internal_format):
+        self.internal_format = internal_format
+        self.buffer = glGenBuffers(1)
+        self.texture = glGenTextures(1)
+        self.capacity = 0
+
+    def update(self, data):
+        data = np.ascontiguousarray(data)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffer)
+        if data.nbytes > self.capacity:
+            self.capacity = max(data.nbytes, self.capacity * 2, 256)
+            glBufferData(GL_TEXTURE_BUFFER, self.capacity, None, GL_STREAM_DRAW)
+            gl_state.bind_texture(self.texture, GL_TEXTURE_BUFFER)
+            glTexBuffer(GL_TEXTURE_BUFFER, self.internal_format, self.buffer)
+        else:
+            #orphan so the driver does not wait on last frames draws
+            glBufferData(GL_TEXTURE_BUFFER, self.capacity, None, GL_STREAM_DRAW)
+        if data.nbytes:
+            glBufferSubData(GL_TEXTURE_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def bind(self, unit):
+        gl_state.bind_texture(self.texture, GL_TEXTURE_BUFFER, unit)
+
+    def delete(self):
+        gl_state.delete_textures([self.texture])
+        glDeleteBuffers(1, [self.buffer])
+        self.texture = self.buffer = 0
+
+
+#spheres around the lights, spot lights get the tighter sphere around their cone
+def light_bounds(data):
+    centers = data[:, 0, 0:3].astype(np.float64)
+    radii = data[:, 0, 3].astype(np.float64)
+    spots = data[:, 1, 3] != 0.0
+    if spots.any():
+        cos_outer = np.clip(data[spots, 3, 3], -1.0, 1.0).astype(np.float64)
+        reach = radii[spots]
+        #up to 45 degrees the sphere through the apex and the cap rim is smallest,
+        #wider cones are bounded by the sphere around the cap, past 90 degrees nothing beats the full sphere
+        narrow = cos_outer >= np.sqrt(0.5)
+        with np.errstate(divide="ignore"):
+            narrow_radius = reach / (2.0 * cos_outer)
+        sphere_radius = np.where(narrow, narrow_radius,
+                                 np.where(cos_outer > 0.0, reach * np.sqrt(1.0 - cos_outer ** 2), reach))
+        offset = np.where(narrow, narrow_radius, np.where(cos_outer > 0.0, reach * cos_outer, 0.0))
+        centers[spots] += data[spots, 1, 0:3] * offset[:, np.newaxis]
+        radii[spots] = sphere_radius
+    return centers, radii
+
+
+#Clustered forward lighting: point and spot lights are binned on the CPU into a
+#view space grid of screen tiles and depth slices. Each cluster stores an offset
+#and count into a shared list of light indices. The fragment shader finds its
+#cluster and only shades the lights listed there.
+class LightClusters:
+    def __init__(self, grid=CLUSTER_GRID):
+        self.grid = tuple(grid)
+        self.light_data = TextureBuffer(GL_RGBA32F)
+        self.cluster_lights = TextureBuffer(GL_RG32UI)
+        self.light_indices = TextureBuffer(GL_R32UI)
+        #the packed lights as uploaded to light_data
+        self.data = pack_local_lights([])
+        self.light_count = 0
+        self.index_count = 0
+
+    #fills the cluster fields of the Lights block data. Without a projection every
+    #light goes into a single cluster
+    def update(self, lights, block, view=None, projection=None, near=0.1, far=100.0):
+        lights = [light for light in lights if isinstance(light, (PointLight, SpotLight))]
+        data = pack_local_lights(lights)
+        if projection is None:
+            grid = (1, 1, 1)
+            counts = np.array([len(data)])
+            indices = np.arange(len(data))
+        else:
+            grid = self.grid
+            counts, indices = self.assign(data, view, projection, near, far)
+
+        cluster_lights = np.empty((len(counts), 2), dtype=np.uint32)
+        cluster_lights[:, 0] = np.cumsum(counts) - counts
+        cluster_lights[:, 1] = counts
+        self.data = data
+        self.light_data.update(data)
+        self.cluster_lights.update(cluster_lights)
+        self.light_indices.update(indices.astype(np.uint32))
+        self.light_count = len(data)
+        self.index_count = len(indices)
+
+        depth_scale = grid[2] / np.log(far / near)
+        block[CLUSTER_SIZE_OFFSET:CLUSTER_SIZE_OFFSET + 4].view(np.int32)[:] = (*grid, 0)
+        block[CLUSTER_DEPTH_OFFSET:CLUSTER_DEPTH_OFFSET + 4] = (depth_scale, -np.log(near) * depth_scale, 0.0, 0.0)
+
+    #returns the light count of every cluster and their light indices, grouped by cluster.
+    #Each depth slice bounds the part of a light's sphere inside it by a view space box,
+    #which becomes a tile rectangle; the per slice x and y tile masks of all lights are
+    #combined into one cluster x light mask whose set entries come out in cluster order
+    def assign(self, data, view, projection, near, far):
+        tiles_x, tiles_y, slices = self.grid
+        centers, radii = light_bounds(data)
+        #pyrr matrices are row vector, so points multiply from the left
+        view = np.asarray(view, dtype=np.float64)
+        projection = np.asarray(projection, dtype=np.float64)
+        centers = centers @ view[0:3, 0:3] + view[3, 0:3]
+        depth = -centers[:, 2]
+
+        #(slices, lights) depth range of the sphere inside each slice
+        edges = near * (far / near) ** (np.arange(slices + 1) / slices)
+        low_depth = np.maximum(edges[:-1, np.newaxis], depth - radii)
+        high_depth = np.minimum(edges[1:, np.newaxis], depth + radii)
+        inside = low_depth < high_depth
+        #widest cross section of the sphere within that range
+        offset = np.clip(depth, low_depth, high_depth) - depth
+        section = np.sqrt(np.maximum(radii * radii - offset * offset, 0.0))
+
+        #a perspective projection maps x to P00 * x / depth - P20, so the box edges are
+        #extreme at its near or far face and the tile range follows from four divisions
+        masks = []
+        for axis, tiles in enumerate((tiles_x, tiles_y)):
+            lower = centers[:, axis] - section
+            upper = centers[:, axis] + section
+            scale, shift = projection[axis, axis], projection[2, axis]
+            low = np.minimum(lower / low_depth, lower / high_depth) * scale - shift
+            high = np.maximum(upper / low_depth, upper / high_depth) * scale - shift
+            inside &= (high > -1.0) & (low < 1.0)
+            first = np.floor((low + 1.0) * 0.5 * tiles)
+            last = np.floor((high + 1.0) * 0.5 * tiles)
+            cells = np.arange(tiles)[np.newaxis, :, np.newaxis]
+            masks.append((cells >= first[:, np.newaxis, :]) & (cells <= last[:, np.newaxis, :]))
+        mask_x, mask_y = masks
+        mask_x &= inside[:, np.newaxis, :]
+        clusters = mask_y[:, :, np.newaxis, :] & mask_x[:, np.newaxis, :, :]
+        clusters = clusters.reshape(slices * tiles_y * tiles_x, len(depth))
+        return clusters.view(np.uint8).sum(axis=1, dtype=np.int64), np.flatnonzero(clusters) % len(depth)
+
+    def bind(self):
+        self.light_data.bind(LIGHT_TEXTURE_UNITS["lightData"])
+        self.cluster_lights.bind(LIGHT_TEXTURE_UNITS["clusterLights"])
+        self.light_indices.bind(LIGHT_TEXTURE_UNITS["lightIndices"])
+        gl_state.active_texture(0)
+
+    def delete(self):
+        self.light_data.delete()
+        self.cluster_lights.delete()
+        self.light_indices.delete()
\ No newline at end of file
@@ -1,15 +1,21 @@
 from OpenGL.GL import *
 import numpy as np
 import open3d as o3d
-import ctypes
+from . import gl_state
+from .buffer_arena import VERTEX_FLOATS, get_buffer_arena
+from .profiler import get_profiler
+from .streaming_buffer import StreamingGeometry
+
+_profiler = get_profiler()
 
 
 class Mesh:
-    def __init__(self, o3d_mesh=None, vertices=None, indices=None, textures=None):
+    #dynamic meshes get their own streaming buffers for geometry updated every frame
+    def __init__(self, o3d_mesh=None, vertices=None, indices=None, textures=None, dynamic=False):
         self.textures = textures if textures else []
-        self.VAO = glGenVertexArrays(1)
-        self.VBO = glGenBuffers(1)
-        self.EBO = glGenBuffers(1)
+        self.dynamic = dynamic
+        #vertices and indices live in a range of the shared buffer arena
+        self.allocation = None
 
         #if we use a mesh from open3d we should use vertices and indices
 
@@ -22,53 +28,144 @@ class Mesh:
             raise ValueError("Either an Open3D mesh or vertices and indices must be provided")
 
     def _init_from_open3d(self, o3d_mesh):
+        vertex_data, indices = Mesh.arrays_from_open3d(o3d_mesh)
+        self._init_from_arrays(vertex_data, indices)
+
+        self.o3d_mesh = o3d_mesh
+
+    #interleaved float32 vertex data (position, normal, uv) and uint32 indices
+    @staticmethod
+    def arrays_from_open3d(o3d_mesh):
         if not o3d_mesh.has_vertex_normals():
             o3d_mesh.compute_vertex_normals()
         vertices = np.asarray(o3d_mesh.vertices)
         normals = np.asarray(o3d_mesh.vertex_normals)
-
-        if o3d_mesh.has_triangle_uvs():
-            uvs = np.asarray(o3d_mesh.triangle_uvs)
-            #this is only some workaround though, still need to implement this right
-            if len(uvs) > 0:
-                tex_coords = np.zeros((len(vertices), 2), dtype=np.float32)
-                for i, triangle in enumerate(o3d_mesh.triangles):
-                    for j in range(3):
-                        tex_coords[triangle[j]] = uvs[i * 3 + j]
-            else:
-                tex_coords = np.zeros((len(vertices), 2), dtype=np.float32)
-        else:
-            tex_coords = np.zeros((len(vertices), 2), dtype=np.float32)
-        vertex_data = np.zeros((len(vertices), 8), dtype=np.float32)
-        vertex_data[:, 0:3] = vertices
-        vertex_data[:, 3:6] = normals
-        vertex_data[:, 6:8] = tex_coords
-
-        indices = np.asarray(o3d_mesh.triangles).flatten()
-
-        self._init_from_arrays(vertex_data, indices)
-
-        self.o3d_mesh = o3d_mesh
+        triangles = np.asarray(o3d_mesh.triangles).reshape(-1)
+        uvs = np.asarray(o3d_mesh.triangle_uvs) if o3d_mesh.has_triangle_uvs() else np.zeros((0, 2))
+
+        if len(uvs) == 0 or len(uvs) != len(triangles):
+            vertex_data = np.zeros((len(vertices), 8), dtype=np.float32)
+            vertex_data[:, 0:3] = vertices
+            vertex_data[:, 3:6] = normals
+            return vertex_data, triangles.astype(np.uint32)
+
+        vertex_ids, corner_ids, indices = Mesh._split_uv_seams(triangles, uvs)
+        vertex_data = np.empty((len(vertex_ids), 8), dtype=np.float32)
+        vertex_data[:, 0:3] = vertices[vertex_ids]
+        vertex_data[:, 3:6] = normals[vertex_ids]
+        vertex_data[:, 6:8] = uvs[corner_ids]
+        return vertex_data, indices
+
+    #uvs are stored per triangle corner, a vertex is only duplicated where its
+    #corners disagree on the uv (a seam), position and normal come with the vertex index
+    @staticmethod
+    def _split_uv_seams(triangles, uvs):
+        #adding 0.0 folds -0.0 into 0.0 so both get the same bits
+        uvs = np.ascontiguousarray(np.asarray(uvs, dtype=np.float32) + np.float32(0.0))
+        _, uv_ids = np.unique(uvs.view(np.uint64).reshape(-1), return_inverse=True)
+        #one integer key per (vertex, uv) pair keeps the sort on plain uint64
+        keys = triangles.astype(np.uint64) * np.uint64(uv_ids.max() + 1) + uv_ids.reshape(-1).astype(np.uint64)
+
+        _, first_corner, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        #number the new vertices in order of first use to keep the original layout close
+        order = np.argsort(first_corner)
+        remap = np.empty(len(order), dtype=np.uint32)
+        remap[order] = np.arange(len(order), dtype=np.uint32)
+
+        corner_ids = first_corner[order]
+        return triangles[corner_ids], corner_ids, remap[inverse.reshape(-1)]
+
+    #meshes loaded from arrays or the mesh cache have no Open3D mesh until asked for one
+    def to_open3d(self):
+        if getattr(self, "o3d_mesh", None) is None:
+            vertex_data = np.asarray(self.vertices, dtype=np.float64).reshape(-1, 8)
+            o3d_mesh = o3d.geometry.TriangleMesh()
+            o3d_mesh.vertices = o3d.utility.Vector3dVector(vertex_data[:, 0:3])
+            o3d_mesh.vertex_normals = o3d.utility.Vector3dVector(vertex_data[:, 3:6])
+            o3d_mesh.triangles = o3d.utility.Vector3iVector(np.asarray(self.indices, dtype=np.int32).reshape(-1, 3))
+            self.o3d_mesh = o3d_mesh
+        return self.o3d_mesh
 
     def _init_from_arrays(self, vertices, indices):
         self.vertices = vertices
         self.indices = indices
-        glBindVertexArray(self.VAO)
-        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
-        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_STATIC_DRAW)
-
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices.nbytes, self.indices, GL_STATIC_DRAW)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 8 * 4, ctypes.c_void_p(0))
-        glEnableVertexAttribArray(0)
-
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 8 * 4, ctypes.c_void_p(3 * 4))
-        glEnableVertexAttribArray(1)
-
-        glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, 8 * 4, ctypes.c_void_p(6 * 4))
-        glEnableVertexAttribArray(2)
+        self._compute_bounds()
+        if self.dynamic:
+            self._make_writable()
+            self.allocation = StreamingGeometry(self.vertices, self.indices)
+        else:
+            self.allocation = get_buffer_arena().allocate(self.vertices, self.indices)
+
+    #every mesh with the same vertex layout shares the arenas VAO
+    @property
+    def VAO(self):
+        return self.allocation.VAO
+
+    #updates keep their own cpu copy, memory mapped or borrowed arrays are copied once
+    def _make_writable(self):
+        self.vertices = np.array(self.vertices, dtype=np.float32).reshape(-1, VERTEX_FLOATS)
+        self.indices = np.array(self.indices, dtype=np.uint32).reshape(-1)
+
+    #rewrites vertices and / or indices starting at the given offsets in place, the
+    #ranges must fit in the current mesh, use set_data to change the counts.
+    #Indices are local to the mesh, the owning Model needs update_bounds() afterwards
+    def update(self, vertices=None, indices=None, vertex_start=0, index_start=0):
+        if not isinstance(self.vertices, np.ndarray) or self.vertices.ndim != 2 or not self.vertices.flags.writeable:
+            self._make_writable()
+        vertex_range = index_range = (0, 0)
+        if vertices is not None:
+            vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, VERTEX_FLOATS)
+            vertex_range = (vertex_start, vertex_start + len(vertices))
+            if vertex_start < 0 or vertex_range[1] > len(self.vertices):
+                raise ValueError("Vertex range is outside the mesh, use set_data to resize it")
+            self.vertices[vertex_start:vertex_range[1]] = vertices
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.uint32).reshape(-1)
+            index_range = (index_start, index_start + len(indices))
+            if index_start < 0 or index_range[1] > len(self.indices):
+                raise ValueError("Index range is outside the mesh, use set_data to resize it")
+            self.indices[index_start:index_range[1]] = indices
+
+        if self.dynamic:
+            self.allocation.update(self.vertices, self.indices, vertex_range, index_range)
+        else:
+            self.allocation.arena.write(self.allocation, vertices, indices, vertex_start, index_start)
+        if vertices is not None:
+            self._compute_bounds()
+            self.o3d_mesh = None
 
-        glBindVertexArray(0)
+    #replaces all geometry, the vertex and index counts may change
+    def set_data(self, vertices, indices):
+        self.vertices = vertices
+        self.indices = indices
+        self._compute_bounds()
+        self.o3d_mesh = None
+        if self.dynamic:
+            self._make_writable()
+            self.allocation.update(self.vertices, self.indices)
+        else:
+            self.allocation.release()
+            self.allocation = get_buffer_arena().allocate(self.vertices, self.indices)
+
+    #gives the buffer range back to the arena and shared textures back to their manager
+    def delete(self):
+        if self.allocation is not None:
+            self.allocation.release()
+            self.allocation = None
+        for texture in self.textures:
+            if texture.manager is not None:
+                texture.manager.release(texture)
+        self.textures = []
+
+    #axis aligned box and bounding sphere in local space, used for culling
+    def _compute_bounds(self):
+        positions = np.asarray(self.vertices, dtype=np.float32).reshape(-1, 8)[:, 0:3]
+        if len(positions) == 0:
+            positions = np.zeros((1, 3), dtype=np.float32)
+        self.bounds_min = positions.min(axis=0)
+        self.bounds_max = positions.max(axis=0)
+        self.bounding_center = (self.bounds_min + self.bounds_max) * 0.5
+        self.bounding_radius = float(np.sqrt(((positions - self.bounding_center) ** 2).sum(axis=1).max()))
 
     @staticmethod
     def create_box(width=1.0, height=1.0, depth=1.0):
@@ -103,12 +200,11 @@ class Mesh:
         torus.compute_vertex_normals()
         return Mesh(o3d_mesh=torus)
 
-    def draw(self, shader):
+    def _bind_textures(self, shader):
         diffuse_nr = 1
         specular_nr = 1
 
         for i, texture in enumerate(self.textures):
-            glActiveTexture(GL_TEXTURE0 + i)
             number = ""
             name = texture.type
             if name == "texture_diffuse":
@@ -120,9 +216,33 @@ class Mesh:
 
             shader.set_int(f"material.{name}{number}", i)
 
-            glBindTexture(GL_TEXTURE_2D, texture.id)
+            gl_state.bind_texture(texture.id, unit=i)
 
-        glBindVertexArray(self.VAO)
-        glDrawElements(GL_TRIANGLES, len(self.indices), GL_UNSIGNED_INT, None)
-        glBindVertexArray(0)
-        glActiveTexture(GL_TEXTURE0)
\ No newline at end of file
+    def draw(self, shader):
+        self._bind_textures(shader)
+
+        allocation = self.allocation
+        allocation.bind()
+        glDrawElementsBaseVertex(GL_TRIANGLES, allocation.index_count, GL_UNSIGNED_INT,
+                                 allocation.index_pointer, allocation.vertex_offset)
+        gl_state.active_texture(0)
+        _profiler.count("draw_calls")
+        _profiler.count("triangles", allocation.index_count // 3)
+
+    #one draw call for every instance stored in the instance buffer
+    def draw_instanced(self, shader, instance_buffer):
+        if instance_buffer.count == 0:
+            return
+        self._bind_textures(shader)
+
+        allocation = self.allocation
+        allocation.bind()
+        #the VAO is shared, so the instance attributes are only pointed at this buffer for the draw
+        instance_buffer.attach()
+        glDrawElementsInstancedBaseVertex(GL_TRIANGLES, allocation.index_count, GL_UNSIGNED_INT,
+                                          allocation.index_pointer, instance_buffer.count, allocation.vertex_offset)
+        instance_buffer.detach()
+        gl_state.active_texture(0)
+        _profiler.count("draw_calls")
+        _profiler.count("instances", instance_buffer.count)
+        _profiler.count("triangles", allocation.index_count // 3 * instance_buffer.count)
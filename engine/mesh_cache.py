@@ -0,0 +1,77 @@
+import hashlib
+import os
+import numpy as np
+import open3d as o3d
+from .mesh import Mesh
+
+#bump when the cached vertex layout or the way it is built changes
+CACHE_VERSION = b"2"
+
+_cache_dir = os.environ.get(
+    "PYRENDERENGINE_MESH_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "pyrenderengine", "meshes"))
+
+
+def set_cache_dir(path):
+    global _cache_dir
+    _cache_dir = path
+
+
+def get_cache_dir():
+    return _cache_dir
+
+
+def get_cache_key(path):
+    digest = hashlib.sha1(CACHE_VERSION)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_paths(key):
+    return (os.path.join(_cache_dir, key + ".vertices.npy"),
+            os.path.join(_cache_dir, key + ".indices.npy"))
+
+
+#returns memory mapped (vertices, indices) or None on a cache miss
+def load_cached_mesh_data(key):
+    vertices_path, indices_path = _cache_paths(key)
+    if not (os.path.exists(vertices_path) and os.path.exists(indices_path)):
+        return None
+    try:
+        vertices = np.load(vertices_path, mmap_mode="r")
+        indices = np.load(indices_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if vertices.dtype != np.float32 or vertices.ndim != 2 or vertices.shape[1] != 8 or indices.dtype != np.uint32:
+        return None
+    return vertices, indices
+
+
+def save_mesh_data(key, vertices, indices):
+    os.makedirs(_cache_dir, exist_ok=True)
+    for path, data in zip(_cache_paths(key), (vertices, indices)):
+        #write next to the target and rename so a crash never leaves half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.save(file, data)
+        os.replace(temp_path, path)
+
+
+#parses the file with Open3D only on a cache miss, warm starts just map the arrays
+def load_mesh_data(path):
+    key = get_cache_key(path)
+    cached = load_cached_mesh_data(key)
+    if cached is not None:
+        return cached
+
+    o3d_mesh = o3d.io.read_triangle_mesh(path)
+    if not o3d_mesh.has_vertex_normals():
+        o3d_mesh.compute_vertex_normals()
+    vertices, indices = Mesh.arrays_from_open3d(o3d_mesh)
+    try:
+        save_mesh_data(key, vertices, indices)
+    except OSError:
+        pass
+    return vertices, indices
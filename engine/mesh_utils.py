@@ -16,16 +16,17 @@ def mesh_from_point(points, normals=None, colors=None):
     return Mesh(o3d_mesh=mesh)
 
 
+def _as_open3d(mesh):
+    if isinstance(mesh, Mesh):
+        return mesh.to_open3d()
+    return mesh
+
+
 def merge_meshes(meshes):
     if not meshes:
         return None
 
-    o3d_meshes = []
-    for mesh in meshes:
-        if hasattr(mesh, 'o3d_mesh'):
-            o3d_meshes.append(mesh.o3d_mesh)
-        else:
-            o3d_meshes.append(mesh)
+    o3d_meshes = [_as_open3d(mesh) for mesh in meshes]
 
     merged_mesh = o3d_meshes[0]
     for mesh in o3d_meshes[1:]:
@@ -35,11 +36,30 @@ def merge_meshes(meshes):
 
     return Mesh(o3d_mesh=merged_mesh)
 
+#merges meshes into one vertex and index array with every mesh moved into world
+#space by its model matrix, nothing goes through Open3D
+def bake_meshes(meshes, matrices):
+    counts = [len(mesh.vertices) for mesh in meshes]
+    offsets = np.cumsum([0] + counts)
+    vertices = np.empty((offsets[-1], 8), dtype=np.float32)
+    indices = []
+
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    #normals go through the inverse transpose, pinv keeps zero scale from raising
+    normal_matrices = np.linalg.pinv(matrices[:, 0:3, 0:3]).transpose(0, 2, 1)
+    for mesh, matrix, normal_matrix, start, end in zip(meshes, matrices, normal_matrices, offsets, offsets[1:]):
+        source = np.asarray(mesh.vertices, dtype=np.float32).reshape(-1, 8)
+        vertices[start:end, 0:3] = source[:, 0:3] @ matrix[0:3, 0:3] + matrix[3, 0:3]
+        normals = source[:, 3:6] @ normal_matrix
+        vertices[start:end, 3:6] = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+        vertices[start:end, 6:8] = source[:, 6:8]
+        indices.append(np.asarray(mesh.indices, dtype=np.uint32).reshape(-1) + np.uint32(start))
+
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.uint32)
+    return Mesh(vertices=vertices, indices=indices)
+
 def subdivide_mesh(mesh, iterations=1):
-    if hasattr(mesh, 'o3d_mesh'):
-        o3d_mesh = mesh.o3d_mesh
-    else:
-        o3d_mesh = mesh
+    o3d_mesh = _as_open3d(mesh)
     subdivided_mesh = o3d_mesh.subdivide_midpoint(number_of_iterations=iterations)
 
     if not subdivided_mesh.has_vertex_normals():
@@ -48,10 +68,7 @@ def subdivide_mesh(mesh, iterations=1):
 
 #basically decimate
 def simplify_mesh(mesh, target_triangles):
-    if hasattr(mesh, 'o3d_mesh'):
-        o3d_mesh = mesh.o3d_mesh
-    else:
-        o3d_mesh = mesh
+    o3d_mesh = _as_open3d(mesh)
 
     simplified_mesh = o3d_mesh.simplify_quadric_decimation(target_number_of_triangles=target_triangles)
 
@@ -60,32 +77,80 @@ def simplify_mesh(mesh, target_triangles):
 
     return Mesh(o3d_mesh=simplified_mesh)
 
-def create_terrain(width, length, height_function, resolution=100):
-    x = np.linspace(-width / 2, width / 2, resolution)
-    z = np.linspace(-length / 2, length / 2, resolution)
+#calls the height function on whole coordinate grids, scalar only functions
+#(math.sin and friends) still work through np.vectorize
+def sample_heights(height_function, X, Z):
+    try:
+        heights = np.asarray(height_function(X, Z), dtype=np.float64)
+    except (TypeError, ValueError):
+        heights = np.vectorize(height_function, otypes=[np.float64])(X, Z)
+    return np.broadcast_to(heights, X.shape)
+
+#bilinear height function over a heightmap covering [-width / 2, width / 2] x [-length / 2, length / 2],
+#rows of the heightmap run along z and columns along x
+def heightmap_function(heightmap, width, length):
+    heightmap = np.asarray(heightmap, dtype=np.float64)
+    rows, cols = heightmap.shape
+
+    def height_function(x, z):
+        u = np.clip((np.asarray(x) / width + 0.5) * (cols - 1), 0, cols - 1)
+        v = np.clip((np.asarray(z) / length + 0.5) * (rows - 1), 0, rows - 1)
+        u0 = np.minimum(u.astype(np.int64), cols - 2) if cols > 1 else np.zeros_like(u, dtype=np.int64)
+        v0 = np.minimum(v.astype(np.int64), rows - 2) if rows > 1 else np.zeros_like(v, dtype=np.int64)
+        u1 = np.minimum(u0 + 1, cols - 1)
+        v1 = np.minimum(v0 + 1, rows - 1)
+        fu = u - u0
+        fv = v - v0
+        top = heightmap[v0, u0] * (1 - fu) + heightmap[v0, u1] * fu
+        bottom = heightmap[v1, u0] * (1 - fu) + heightmap[v1, u1] * fu
+        return top * (1 - fv) + bottom * fv
+
+    return height_function
+
+#interleaved vertices and indices of a regular grid. heights has one extra sample on
+#every side so normals come from central differences, also across tile borders
+def grid_arrays(x, z, heights, uv_origin=(0.0, 0.0), uv_size=(1.0, 1.0)):
+    cols, rows = len(x), len(z)
+    dx = (x[-1] - x[0]) / (cols - 1)
+    dz = (z[-1] - z[0]) / (rows - 1)
+    inner = heights[1:-1, 1:-1]
+    dh_dx = (heights[1:-1, 2:] - heights[1:-1, :-2]) / (2.0 * dx)
+    dh_dz = (heights[2:, 1:-1] - heights[:-2, 1:-1]) / (2.0 * dz)
+
     X, Z = np.meshgrid(x, z)
-    Y = np.zeros_like(X)
-    for i in range(resolution):
-        for j in range(resolution):
-            Y[i, j] = height_function(X[i, j], Z[i, j])
-    vertices = []
-    for i in range(resolution):
-        for j in range(resolution):
-            vertices.append([X[i, j], Y[i, j], Z[i, j]])
-    triangles = []
-    for i in range(resolution - 1):
-        for j in range(resolution - 1):
-            idx1 = i * resolution + j
-            idx2 = i * resolution + (j + 1)
-            idx3 = (i + 1) * resolution + j
-            idx4 = (i + 1) * resolution + (j + 1)
-
-            triangles.append([idx1, idx2, idx3])
-            triangles.append([idx2, idx4, idx3])
-
-    o3d_mesh = o3d.geometry.TriangleMesh()
-    o3d_mesh.vertices = o3d.utility.Vector3dVector(vertices)
-    o3d_mesh.triangles = o3d.utility.Vector3iVector(triangles)
-    o3d_mesh.compute_vertex_normals()
-
-    return Mesh(o3d_mesh=o3d_mesh)
\ No newline at end of file
+    vertices = np.empty((rows, cols, 8), dtype=np.float32)
+    vertices[..., 0] = X
+    vertices[..., 1] = inner
+    vertices[..., 2] = Z
+    normals = np.stack([-dh_dx, np.ones_like(dh_dx), -dh_dz], axis=-1)
+    vertices[..., 3:6] = normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+    vertices[..., 6] = (X - uv_origin[0]) / uv_size[0]
+    vertices[..., 7] = (Z - uv_origin[1]) / uv_size[1]
+
+    #two counter clockwise triangles per cell, seen from above
+    corner = (np.arange(rows - 1)[:, np.newaxis] * cols + np.arange(cols - 1)).reshape(-1).astype(np.uint32)
+    below = corner + np.uint32(cols)
+    indices = np.stack([corner, below, corner + 1, corner + 1, below, below + 1], axis=1)
+    return vertices.reshape(-1, 8), indices.reshape(-1)
+
+#height_function is called on whole coordinate arrays, or is a 2d heightmap array
+#whose shape sets the grid resolution (rows along z)
+def create_terrain(width, length, height_function, resolution=100):
+    if callable(height_function):
+        rows = cols = resolution
+        x = np.linspace(-width / 2, width / 2, cols)
+        z = np.linspace(-length / 2, length / 2, rows)
+        #sample one step past the edges for the normals
+        x_outer = np.concatenate([[2 * x[0] - x[1]], x, [2 * x[-1] - x[-2]]])
+        z_outer = np.concatenate([[2 * z[0] - z[1]], z, [2 * z[-1] - z[-2]]])
+        heights = sample_heights(height_function, *np.meshgrid(x_outer, z_outer))
+    else:
+        heightmap = np.asarray(height_function, dtype=np.float64)
+        rows, cols = heightmap.shape
+        x = np.linspace(-width / 2, width / 2, cols)
+        z = np.linspace(-length / 2, length / 2, rows)
+        #linear extrapolation, gives one sided differences at the border
+        heights = np.pad(heightmap, 1, mode="reflect", reflect_type="odd")
+
+    vertices, indices = grid_arrays(x, z, heights, (-width / 2, -length / 2), (width, length))
+    return Mesh(vertices=vertices, indices=indices)
\ No newline at end of file
@@ -1,44 +1,56 @@
 import numpy as np
-import pyrr
-import open3d as o3d
 from .mesh import Mesh
 import os
 from .obj_loader import load_obj
+from .mesh_cache import load_mesh_data
+from .mesh_utils import simplify_mesh
+from .transform import TRANSFORM_SIZE, compose_model_matrices, transform_bounds
 
 
 class Model:
-    def __init__(self, path=None, mesh=None):
+    #meshes=[] gives an empty model, the async loader fills it in later
+    def __init__(self, path=None, mesh=None, meshes=None):
         self.meshes = []
-        self.textures_loaded = {}
-        self.position = np.array([0.0, 0.0, 0.0])
-        self.rotation = np.array([0.0, 0.0, 0.0])
-        self.scale = np.array([1.0, 1.0, 1.0])
+        #level of detail chain, lods[0] is self.meshes and active_meshes is what gets drawn
+        self.lods = []
+        self.lod_screen_sizes = ()
+        self.lod_level = 0
+        self.active_meshes = self.meshes
+        self.loaded = True
+        self.load_error = None
+        #position, rotation and scale live in one compact array, the composed
+        #matrix is cached and only rebuilt when one of them actually changes
+        self.transform = np.zeros(TRANSFORM_SIZE, dtype=np.float32)
+        self.transform[6:9] = 1.0
+        self.model_matrix = np.identity(4, dtype=np.float32)
+        self.dirty = True
         self.color = np.array([0.8, 0.8, 0.8])
         self.shininess = 32.0
+        #below 1.0 the model is drawn blended and sorted back to front, after everything opaque
+        self.opacity = 1.0
+        #static models are baked into the scenes world space batches instead of drawn one by one
+        self.static = False
+        #set by the material setters, the scene rebakes the batch of a static model when it is
+        self.material_dirty = False
 
         if path:
             self._load_model(path)
         elif mesh:
             self.meshes.append(mesh)
+        elif meshes is not None:
+            self.meshes.extend(meshes)
         else:
             self._create_cube()
+        self.update_bounds()
 
     def _load_model(self, path):
         directory = os.path.dirname(path)
         if path.lower().endswith('.obj'):
             mesh = load_obj(path, directory)
             self.meshes.append(mesh)
-        elif path.lower().endswith('.ply'):
-            o3d_mesh = o3d.io.read_triangle_mesh(path)
-            if not o3d_mesh.has_vertex_normals():
-                o3d_mesh.compute_vertex_normals()
-            mesh = Mesh(o3d_mesh=o3d_mesh)
-            self.meshes.append(mesh)
-        elif path.lower().endswith('.stl'):
-            o3d_mesh = o3d.io.read_triangle_mesh(path)
-            if not o3d_mesh.has_vertex_normals():
-                o3d_mesh.compute_vertex_normals()
-            mesh = Mesh(o3d_mesh=o3d_mesh)
+        elif path.lower().endswith(('.ply', '.stl')):
+            vertices, indices = load_mesh_data(path)
+            mesh = Mesh(vertices=vertices, indices=indices)
             self.meshes.append(mesh)
         else:
             self._create_cube()
@@ -72,46 +84,155 @@ class Model:
         mesh = Mesh.create_torus(torus_radius, tube_radius, radial_resolution, tubular_resolution)
         return Model(mesh=mesh)
 
+    #builds simplified copies of every mesh ahead of time, level i + 1 is used once the
+    #model covers less than screen_sizes[i] of the screen height
+    def generate_lods(self, ratios=(0.5, 0.25, 0.1), screen_sizes=(0.3, 0.15, 0.05)):
+        if len(ratios) != len(screen_sizes):
+            raise ValueError("Every LOD ratio needs a screen size")
+        self._delete_lods()
+        self.lods = [self.meshes]
+        for ratio in ratios:
+            level = []
+            for mesh in self.meshes:
+                target_triangles = max(4, int(len(mesh.indices) // 3 * ratio))
+                lod_mesh = simplify_mesh(mesh, target_triangles)
+                lod_mesh.textures = list(mesh.textures)
+                for texture in lod_mesh.textures:
+                    if texture.manager is not None:
+                        texture.manager.retain(texture)
+                level.append(lod_mesh)
+            self.lods.append(level)
+        self.lod_screen_sizes = tuple(screen_sizes)
+        self.set_lod_level(0)
+
+    #level 0 is self.meshes, the simplified levels belong to the model alone.
+    #Deleting them gives back their arena ranges and retained textures
+    def _delete_lods(self):
+        for level in self.lods[1:]:
+            for mesh in level:
+                mesh.delete()
+        self.lods = []
+
+    def set_lod_level(self, level):
+        self.lod_level = level
+        self.active_meshes = self.lods[level] if self.lods else self.meshes
+
     def set_color(self, color):
         self.color = np.array(color, dtype=np.float32)
+        self.material_dirty = True
 
     def set_shininess(self, shininess):
         self.shininess = shininess
-
-    def draw(self, shader):
-        model_matrix = np.identity(4, dtype=np.float32)
-        model_matrix = pyrr.matrix44.create_from_scale(self.scale, dtype=np.float32)
-        rotation_x = pyrr.matrix44.create_from_x_rotation(np.radians(self.rotation[0]), dtype=np.float32)
-        rotation_y = pyrr.matrix44.create_from_y_rotation(np.radians(self.rotation[1]), dtype=np.float32)
-        rotation_z = pyrr.matrix44.create_from_z_rotation(np.radians(self.rotation[2]), dtype=np.float32)
-        rotation_matrix = pyrr.matrix44.multiply(rotation_x, rotation_y)
-        rotation_matrix = pyrr.matrix44.multiply(rotation_matrix, rotation_z)
-        model_matrix = pyrr.matrix44.multiply(model_matrix, rotation_matrix)
-        translation = pyrr.matrix44.create_from_translation(self.position, dtype=np.float32)
-        model_matrix = pyrr.matrix44.multiply(model_matrix, translation)
-        shader.set_mat4("model", model_matrix)
+        self.material_dirty = True
+
+    def set_opacity(self, opacity):
+        self.opacity = float(opacity)
+        self.material_dirty = True
+
+    @property
+    def transparent(self):
+        return self.opacity < 1.0
+
+    def set_static(self, static=True):
+        self.static = static
+
+    #views into self.transform, writing into them directly skips the dirty flag
+    #so use the setters instead
+    @property
+    def position(self):
+        return self.transform[0:3]
+
+    @position.setter
+    def position(self, position):
+        self.set_position(position)
+
+    @property
+    def rotation(self):
+        return self.transform[3:6]
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self.set_rotation(rotation)
+
+    @property
+    def scale(self):
+        return self.transform[6:9]
+
+    @scale.setter
+    def scale(self, scale):
+        self.set_scale(scale)
+
+    def _set_transform_part(self, start, value):
+        value = np.asarray(value, dtype=np.float32)
+        part = self.transform[start:start + 3]
+        if not np.array_equal(part, value):
+            part[:] = value
+            self.dirty = True
+
+    def set_meshes(self, meshes):
+        self.meshes[:] = meshes
+        self._delete_lods()
+        self.set_lod_level(0)
+        self.update_bounds()
+
+    #local box around all meshes, call again after changing self.meshes
+    def update_bounds(self):
+        if self.meshes:
+            bounds_min = np.min([mesh.bounds_min for mesh in self.meshes], axis=0)
+            bounds_max = np.max([mesh.bounds_max for mesh in self.meshes], axis=0)
+        else:
+            bounds_min = bounds_max = np.zeros(3, dtype=np.float32)
+        self.local_center = ((bounds_min + bounds_max) * 0.5).astype(np.float32)
+        self.local_extents = ((bounds_max - bounds_min) * 0.5).astype(np.float32)
+        self.dirty = True
+
+    #world bounds can be passed in when the scene computed them in a batch
+    def update_model_matrix(self, model_matrix, world_center=None, world_extents=None):
+        self.model_matrix = model_matrix
+        if world_center is None:
+            centers, extents = transform_bounds(self.local_center[np.newaxis], self.local_extents[np.newaxis],
+                                                model_matrix[np.newaxis])
+            world_center, world_extents = centers[0], extents[0]
+        self.world_center = world_center
+        self.world_extents = world_extents
+        self.dirty = False
+
+    def get_model_matrix(self):
+        if self.dirty:
+            self.update_model_matrix(compose_model_matrices(self.transform)[0])
+        return self.model_matrix
+
+    #world space box as (center, half extents), follows the cached matrix
+    def get_world_bounds(self):
+        self.get_model_matrix()
+        return self.world_center, self.world_extents
+
+    #meshes lets the scene draw only the meshes that were not instanced
+    def draw(self, shader, meshes=None):
+        shader.set_mat4("model", self.get_model_matrix())
         shader.set_float("material.shininess", self.shininess)
         shader.set_vec3("objectColor", self.color)
+        shader.set_float("opacity", self.opacity)
 
-        for mesh in self.meshes:
+        for mesh in (self.active_meshes if meshes is None else meshes):
             has_textures = len(mesh.textures) > 0
             shader.set_bool("hasTexture", has_textures)
 
             mesh.draw(shader)
 
     def set_position(self, position):
-        self.position = position
+        self._set_transform_part(0, position)
 
     def set_rotation(self, rotation):
-        self.rotation = rotation
+        self._set_transform_part(3, rotation)
 
     def set_scale(self, scale):
-        self.scale = scale
+        self._set_transform_part(6, scale)
 
     def rotate(self, axis, angle):
-        if axis[0] > 0:
-            self.rotation[0] += np.degrees(angle)
-        if axis[1] > 0:
-            self.rotation[1] += np.degrees(angle)
-        if axis[2] > 0:
-            self.rotation[2] += np.degrees(angle)
\ No newline at end of file
+        if angle == 0:
+            return
+        delta = np.degrees(angle) * (np.asarray(axis) > 0)
+        if np.any(delta):
+            self.transform[3:6] += delta
+            self.dirty = True
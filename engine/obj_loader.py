@@ -1,14 +1,11 @@
-import numpy as np
-import open3d as o3d
 from .mesh import Mesh
-from .texture import Texture
+from .mesh_cache import load_mesh_data
+from .texture_manager import get_texture_manager
 import os
 
 
-def load_obj(file_path, directory=""):
-    mesh = o3d.io.read_triangle_mesh(file_path)
-    if not mesh.has_vertex_normals():
-        mesh.compute_vertex_normals()
+#(texture path, texture type) for every map_Kd/map_Ks in the .mtl next to the .obj
+def parse_mtl_textures(file_path, directory=""):
     textures = []
     mtl_path = file_path.replace('.obj', '.mtl')
     if os.path.exists(mtl_path):
@@ -20,13 +17,21 @@ def load_obj(file_path, directory=""):
                 elif line.startswith('map_Kd') and current_material:
                     tex_path = os.path.join(directory, line.split()[1])
                     if os.path.exists(tex_path):
-                        diffuse_texture = Texture(tex_path, "texture_diffuse")
-                        textures.append(diffuse_texture)
+                        textures.append((tex_path, "texture_diffuse"))
                 elif line.startswith('map_Ks') and current_material:
                     tex_path = os.path.join(directory, line.split()[1])
                     if os.path.exists(tex_path):
-                        specular_texture = Texture(tex_path, "texture_specular")
-                        textures.append(specular_texture)
+                        textures.append((tex_path, "texture_specular"))
+    return textures
+
+
+def load_obj(file_path, directory=""):
+    #geometry comes from the binary mesh cache, materials are read every time
+    vertices, indices = load_mesh_data(file_path)
+    #textures are shared, models using the same material upload each image once
+    texture_manager = get_texture_manager()
+    textures = [texture_manager.acquire(tex_path, type_name)
+                for tex_path, type_name in parse_mtl_textures(file_path, directory)]
 
     # Create and return the mesh with textures
-    return Mesh(o3d_mesh=mesh, textures=textures)
\ No newline at end of file
+    return Mesh(vertices=vertices, indices=indices, textures=textures)
\ No newline at end of file
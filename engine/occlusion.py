@@ -0,0 +1,127 @@
+from OpenGL.GL import *
+import os
+import numpy as np
+from . import gl_state
+from .mesh import Mesh
+from .profiler import get_profiler
+from .shader import Shader
+
+#query boxes are a little larger than the model so its own surface never hides it
+BOX_PADDING = 1.02
+BOX_MARGIN = 0.01
+#corners of the -1..1 cube in the interleaved vertex layout, one index list for all 12 triangles
+_BOX_CORNERS = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+_BOX_INDICES = np.array([0, 1, 3, 0, 3, 2, 4, 6, 7, 4, 7, 5,
+                         0, 4, 5, 0, 5, 1, 2, 3, 7, 2, 7, 6,
+                         0, 2, 6, 0, 6, 4, 1, 5, 7, 1, 7, 3], dtype=np.uint32)
+
+_profiler = get_profiler()
+
+
+class _QueryState:
+    __slots__ = ("query", "issued", "occluded")
+
+    def __init__(self, query):
+        self.query = query
+        #a query name only becomes a query object once it was begun
+        self.issued = False
+        self.occluded = False
+
+
+#Hardware occlusion culling with last frame's results: models whose bounding box had
+#no visible samples last frame are held back while the rest is drawn. Then every
+#candidate's box is tested against the depth buffer in an ANY_SAMPLES_PASSED query and
+#the held back models are drawn under conditional rendering on their new query, so a
+#model that just came into view is still drawn and the cpu never waits for a result.
+class OcclusionCuller:
+    def __init__(self):
+        shaders_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
+        self.shader = Shader(os.path.join(shaders_dir, "bounds.vert"), os.path.join(shaders_dir, "depth.frag"))
+        vertices = np.zeros((len(_BOX_CORNERS), 8), dtype=np.float32)
+        vertices[:, 0:3] = _BOX_CORNERS
+        self.box_mesh = Mesh(vertices=vertices, indices=_BOX_INDICES)
+        self._states = {}
+        self._free_queries = []
+        #models of the last split, in the order their boxes get queried
+        self._queried = []
+
+    def _query(self):
+        if not self._free_queries:
+            self._free_queries.extend(glGenQueries(64))
+        return self._free_queries.pop()
+
+    #returns (models to draw, models occluded last frame). Models with the camera inside
+    #or close to their box are always drawn, their box would be clipped by the near plane
+    def split(self, models, camera):
+        previous = self._states
+        self._states = {}
+        visible, hidden, queried = [], [], []
+        near = np.zeros(len(models), dtype=bool)
+        if models:
+            centers = np.array([model.world_center for model in models], dtype=np.float32)
+            extents = np.array([model.world_extents for model in models], dtype=np.float32)
+            margin = extents * BOX_PADDING + BOX_MARGIN + camera.near * 2.0
+            near = np.all(np.abs(camera.position - centers) <= margin, axis=1)
+        for model, camera_near in zip(models, near):
+            state = previous.pop(model, None)
+            if state is None:
+                state = _QueryState(self._query())
+            elif state.issued and glGetQueryObjectiv(state.query, GL_QUERY_RESULT_AVAILABLE):
+                state.occluded = not glGetQueryObjectiv(state.query, GL_QUERY_RESULT)
+            if camera_near:
+                state.occluded = False
+            else:
+                queried.append(model)
+            self._states[model] = state
+            (hidden if state.occluded else visible).append(model)
+        #models that left the view start out visible when they come back
+        self._free_queries.extend(state.query for state in previous.values())
+        self._queried = queried
+        _profiler.count("occluded", len(hidden))
+        return visible, hidden
+
+    #tests the boxes of the split models against the depth buffer drawn so far
+    def query(self):
+        if not self._queried:
+            return
+        gl_state.color_mask(False)
+        gl_state.depth_mask(False)
+        gl_state.depth_func(GL_LEQUAL)
+        #the back faces still count when the front ones are clipped
+        gl_state.set_capability(GL_CULL_FACE, False)
+        shader = self.shader
+        shader.use()
+        allocation = self.box_mesh.allocation
+        allocation.bind()
+        for model in self._queried:
+            state = self._states[model]
+            shader.set_vec3("boxCenter", model.world_center)
+            shader.set_vec3("boxExtents", np.asarray(model.world_extents) * BOX_PADDING + BOX_MARGIN)
+            glBeginQuery(GL_ANY_SAMPLES_PASSED, state.query)
+            glDrawElementsBaseVertex(GL_TRIANGLES, allocation.index_count, GL_UNSIGNED_INT,
+                                     allocation.index_pointer, allocation.vertex_offset)
+            glEndQuery(GL_ANY_SAMPLES_PASSED)
+            state.issued = True
+        gl_state.set_capability(GL_CULL_FACE, True)
+        gl_state.depth_func(GL_LESS)
+        gl_state.depth_mask(True)
+        gl_state.color_mask(True)
+        _profiler.count("occlusion_queries", len(self._queried))
+        _profiler.count("draw_calls", len(self._queried))
+
+    #draws the models held back by split, the gpu skips every one whose box stayed hidden
+    def draw_hidden(self, shader, models):
+        for model in models:
+            glBeginConditionalRender(self._states[model].query, GL_QUERY_WAIT)
+            model.draw(shader)
+            glEndConditionalRender()
+
+    def delete(self):
+        queries = [state.query for state in self._states.values()] + self._free_queries
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self._states = {}
+        self._free_queries = []
+        self._queried = []
+        self.box_mesh.delete()
+        glDeleteProgram(self.shader.program)
@@ -0,0 +1,220 @@
+import ctypes
+import os
+import numpy as np
+import OpenGL
+import OpenGL.platform
+from OpenGL.GL import *
+from . import gl_state
+
+#PyOpenGL picks its function loader on first import, so PYOPENGL_PLATFORM has to be
+#egl or osmesa before anything imports OpenGL, e.g. PYOPENGL_PLATFORM=egl python render.py.
+#With Mesa, EGL_PLATFORM=surfaceless avoids needing a display server at all.
+BACKENDS = ("egl", "osmesa")
+
+
+def default_backend():
+    platform = os.environ.get("PYOPENGL_PLATFORM", "egl").lower()
+    return platform if platform in BACKENDS else "egl"
+
+
+def _check_platform(backend):
+    loader = type(OpenGL.platform.PLATFORM).__name__.lower()
+    if not loader.startswith(backend):
+        raise RuntimeError(f"The {backend} backend needs PYOPENGL_PLATFORM={backend} set before "
+                           f"OpenGL is imported, PyOpenGL is using {type(OpenGL.platform.PLATFORM).__name__}")
+
+
+#reads the framebuffer into a top down (height, width, channels) uint8 array
+def read_framebuffer(framebuffer, width, height, alpha=False):
+    glBindFramebuffer(GL_READ_FRAMEBUFFER, framebuffer)
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    channels = 4 if alpha else 3
+    data = glReadPixels(0, 0, width, height, GL_RGBA if alpha else GL_RGB, GL_UNSIGNED_BYTE)
+    return np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels)[::-1].copy()
+
+
+class _EGLContext:
+    def __init__(self):
+        from OpenGL import EGL
+        self.EGL = EGL
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not self.display or not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("Failed to initialize EGL")
+
+        attributes = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                      EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                      EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+                      EGL.EGL_NONE]
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, (EGL.EGLint * len(attributes))(*attributes),
+                            ctypes.pointer(config), 1, ctypes.pointer(count))
+        if count.value == 0:
+            raise RuntimeError("No EGL config supports desktop OpenGL")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        attributes = [EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                      EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                      EGL.EGL_NONE]
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT,
+                                            (EGL.EGLint * len(attributes))(*attributes))
+        if not self.context:
+            raise RuntimeError("Failed to create an OpenGL 3.3 core EGL context")
+
+        #everything renders into the window's framebuffer object, a surface is only
+        #made for drivers that cannot make a context current without one
+        self.surface = EGL.EGL_NO_SURFACE
+        extensions = EGL.eglQueryString(self.display, EGL.EGL_EXTENSIONS) or b""
+        if b"EGL_KHR_surfaceless_context" not in extensions:
+            attributes = [EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1, EGL.EGL_NONE]
+            self.surface = EGL.eglCreatePbufferSurface(self.display, config,
+                                                       (EGL.EGLint * len(attributes))(*attributes))
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context):
+            raise RuntimeError("Failed to make the EGL context current")
+
+    def destroy(self):
+        EGL = self.EGL
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        if self.surface != EGL.EGL_NO_SURFACE:
+            EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
+
+
+#Mesa's software rasterizer, for machines without any GPU driver
+class _OSMesaContext:
+    def __init__(self):
+        from OpenGL import osmesa
+        self.osmesa = osmesa
+        attributes = [osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+                      osmesa.OSMESA_DEPTH_BITS, 24,
+                      osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+                      osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+                      osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3,
+                      0]
+        self.context = osmesa.OSMesaCreateContextAttribs((ctypes.c_int * len(attributes))(*attributes), None)
+        if not self.context:
+            raise RuntimeError("Failed to create an OpenGL 3.3 core OSMesa context")
+        #OSMesa wants a client buffer to make current, the real output is the framebuffer object
+        self.buffer = np.zeros((1, 1, 4), dtype=np.uint8)
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE, 1, 1):
+            raise RuntimeError("Failed to make the OSMesa context current")
+
+    def destroy(self):
+        self.osmesa.OSMesaDestroyContext(self.context)
+
+
+_CONTEXTS = {
+    "egl": _EGLContext,
+    "osmesa": _OSMesaContext,
+}
+
+
+#drop in replacement for Window without a display: an EGL or OSMesa context
+#rendering into a framebuffer object. Input queries report nothing pressed.
+class OffscreenWindow:
+    def __init__(self, width, height, title=None, backend=None):
+        backend = backend or default_backend()
+        if backend not in _CONTEXTS:
+            raise ValueError(f"Unknown offscreen backend: {backend}")
+        _check_platform(backend)
+        self.backend = backend
+        self.title = title
+        self.context = _CONTEXTS[backend]()
+        #a new context, nothing cached so far is valid
+        gl_state.reset()
+
+        self.width = width
+        self.height = height
+        self.framebuffer = 0
+        self._color_buffer = 0
+        self._depth_buffer = 0
+        self._create_framebuffer()
+
+        gl_state.set_capability(GL_DEPTH_TEST, True)
+
+        gl_state.set_capability(GL_CULL_FACE, True)
+        gl_state.cull_face(GL_BACK)
+
+        self._should_close = False
+
+    def _create_framebuffer(self):
+        self.framebuffer = glGenFramebuffers(1)
+        self._color_buffer, self._depth_buffer = glGenRenderbuffers(2)
+        glBindRenderbuffer(GL_RENDERBUFFER, self._color_buffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, self.width, self.height)
+        glBindRenderbuffer(GL_RENDERBUFFER, self._depth_buffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, self.width, self.height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self._color_buffer)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self._depth_buffer)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Offscreen framebuffer is incomplete")
+        glViewport(0, 0, self.width, self.height)
+
+    def _delete_framebuffer(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteFramebuffers(1, [self.framebuffer])
+        glDeleteRenderbuffers(2, [self._color_buffer, self._depth_buffer])
+        self.framebuffer = self._color_buffer = self._depth_buffer = 0
+
+    def resize(self, width, height):
+        self._delete_framebuffer()
+        self.width = width
+        self.height = height
+        self._create_framebuffer()
+
+    def read_pixels(self, alpha=False):
+        return read_framebuffer(self.framebuffer, self.width, self.height, alpha)
+
+    def is_key_pressed(self, key):
+        return False
+
+    def is_mouse_button_pressed(self, button):
+        return False
+
+    def get_mouse_position(self):
+        return (self.width / 2, self.height / 2)
+
+    def get_mouse_offset(self):
+        return (0, 0)
+
+    def get_scroll_offset(self):
+        return 0
+
+    def poll_events(self):
+        pass
+
+    def should_close(self):
+        return self._should_close
+
+    def set_should_close(self, value):
+        self._should_close = value
+
+    def clear(self, r, g, b, a):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glViewport(0, 0, self.width, self.height)
+        glClearColor(r, g, b, a)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+    #nothing is presented, flushing keeps the gpu busy between frames
+    def swap_buffers(self):
+        glFlush()
+
+    def terminate(self):
+        if self.context is not None:
+            self._delete_framebuffer()
+            self.context.destroy()
+            self.context = None
+
+    def get_aspect_ratio(self):
+        return self.width / self.height
+
+    def set_title(self, title):
+        self.title = title
+
+    def set_cursor_mode(self, mode):
+        pass
\ No newline at end of file
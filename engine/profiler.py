@@ -0,0 +1,272 @@
+import ctypes
+import json
+import time
+from collections import defaultdict, deque
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_3_2 import glGetInteger64v as _glGetInteger64v
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v as _glGetQueryObjectui64v
+
+#frames kept for summaries and trace export
+HISTORY = 300
+#queries are generated in batches and recycled once their results are read
+QUERY_BATCH = 32
+
+
+#the PyOpenGL wrappers mangle 64 bit results, so these go through the raw entry points
+def _query_result(query):
+    value = GLuint64(0)
+    _glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(value))
+    return value.value
+
+
+def _gpu_timestamp():
+    value = GLint64(0)
+    _glGetInteger64v(GL_TIMESTAMP, ctypes.byref(value))
+    return value.value
+
+
+#one timed stage of a frame, gpu times stay None until the queries are read back
+class Section:
+    __slots__ = ("name", "depth", "cpu_start", "cpu_end", "gpu_start", "gpu_end")
+
+    def __init__(self, name, depth, cpu_start):
+        self.name = name
+        self.depth = depth
+        self.cpu_start = cpu_start
+        self.cpu_end = cpu_start
+        self.gpu_start = None
+        self.gpu_end = None
+
+    @property
+    def cpu_ms(self):
+        return (self.cpu_end - self.cpu_start) * 1000.0
+
+    @property
+    def gpu_ms(self):
+        if self.gpu_start is None or self.gpu_end is None:
+            return None
+        return (self.gpu_end - self.gpu_start) * 1000.0
+
+
+class FrameRecord:
+    def __init__(self, index, start):
+        self.index = index
+        self.start = start
+        self.end = start
+        self.sections = []
+        self.counters = {}
+        #(section, start query, end query) still waiting for the gpu
+        self.queries = []
+        #gpu timestamp in seconds matching the cpu clock at frame start, for the trace
+        self.gpu_clock = None
+
+    @property
+    def cpu_ms(self):
+        return (self.end - self.start) * 1000.0
+
+    #from the first to the last gpu timestamp of the frame
+    @property
+    def gpu_ms(self):
+        timed = [section for section in self.sections if section.gpu_end is not None]
+        if not timed or self.queries:
+            return None
+        return (max(section.gpu_end for section in timed) - min(section.gpu_start for section in timed)) * 1000.0
+
+
+class _SectionScope:
+    __slots__ = ("profiler", "name", "gpu")
+
+    def __init__(self, profiler, name, gpu):
+        self.profiler = profiler
+        self.name = name
+        self.gpu = gpu
+
+    def __enter__(self):
+        self.profiler.begin_section(self.name, self.gpu)
+
+    def __exit__(self, *exc_info):
+        self.profiler.end_section()
+
+
+class _NullScope:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SCOPE = _NullScope()
+
+
+#cpu time per frame stage, gpu time per stage through GL_TIMESTAMP queries read back
+#frames later so nothing waits on the gpu, and per frame counters. Disabled it costs
+#one attribute check per call.
+class Profiler:
+    def __init__(self, history=HISTORY, gpu=True):
+        self.enabled = False
+        self.gpu = gpu
+        self.frames = deque(maxlen=history)
+        self.frame = None
+        self._frame_index = 0
+        self._stack = []
+        self._counters = defaultdict(int)
+        #frames whose gpu queries are still pending, oldest first
+        self._pending = deque()
+        self._free_queries = []
+
+    def enable(self, gpu=None):
+        if gpu is not None:
+            self.gpu = gpu
+        self.enabled = True
+
+    def disable(self):
+        self.end_frame()
+        self.enabled = False
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        if self.frame is not None:
+            self.end_frame()
+        self._read_queries()
+        self.frame = FrameRecord(self._frame_index, time.perf_counter())
+        self._frame_index += 1
+        if self.gpu:
+            self.frame.gpu_clock = _gpu_timestamp() / 1e9
+        self._counters.clear()
+
+    def end_frame(self):
+        frame = self.frame
+        if frame is None:
+            return
+        while self._stack:
+            self.end_section()
+        frame.end = time.perf_counter()
+        frame.counters = dict(self._counters)
+        self.frames.append(frame)
+        if frame.queries:
+            self._pending.append(frame)
+        self.frame = None
+
+    def section(self, name, gpu=False):
+        if not self.enabled or self.frame is None:
+            return _NULL_SCOPE
+        return _SectionScope(self, name, gpu)
+
+    def begin_section(self, name, gpu=False):
+        section = Section(name, len(self._stack), time.perf_counter())
+        query = None
+        if gpu and self.gpu:
+            query = self._query()
+            glQueryCounter(query, GL_TIMESTAMP)
+        self._stack.append((section, query))
+        self.frame.sections.append(section)
+
+    def end_section(self):
+        section, start_query = self._stack.pop()
+        if start_query is not None:
+            end_query = self._query()
+            glQueryCounter(end_query, GL_TIMESTAMP)
+            self.frame.queries.append((section, start_query, end_query))
+        section.cpu_end = time.perf_counter()
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self._counters[name] += amount
+
+    def _query(self):
+        if not self._free_queries:
+            self._free_queries.extend(glGenQueries(QUERY_BATCH))
+        return self._free_queries.pop()
+
+    #collects finished frames without blocking, queries finish in submission order
+    def _read_queries(self):
+        while self._pending:
+            frame = self._pending[0]
+            last_query = frame.queries[-1][2]
+            if not glGetQueryObjectiv(last_query, GL_QUERY_RESULT_AVAILABLE):
+                return
+            for section, start_query, end_query in frame.queries:
+                section.gpu_start = _query_result(start_query) / 1e9
+                section.gpu_end = _query_result(end_query) / 1e9
+                self._free_queries.extend((start_query, end_query))
+            frame.queries = []
+            self._pending.popleft()
+
+    #averages over the last frame_count recorded frames
+    def averages(self, frame_count=60):
+        frames = list(self.frames)[-frame_count:]
+        if not frames:
+            return {}
+        result = {"frame_cpu_ms": sum(frame.cpu_ms for frame in frames) / len(frames)}
+        gpu_times = [frame.gpu_ms for frame in frames if frame.gpu_ms is not None]
+        if gpu_times:
+            result["frame_gpu_ms"] = sum(gpu_times) / len(gpu_times)
+
+        cpu_times, counters = defaultdict(float), defaultdict(float)
+        for frame in frames:
+            for section in frame.sections:
+                cpu_times[section.name] += section.cpu_ms
+            for name, value in frame.counters.items():
+                counters[name] += value
+        for name, total in cpu_times.items():
+            result[name + "_ms"] = total / len(frames)
+        for name, total in counters.items():
+            result[name] = total / len(frames)
+        return result
+
+    def summary(self, frame_count=60):
+        averages = self.averages(frame_count)
+        if not averages:
+            return "no frames profiled"
+        text = f"cpu {averages['frame_cpu_ms']:.2f} ms"
+        if "frame_gpu_ms" in averages:
+            text += f" | gpu {averages['frame_gpu_ms']:.2f} ms"
+        text += (f" | {averages.get('draw_calls', 0):.0f} draws"
+                 f" | {averages.get('triangles', 0) / 1000.0:.1f}k tris"
+                 f" | {averages.get('state_changes', 0):.0f} state changes"
+                 f" | {averages.get('uniform_uploads', 0):.0f} uniform uploads")
+        return text
+
+    #trace events in the chrome://tracing / Perfetto json format, cpu and gpu as two threads
+    def chrome_trace(self):
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": "CPU"}},
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": 1, "args": {"name": "GPU"}},
+        ]
+        for frame in self.frames:
+            events.append({"name": f"frame {frame.index}", "ph": "X", "pid": 0, "tid": 0,
+                           "ts": frame.start * 1e6, "dur": frame.cpu_ms * 1000.0})
+            for section in frame.sections:
+                events.append({"name": section.name, "ph": "X", "pid": 0, "tid": 0,
+                               "ts": section.cpu_start * 1e6, "dur": section.cpu_ms * 1000.0})
+                if section.gpu_ms is not None and frame.gpu_clock is not None:
+                    start = section.gpu_start - frame.gpu_clock + frame.start
+                    events.append({"name": section.name, "ph": "X", "pid": 0, "tid": 1,
+                                   "ts": start * 1e6, "dur": section.gpu_ms * 1000.0})
+            if frame.counters:
+                events.append({"name": "counters", "ph": "C", "pid": 0, "tid": 0,
+                               "ts": frame.start * 1e6, "args": frame.counters})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+    def reset(self):
+        self.frames.clear()
+        self.frame = None
+        self._stack = []
+        #pending queries are dropped with their frames
+        for frame in self._pending:
+            for _, start_query, end_query in frame.queries:
+                self._free_queries.extend((start_query, end_query))
+        self._pending.clear()
+
+
+_profiler = Profiler()
+
+
+def get_profiler():
+    return _profiler
\ No newline at end of file
@@ -0,0 +1,107 @@
+import weakref
+import numpy as np
+
+#64 bit sort keys, most significant bits first
+#  opaque:      layer 2 | variant 2 | material 16 | mesh 20 | depth 24
+#  transparent: layer 2 | inverted depth 24 | variant 2 | material 16 | mesh 20
+#opaque draws are grouped by state and go front to back within the same state,
+#transparent ones go back to front whatever their state
+LAYER_OPAQUE = 0
+LAYER_TRANSPARENT = 1
+#the scene shader has an instanced and a single model variant, grouping by it means
+#useInstancing only flips once
+VARIANT_INSTANCED = 0
+VARIANT_SINGLE = 1
+
+VARIANT_BITS = 2
+MATERIAL_BITS = 16
+MESH_BITS = 20
+DEPTH_BITS = 24
+_DEPTH_MAX = (1 << DEPTH_BITS) - 1
+
+
+#hands out small ids that stay the same between frames. Ids are never reused while
+#their key lives, keys dropping out of a weak map must not free theirs. Once they run
+#out, new keys share the last id until start_over is called between frames
+class _IdMap:
+    def __init__(self, bits, weak=False):
+        self.limit = 1 << bits
+        self.ids = weakref.WeakKeyDictionary() if weak else {}
+        self.next_id = 0
+
+    @property
+    def exhausted(self):
+        return self.next_id >= self.limit
+
+    def get(self, key):
+        id = self.ids.get(key)
+        if id is None:
+            id = min(self.next_id, self.limit - 1)
+            self.next_id += 1
+            self.ids[key] = id
+        return id
+
+    def start_over(self):
+        self.ids.clear()
+        self.next_id = 0
+
+
+#Collects the draws of a pass, one item per instanced group or single model mesh,
+#and orders them by packed 64 bit keys with one argsort
+class RenderQueue:
+    def __init__(self):
+        self._material_ids = _IdMap(MATERIAL_BITS)
+        self._mesh_ids = _IdMap(MESH_BITS, weak=True)
+        self.items = []
+        self._fields = []
+        self._centers = []
+
+    #call between frames, ids that ran out start over here and never within a frame
+    def begin_frame(self):
+        for id_map in (self._material_ids, self._mesh_ids):
+            if id_map.exhausted:
+                id_map.start_over()
+
+    def clear(self):
+        self.items = []
+        self._fields = []
+        self._centers = []
+
+    def __len__(self):
+        return len(self.items)
+
+    #models is the instanced group, or a single model for the other variant.
+    #material is any hashable key of the state the draw sets up
+    def add(self, mesh, models, material, variant, transparent=False):
+        self.items.append((mesh, models, variant))
+        self._fields.append((LAYER_TRANSPARENT if transparent else LAYER_OPAQUE, variant,
+                             self._material_ids.get(material), self._mesh_ids.get(mesh)))
+        #a group is placed at the middle of its members
+        if len(models) == 1:
+            self._centers.append(models[0].world_center)
+        else:
+            self._centers.append(np.mean([model.world_center for model in models], axis=0))
+
+    def sort_keys(self, view, far):
+        if not self.items:
+            return np.zeros(0, dtype=np.uint64)
+        fields = np.array(self._fields, dtype=np.uint64)
+        layer, variant, material, mesh = fields.T
+        #pyrr matrices are row vector, view depth is minus the view space z
+        view = np.asarray(view, dtype=np.float64)
+        depth = -(np.array(self._centers, dtype=np.float64) @ view[0:3, 2] + view[3, 2])
+        depth = (np.clip(depth / far, 0.0, 1.0) * _DEPTH_MAX).astype(np.uint64)
+
+        state = (variant << np.uint64(MATERIAL_BITS + MESH_BITS)) | (material << np.uint64(MESH_BITS)) | mesh
+        top = layer << np.uint64(62)
+        opaque = top | (state << np.uint64(DEPTH_BITS)) | depth
+        transparent = top | ((np.uint64(_DEPTH_MAX) - depth) << np.uint64(VARIANT_BITS + MATERIAL_BITS + MESH_BITS)) | state
+        return np.where(layer == LAYER_TRANSPARENT, transparent, opaque)
+
+    #items in draw order as (mesh, models, variant, transparent)
+    def sorted_items(self, view, far):
+        keys = self.sort_keys(view, far)
+        transparent = keys >> np.uint64(62) == LAYER_TRANSPARENT
+        for i in np.argsort(keys, kind="stable"):
+            mesh, models, variant = self.items[i]
+            yield mesh, models, variant, bool(transparent[i])
@@ -1,14 +1,108 @@
-from engine.light import PointLight
+import os
+import numpy as np
+from OpenGL.GL import *
+from engine.light import LIGHTS_BLOCK_FLOATS, pack_lights_block
+from engine.light_clusters import LightClusters
+from engine.instancing import InstanceBuffer
+from engine.transform import compose_model_matrices, transform_bounds
+from engine.frustum import extract_frustum_planes, boxes_in_frustum
+from engine.indirect import IndirectDraws
+from engine.bvh import BVH
+from engine.uniform_buffer import UniformBuffer
+from engine.mesh_utils import bake_meshes
+from engine.model import Model
+from engine.occlusion import OcclusionCuller
+from engine.profiler import get_profiler
+from engine.render_queue import RenderQueue, VARIANT_INSTANCED, VARIANT_SINGLE
+from engine.shader import Shader
+from engine import gl_state
 
 
 class Scene:
     def __init__(self):
         self.models = []
         self.lights = []
+        self.terrains = []
         self.camera = None
 
+        #meshes shared by at least this many models are drawn with one instanced call
+        self.instancing = True
+        self.instancing_threshold = 2
+        self._instance_buffers = {}
+        self._lights_buffer = None
+        #point and spot lights binned into view space clusters every frame
+        self.light_clusters = None
+
+        #world boxes of all models stacked for vectorized culling, same order as self.models
+        self.frustum_culling = True
+        self._world_centers = np.zeros((0, 3), dtype=np.float32)
+        self._world_extents = np.zeros((0, 3), dtype=np.float32)
+        self._models_changed = True
+
+        #spatial index over the same boxes, culling switches to it for large scenes
+        self.spatial_index = BVH()
+        self.spatial_index_threshold = 1024
+
+        #a model only changes LOD once its screen size is this far past a threshold
+        self.lod_hysteresis = 0.1
+
+        #static models sharing a material are baked into one world space mesh each,
+        #rebuilt only when the set of static models or one of their transforms changes
+        self.static_batching = True
+        self._static_models = []
+        self._static_batches = []
+        self._static_dirty = False
+        self._batch_centers = np.zeros((0, 3), dtype=np.float32)
+        self._batch_extents = np.zeros((0, 3), dtype=np.float32)
+
+        #lays down depth first with a depth only shader, so shading runs once per pixel
+        self.depth_prepass = False
+        self._depth_shader = None
+        #holds back models whose box was hidden last frame, see engine/occlusion.py
+        self.occlusion_culling = False
+        self.occlusion_culler = None
+
+        #draws of a pass are sorted by state, opaque ones front to back and transparent
+        #ones back to front, see engine/render_queue.py
+        self.render_queue = RenderQueue()
+        #transparent models of the last deferred render, the G-buffer only holds opaque surfaces
+        self._deferred_transparent = []
+        #submits every opaque model from a GPU command buffer, see engine/indirect.py
+        self.indirect_drawing = False
+        self.indirect_draws = None
+
     def add_model(self, model):
         self.models.append(model)
+        self._models_changed = True
+
+    def remove_model(self, model):
+        self.models.remove(model)
+        self._models_changed = True
+        #other models sharing a mesh get a new buffer the next time it is drawn
+        for meshes in model.lods or [model.meshes]:
+            self._release_instance_buffers(meshes)
+
+    def _release_instance_buffers(self, meshes):
+        for mesh in meshes:
+            instance_buffer = self._instance_buffers.pop(mesh, None)
+            if instance_buffer is not None:
+                instance_buffer.delete()
+
+    #meshes deleted anywhere else, terrain tiles or replaced LOD chains, lose their buffer here
+    def _release_deleted_instance_buffers(self):
+        deleted = [mesh for mesh in self._instance_buffers if mesh.allocation is None]
+        if deleted:
+            self._release_instance_buffers(deleted)
+
+    #terrain tiles come and go as models around the camera
+    def add_terrain(self, terrain):
+        terrain.scene = self
+        self.terrains.append(terrain)
+
+    def remove_terrain(self, terrain):
+        terrain.unload()
+        terrain.scene = None
+        self.terrains.remove(terrain)
 
     def add_light(self, light):
         self.lights.append(light)
@@ -16,22 +110,339 @@ class Scene:
     def set_camera(self, camera):
         self.camera = camera
 
-    def render(self, shader):
+    #recomputes every dirty model matrix and world box in one vectorized pass
+    def update_transforms(self):
+        dirty = [i for i, model in enumerate(self.models) if model.dirty]
+        if dirty:
+            models = [self.models[i] for i in dirty]
+            matrices = compose_model_matrices(np.array([model.transform for model in models]))
+            centers, extents = transform_bounds(np.array([model.local_center for model in models]),
+                                                np.array([model.local_extents for model in models]),
+                                                matrices)
+            for model, matrix, center, extent in zip(models, matrices, centers, extents):
+                model.update_model_matrix(matrix, center, extent)
+                if model.static:
+                    self._static_dirty = True
+
+        if self._models_changed:
+            self._world_centers = np.array([model.world_center for model in self.models],
+                                           dtype=np.float32).reshape(-1, 3)
+            self._world_extents = np.array([model.world_extents for model in self.models],
+                                           dtype=np.float32).reshape(-1, 3)
+            self._models_changed = False
+            self._update_spatial_index(rebuild=True)
+        elif dirty:
+            self._world_centers[dirty] = centers
+            self._world_extents[dirty] = extents
+            self._update_spatial_index(rebuild=False)
+
+    @staticmethod
+    def _material_key(model, mesh):
+        return (tuple(np.asarray(model.color, dtype=np.float32).tolist()), float(model.shininess),
+                model.opacity, tuple((texture.id, texture.type) for texture in mesh.textures))
+
+    def _update_static_batches(self):
+        static = [model for model in self.models if model.static and model.loaded] if self.static_batching else []
+        #a changed material moves the model into another batch
+        for model in static:
+            if model.material_dirty:
+                model.material_dirty = False
+                self._static_dirty = True
+        if static == self._static_models and not self._static_dirty:
+            return
+        self._static_models = static
+        self._static_dirty = False
+        self._delete_static_batches()
+
+        groups = {}
+        for model in static:
+            for mesh in model.meshes:
+                groups.setdefault(self._material_key(model, mesh), []).append((model, mesh))
+
+        for pieces in groups.values():
+            model, mesh = pieces[0]
+            batch_mesh = bake_meshes([mesh for _, mesh in pieces], [model.get_model_matrix() for model, _ in pieces])
+            batch_mesh.textures = list(mesh.textures)
+            for texture in batch_mesh.textures:
+                if texture.manager is not None:
+                    texture.manager.retain(texture)
+            batch = Model(mesh=batch_mesh)
+            batch.set_color(model.color)
+            batch.set_shininess(model.shininess)
+            batch.set_opacity(model.opacity)
+            batch.get_model_matrix()
+            self._static_batches.append(batch)
+
+        self._batch_centers = np.array([batch.world_center for batch in self._static_batches],
+                                       dtype=np.float32).reshape(-1, 3)
+        self._batch_extents = np.array([batch.world_extents for batch in self._static_batches],
+                                       dtype=np.float32).reshape(-1, 3)
+
+    def _delete_static_batches(self):
+        for batch in self._static_batches:
+            self._release_instance_buffers(batch.meshes)
+            for mesh in batch.meshes:
+                mesh.delete()
+        self._static_batches = []
+
+    #frees the GL objects the scene created for drawing, the models and terrains stay as they are
+    def delete(self):
+        self._delete_static_batches()
+        self._static_models = []
+        self._release_instance_buffers(list(self._instance_buffers))
+        if self._lights_buffer is not None:
+            self._lights_buffer.delete()
+            self.light_clusters.delete()
+            self._lights_buffer = self.light_clusters = None
+        if self.occlusion_culler is not None:
+            self.occlusion_culler.delete()
+            self.occlusion_culler = None
+        if self.indirect_draws is not None:
+            self.indirect_draws.delete()
+            self.indirect_draws = None
+        if self._depth_shader is not None:
+            glDeleteProgram(self._depth_shader.program)
+            self._depth_shader = None
+
+    #refits the tree when models move and only rebuilds once it got too loose
+    def _update_spatial_index(self, rebuild):
+        mins = self._world_centers - self._world_extents
+        maxs = self._world_centers + self._world_extents
+        if not rebuild:
+            self.spatial_index.refit(mins, maxs)
+            rebuild = self.spatial_index.needs_rebuild()
+        if rebuild:
+            self.spatial_index.build(mins, maxs)
+
+    #models whose world box touches the camera frustum
+    def get_visible_models(self, aspect_ratio):
+        planes = extract_frustum_planes(self.camera.get_view_matrix(),
+                                        self.camera.get_projection_matrix(aspect_ratio))
+        if len(self.models) >= self.spatial_index_threshold:
+            visible = np.sort(self.spatial_index.query_frustum(planes))
+        else:
+            visible = np.flatnonzero(boxes_in_frustum(planes, self._world_centers, self._world_extents))
+        return [self.models[i] for i in visible]
+
+    #picks a LOD level for every model with a chain from its projected screen size
+    def select_lods(self, models):
+        lod_models = [model for model in models if model.lods]
+        if not lod_models:
+            return
+        centers = np.array([model.world_center for model in lod_models])
+        radii = np.linalg.norm(np.array([model.world_extents for model in lod_models]), axis=1)
+        distances = np.maximum(np.linalg.norm(centers - self.camera.position, axis=1), 1e-6)
+        #fraction of the screen height covered by the bounding sphere
+        screen_sizes = radii / (distances * np.tan(np.radians(self.camera.zoom) * 0.5))
+
+        level_count = max(len(model.lod_screen_sizes) for model in lod_models)
+        thresholds = np.full((len(lod_models), level_count), -np.inf)
+        for i, model in enumerate(lod_models):
+            thresholds[i, :len(model.lod_screen_sizes)] = model.lod_screen_sizes
+        current = np.array([model.lod_level for model in lod_models])
+
+        #coarsest level we have to drop to and finest level we may go back up to
+        lowest = (screen_sizes[:, np.newaxis] < thresholds * (1.0 - self.lod_hysteresis)).sum(axis=1)
+        highest = (screen_sizes[:, np.newaxis] < thresholds * (1.0 + self.lod_hysteresis)).sum(axis=1)
+        levels = np.clip(current, lowest, highest)
+
+        for i in np.flatnonzero(levels != current):
+            lod_models[i].set_lod_level(int(levels[i]))
+
+    def query_sphere(self, center, radius):
+        self.update_transforms()
+        return [self.models[i] for i in np.sort(self.spatial_index.query_sphere(center, radius))]
+
+    #models whose world box is hit by the ray, as (model, distance) from nearest to farthest
+    def raycast(self, origin, direction, max_distance=np.inf):
+        self.update_transforms()
+        items, distances = self.spatial_index.query_ray(origin, direction, max_distance)
+        return [(self.models[i], float(distance)) for i, distance in zip(items, distances)]
+
+    #aspect_ratio is needed for frustum culling, without it every model is drawn.
+    #deferred draws into a G-buffer: lights are left unbinned for the light volumes
+    #and terrains switch to their G-buffer shaders
+    def render(self, shader, aspect_ratio=None, deferred=False):
         if not self.camera:
             raise ValueError("Camera not set in scene")
-        #TODO: Actually do something with this boolean
-        dir_light_set = False
-        point_light_count = 0
-
-        for light in self.lights:
-            if isinstance(light, PointLight):
-                light.apply(shader, point_light_count)
-                point_light_count += 1
+
+        profiler = get_profiler()
+        #the directional light and cluster grid go to the Lights block, point and
+        #spot lights to the cluster buffer textures
+        with profiler.section("lights"):
+            if self._lights_buffer is None:
+                self._lights_buffer = UniformBuffer("Lights", LIGHTS_BLOCK_FLOATS * 4)
+                self.light_clusters = LightClusters()
+            block = pack_lights_block(self.lights)
+            if aspect_ratio is None or deferred:
+                self.light_clusters.update(self.lights, block)
             else:
-                light.apply(shader, 0)
-                dir_light_set = True
+                camera = self.camera
+                self.light_clusters.update(self.lights, block, camera.get_view_matrix(),
+                                           camera.get_projection_matrix(aspect_ratio), camera.near, camera.far)
+            self._lights_buffer.update(block)
+            self.light_clusters.bind()
+
+        with profiler.section("terrain_update", gpu=True):
+            for terrain in self.terrains:
+                terrain.update(self.camera.position)
+        with profiler.section("transforms"):
+            self.update_transforms()
+        with profiler.section("static_batches", gpu=True):
+            self._update_static_batches()
+        self._release_deleted_instance_buffers()
+        with profiler.section("culling"):
+            batches = self._static_batches
+            if self.frustum_culling and aspect_ratio is not None:
+                models = self.get_visible_models(aspect_ratio)
+                if batches:
+                    planes = extract_frustum_planes(self.camera.get_view_matrix(),
+                                                    self.camera.get_projection_matrix(aspect_ratio))
+                    visible = boxes_in_frustum(planes, self._batch_centers, self._batch_extents)
+                    batches = [batch for batch, shown in zip(batches, visible) if shown]
+            else:
+                models = self.models
+            if self._static_models:
+                models = [model for model in models if not model.static]
+        with profiler.section("lod"):
+            self.select_lods(models)
+        self.render_queue.begin_frame()
+        if self.indirect_drawing:
+            if self.indirect_draws is None:
+                self.indirect_draws = IndirectDraws()
+            self.indirect_draws.reset()
+        models = models + batches
+        #blended models skip the pre-pass and occlusion culling, they are drawn last
+        transparent = [model for model in models if model.transparent]
+        if transparent:
+            models = [model for model in models if not model.transparent]
+        hidden = []
+        occlusion_culling = self.occlusion_culling and aspect_ratio is not None
+        if occlusion_culling:
+            with profiler.section("occlusion_split"):
+                if self.occlusion_culler is None:
+                    self.occlusion_culler = OcclusionCuller()
+                models, hidden = self.occlusion_culler.split(models, self.camera)
+        if self.depth_prepass:
+            with profiler.section("depth_prepass", gpu=True):
+                depth_shader = self._get_depth_shader()
+                depth_shader.use()
+                gl_state.color_mask(False)
+                self._draw_models(depth_shader, models)
+                gl_state.color_mask(True)
+                #the shading pass only passes where the pre-pass left its own depth
+                gl_state.depth_func(GL_LEQUAL)
+                shader.use()
+        with profiler.section("draw_models", gpu=True):
+            self._draw_models(shader, models)
+        gl_state.depth_func(GL_LESS)
+
+        #quadtree terrains draw with their own shader
+        if self.terrains and aspect_ratio is not None:
+            with profiler.section("draw_terrain", gpu=True):
+                for terrain in self.terrains:
+                    terrain.draw(self.camera, aspect_ratio, deferred)
+                shader.use()
+
+        #boxes are tested once everything else, terrain included, is in the depth buffer
+        if occlusion_culling:
+            with profiler.section("occlusion_queries", gpu=True):
+                self.occlusion_culler.query()
+                shader.use()
+                self.occlusion_culler.draw_hidden(shader, hidden)
+
+        if deferred:
+            self._deferred_transparent = transparent
+        elif transparent:
+            with profiler.section("draw_transparent", gpu=True):
+                self._draw_models(shader, transparent)
+
+    #forward pass over the transparent models the last deferred render held back,
+    #drawn on top of the resolved image and its depth
+    def draw_transparent(self, shader):
+        if not self._deferred_transparent:
+            return
+        with get_profiler().section("draw_transparent", gpu=True):
+            shader.use()
+            self._draw_models(shader, self._deferred_transparent)
+        self._deferred_transparent = []
+
+    def _get_depth_shader(self):
+        if self._depth_shader is None:
+            shaders_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
+            self._depth_shader = Shader(os.path.join(shaders_dir, "phong.vert"), os.path.join(shaders_dir, "depth.frag"))
+        return self._depth_shader
+
+    #instanced draws only vary the matrix and color, so models are grouped by mesh and
+    #the rest of their material (shininess, opacity, textures)
+    def _group_by_material(self, models):
+        groups = {}
+        for model in models:
+            for mesh in model.active_meshes:
+                groups.setdefault((mesh,) + self._material_key(model, mesh)[1:], []).append(model)
+        return groups
+
+    #queues an instanced draw per shared mesh and material and a single draw per remaining model mesh,
+    #then submits them in sort key order so shader, material and mesh changes are rare
+    def _draw_models(self, shader, models):
+        if self.indirect_drawing and self.indirect_draws is not None:
+            #transparent models still need the queue for their back to front order
+            if any(model.transparent for model in models):
+                self.indirect_draws.draw(shader, [model for model in models if not model.transparent])
+                models = [model for model in models if model.transparent]
+            else:
+                self.indirect_draws.draw(shader, models)
+                return
+        queue = self.render_queue
+        queue.clear()
+        for key, group in self._group_by_material(models).items():
+            mesh, material = key[0], key[1:]
+            instanced = []
+            if self.instancing:
+                #transparent models need their own place in the back to front order
+                instanced = [model for model in group if not model.transparent]
+                if len(instanced) < self.instancing_threshold:
+                    instanced = []
+            if instanced:
+                #color is per instance, the rest of the material is shared by the group
+                queue.add(mesh, instanced, material, VARIANT_INSTANCED)
+            for model in group:
+                if not instanced or model.transparent:
+                    queue.add(mesh, [model], self._material_key(model, mesh), VARIANT_SINGLE, model.transparent)
+
+        variant = None
+        blending = False
+        for mesh, group, item_variant, transparent in queue.sorted_items(self.camera.get_view_matrix(), self.camera.far):
+            if item_variant != variant:
+                variant = item_variant
+                shader.set_bool("useInstancing", variant == VARIANT_INSTANCED)
+            if transparent and not blending:
+                blending = True
+                gl_state.set_capability(GL_BLEND, True)
+                gl_state.blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+                gl_state.depth_mask(False)
+            if variant == VARIANT_INSTANCED:
+                self._draw_instanced(shader, mesh, group)
+            else:
+                group[0].draw(shader, [mesh])
+        if blending:
+            gl_state.depth_mask(True)
+            gl_state.set_capability(GL_BLEND, False)
+        shader.set_bool("useInstancing", False)
+        queue.clear()
+
+    def _draw_instanced(self, shader, mesh, models):
+        instance_buffer = self._instance_buffers.get(mesh)
+        if instance_buffer is None:
+            instance_buffer = InstanceBuffer(len(models))
+            self._instance_buffers[mesh] = instance_buffer
 
-        shader.set_int("numPointLights", point_light_count)
+        matrices = np.array([model.get_model_matrix() for model in models], dtype=np.float32)
+        colors = np.array([model.color for model in models], dtype=np.float32)
+        instance_buffer.update(matrices, colors)
 
-        for model in self.models:
-            model.draw(shader)
\ No newline at end of file
+        #groups share their shininess, see _group_by_material
+        shader.set_float("material.shininess", models[0].shininess)
+        shader.set_float("opacity", 1.0)
+        shader.set_bool("hasTexture", len(mesh.textures) > 0)
+        mesh.draw_instanced(shader, instance_buffer)
@@ -1,4 +1,11 @@
 from OpenGL.GL import *
+import numpy as np
+from . import gl_state
+from .light_clusters import LIGHT_TEXTURE_UNITS
+from .profiler import get_profiler
+from .uniform_buffer import UNIFORM_BLOCK_BINDINGS
+
+_profiler = get_profiler()
 
 class Shader:
     def __init__(self, vertex_path, fragment_path):
@@ -25,6 +32,59 @@ class Shader:
         glDeleteShader(vertex_shader)
         glDeleteShader(fragment_shader)
 
+        self.uniforms = {}
+        #last value set per uniform name, a program keeps its uniforms between draws
+        self._values = {}
+        self._load_uniform_locations()
+        self._bind_uniform_blocks()
+        self._bind_texture_units()
+
+    #look up every active uniform once so set_* never has to ask the driver
+    def _load_uniform_locations(self):
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_UNIFORMS)):
+            name, size, _ = glGetActiveUniform(self.program, i)
+            name = name.decode()
+            location = glGetUniformLocation(self.program, name)
+            #uniforms inside a block have no location
+            if location == -1:
+                continue
+            self.uniforms[name] = location
+            if name.endswith("[0]"):
+                base = name[:-3]
+                self.uniforms[base] = location
+                for element in range(1, size):
+                    element_name = f"{base}[{element}]"
+                    self.uniforms[element_name] = glGetUniformLocation(self.program, element_name)
+
+    def _bind_uniform_blocks(self):
+        for block_name, binding in UNIFORM_BLOCK_BINDINGS.items():
+            index = glGetUniformBlockIndex(self.program, block_name)
+            if index != GL_INVALID_INDEX:
+                glUniformBlockBinding(self.program, index, binding)
+
+    #samplers of the shared light textures always read the same units, a sampler left at
+    #unit 0 would clash with the sampler2D bound there. Shaders can be created mid frame,
+    #so the program in use is put back afterwards
+    def _bind_texture_units(self):
+        current_program = gl_state.current_program()
+        gl_state.use_program(self.program)
+        for name, unit in LIGHT_TEXTURE_UNITS.items():
+            location = self.uniforms.get(name)
+            if location is not None:
+                glUniform1i(location, unit)
+        if current_program is not None:
+            gl_state.use_program(current_program)
+
+    #every set_* goes through here, so this is where uniform uploads are counted
+    def get_uniform_location(self, name):
+        _profiler.count("uniform_uploads")
+        location = self.uniforms.get(name)
+        if location is None:
+            #not active in this program, cache the -1 so we only ask once
+            location = glGetUniformLocation(self.program, name)
+            self.uniforms[name] = location
+        return location
+
     def _compile_shader(self, source, shader_type):
         shader = glCreateShader(shader_type)
         glShaderSource(shader, source)
@@ -39,31 +99,45 @@ class Shader:
         return shader
 
     def use(self):
-        glUseProgram(self.program)
+        gl_state.use_program(self.program)
+
+    #True when name does not hold value yet, repeated material uniforms skip the upload
+    def _changed(self, name, value):
+        if self._values.get(name) == value:
+            return False
+        self._values[name] = value
+        return True
 
     def set_bool(self, name, value):
-        glUniform1i(glGetUniformLocation(self.program, name), int(value))
+        value = int(value)
+        if self._changed(name, value):
+            glUniform1i(self.get_uniform_location(name), value)
 
     def set_int(self, name, value):
-        glUniform1i(glGetUniformLocation(self.program, name), value)
+        if self._changed(name, value):
+            glUniform1i(self.get_uniform_location(name), value)
 
     def set_float(self, name, value):
-        glUniform1f(glGetUniformLocation(self.program, name), value)
+        if self._changed(name, float(value)):
+            glUniform1f(self.get_uniform_location(name), value)
 
     def set_vec2(self, name, value):
-        glUniform2fv(glGetUniformLocation(self.program, name), 1, value)
+        if self._changed(name, tuple(np.asarray(value, dtype=np.float32).tolist())):
+            glUniform2fv(self.get_uniform_location(name), 1, value)
 
     def set_vec3(self, name, value):
-        glUniform3fv(glGetUniformLocation(self.program, name), 1, value)
+        if self._changed(name, tuple(np.asarray(value, dtype=np.float32).tolist())):
+            glUniform3fv(self.get_uniform_location(name), 1, value)
 
     def set_vec4(self, name, value):
-        glUniform4fv(glGetUniformLocation(self.program, name), 1, value)
+        if self._changed(name, tuple(np.asarray(value, dtype=np.float32).tolist())):
+            glUniform4fv(self.get_uniform_location(name), 1, value)
 
     def set_mat2(self, name, value):
-        glUniformMatrix2fv(glGetUniformLocation(self.program, name), 1, GL_FALSE, value)
+        glUniformMatrix2fv(self.get_uniform_location(name), 1, GL_FALSE, value)
 
     def set_mat3(self, name, value):
-        glUniformMatrix3fv(glGetUniformLocation(self.program, name), 1, GL_FALSE, value)
+        glUniformMatrix3fv(self.get_uniform_location(name), 1, GL_FALSE, value)
 
     def set_mat4(self, name, value):
-        glUniformMatrix4fv(glGetUniformLocation(self.program, name), 1, GL_FALSE, value)
\ No newline at end of file
+        glUniformMatrix4fv(self.get_uniform_location(name), 1, GL_FALSE, value)
\ No newline at end of file
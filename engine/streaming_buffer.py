@@ -0,0 +1,165 @@
+from OpenGL.GL import *
+import numpy as np
+import ctypes
+from .buffer_arena import INDEX_SIZE, VERTEX_FLOATS, VERTEX_STRIDE, setup_vertex_layout
+from .gl_state import bind_vertex_array, context_supports
+
+#regions in flight, the cpu writes one while the gpu may still read the others
+RING_SIZE = 3
+_PERSISTENT_FLAGS = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+
+
+def _merge(pending, start, end):
+    if start >= end:
+        return pending
+    if pending is None:
+        return start, end
+    return min(pending[0], start), max(pending[1], end)
+
+
+#geometry that changes often. Holds a ring of regions in its own VBO/EBO; each
+#update goes to the next region, guarded by a fence, so the cpu never waits on draws
+#still reading the previous data. Buffers are persistently mapped when the context
+#has buffer storage (GL 4.4 or ARB_buffer_storage), otherwise a single region is orphaned on every update.
+#Same draw interface as a BufferAllocation.
+class StreamingGeometry:
+    def __init__(self, vertices, indices, ring_size=RING_SIZE):
+        self.VAO = glGenVertexArrays(1)
+        self.VBO = 0
+        self.EBO = 0
+        self.persistent = context_supports((4, 4), "GL_ARB_buffer_storage")
+        self.ring_size = ring_size if self.persistent else 1
+        self.vertex_capacity = 0
+        self.index_capacity = 0
+        self.region = 0
+        self._fences = [None] * self.ring_size
+        #changed (start, end) ranges each region still has to catch up on
+        self._pending_vertices = [None] * self.ring_size
+        self._pending_indices = [None] * self.ring_size
+        self._vertex_pointer = None
+        self._index_pointer = None
+
+        self.vertex_offset = 0
+        self.vertex_count = 0
+        self.index_offset = 0
+        self.index_count = 0
+        self.update(vertices, indices)
+
+    @property
+    def index_pointer(self):
+        return ctypes.c_void_p(self.index_offset * INDEX_SIZE)
+
+    def bind(self):
+        bind_vertex_array(self.VAO)
+
+    #vertices and indices are the complete current arrays, the ranges say what
+    #changed since the last update (None means everything)
+    def update(self, vertices, indices, vertex_range=None, index_range=None):
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, VERTEX_FLOATS)
+        indices = np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1)
+        if vertex_range is None:
+            vertex_range = (0, len(vertices))
+        if index_range is None:
+            index_range = (0, len(indices))
+
+        if len(vertices) > self.vertex_capacity or len(indices) > self.index_capacity:
+            self._reallocate(max(len(vertices), self.vertex_capacity * 2),
+                             max(len(indices), self.index_capacity * 2))
+            vertex_range = (0, len(vertices))
+            index_range = (0, len(indices))
+
+        for region in range(self.ring_size):
+            self._pending_vertices[region] = _merge(self._pending_vertices[region], *vertex_range)
+            self._pending_indices[region] = _merge(self._pending_indices[region], *index_range)
+
+        self._advance()
+        if self.persistent:
+            self._write_region(vertices, indices)
+        else:
+            self._orphan(vertices, indices)
+
+        self.vertex_offset = self.region * self.vertex_capacity
+        self.index_offset = self.region * self.index_capacity
+        self.vertex_count = len(vertices)
+        self.index_count = len(indices)
+
+    #fences the region the last draws used and moves on to the next one
+    def _advance(self):
+        if self.ring_size == 1:
+            return
+        self._fences[self.region] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.region = (self.region + 1) % self.ring_size
+        fence = self._fences[self.region]
+        if fence is not None:
+            #only blocks when the gpu is a whole ring behind
+            glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+            glDeleteSync(fence)
+            self._fences[self.region] = None
+
+    #ranges left over from before a shrink are clamped to the current data
+    def _write_region(self, vertices, indices):
+        pending = self._pending_vertices[self.region]
+        if pending is not None:
+            start, end = pending[0], min(pending[1], len(vertices))
+            ctypes.memmove(self._vertex_pointer + (self.region * self.vertex_capacity + start) * VERTEX_STRIDE,
+                           vertices[start:end].ctypes.data, (end - start) * VERTEX_STRIDE)
+        pending = self._pending_indices[self.region]
+        if pending is not None:
+            start, end = pending[0], min(pending[1], len(indices))
+            ctypes.memmove(self._index_pointer + (self.region * self.index_capacity + start) * INDEX_SIZE,
+                           indices[start:end].ctypes.data, (end - start) * INDEX_SIZE)
+        self._pending_vertices[self.region] = None
+        self._pending_indices[self.region] = None
+
+    #the old storage goes to the driver, which keeps it alive for pending draws
+    def _orphan(self, vertices, indices):
+        for buffer, data, size in ((self.VBO, vertices, self.vertex_capacity * VERTEX_STRIDE),
+                                   (self.EBO, indices, self.index_capacity * INDEX_SIZE)):
+            glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+            glBufferData(GL_COPY_WRITE_BUFFER, size, None, GL_STREAM_DRAW)
+            if len(data):
+                glBufferSubData(GL_COPY_WRITE_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        self._pending_vertices[0] = None
+        self._pending_indices[0] = None
+
+    def _reallocate(self, vertex_capacity, index_capacity):
+        self._delete_buffers()
+        self.vertex_capacity = max(vertex_capacity, 1)
+        self.index_capacity = max(index_capacity, 1)
+        self.region = 0
+        self.VBO, self.EBO = glGenBuffers(2)
+        sizes = (self.vertex_capacity * VERTEX_STRIDE * self.ring_size,
+                 self.index_capacity * INDEX_SIZE * self.ring_size)
+        pointers = []
+        for buffer, size in zip((self.VBO, self.EBO), sizes):
+            glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+            if self.persistent:
+                glBufferStorage(GL_COPY_WRITE_BUFFER, size, None, _PERSISTENT_FLAGS)
+                pointers.append(glMapBufferRange(GL_COPY_WRITE_BUFFER, 0, size, _PERSISTENT_FLAGS))
+            else:
+                glBufferData(GL_COPY_WRITE_BUFFER, size, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        if self.persistent:
+            self._vertex_pointer, self._index_pointer = pointers
+
+        self.bind()
+        setup_vertex_layout(self.VBO, self.EBO)
+
+    def _delete_buffers(self):
+        for region, fence in enumerate(self._fences):
+            if fence is not None:
+                glDeleteSync(fence)
+                self._fences[region] = None
+        if self.VBO:
+            #deleting a buffer also unmaps it
+            glDeleteBuffers(2, [self.VBO, self.EBO])
+        self.VBO = self.EBO = 0
+        self._vertex_pointer = self._index_pointer = None
+
+    def release(self):
+        if self.VAO:
+            self._delete_buffers()
+            bind_vertex_array(0)
+            glDeleteVertexArrays(1, [self.VAO])
+            self.VAO = 0
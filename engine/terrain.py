@@ -0,0 +1,363 @@
+from OpenGL.GL import *
+import os
+import ctypes
+import numpy as np
+from .mesh import Mesh
+from .model import Model
+from .mesh_utils import grid_arrays, heightmap_function, sample_heights
+from .frustum import extract_frustum_planes, boxes_in_frustum
+from . import gl_state
+from .profiler import get_profiler
+from .shader import Shader
+
+#tile center to corner distance in tile sizes
+HALF_DIAGONAL = np.sqrt(0.5)
+
+#must match terrain.vert
+MAX_LOD_LEVELS = 16
+PATCH_LOCATION = 3
+#morphing to the next level starts at this fraction of a levels range
+MORPH_START = 0.75
+_CHILD_OFFSETS = np.array([[0, 0], [1, 0], [0, 1], [1, 1]], dtype=np.int64)
+
+_profiler = get_profiler()
+
+
+#terrain split into square tiles that are generated when the camera comes close
+#and dropped again once it moves away. height_function is called on whole coordinate
+#arrays, a 2d heightmap array works too and then covers width x length.
+#Without width and length the terrain is unbounded
+class Terrain:
+    def __init__(self, height_function, tile_size=32.0, tile_resolution=65, view_distance=96.0,
+                 width=None, length=None, max_tiles_per_update=2):
+        if not callable(height_function):
+            if width is None or length is None:
+                raise ValueError("A heightmap terrain needs a width and a length")
+            height_function = heightmap_function(height_function, width, length)
+        self.height_function = height_function
+        self.tile_size = tile_size
+        self.tile_resolution = tile_resolution
+        self.view_distance = view_distance
+        #tiles are only dropped this far past the view distance so they do not flicker in and out
+        self.unload_margin = tile_size
+        self.width = width
+        self.length = length
+        #tile generation per update is capped to keep frame times even
+        self.max_tiles_per_update = max_tiles_per_update
+        self.color = np.array([0.8, 0.8, 0.8])
+        self.shininess = 32.0
+        self.tiles = {}
+        self.scene = None
+
+    def set_color(self, color):
+        self.color = np.array(color, dtype=np.float32)
+
+    def _tile_range(self, center, radius):
+        low = np.floor((center - radius) / self.tile_size).astype(np.int64)
+        high = np.floor((center + radius) / self.tile_size).astype(np.int64)
+        if self.width is not None:
+            limits = np.array([self.width, self.length]) * 0.5
+            low = np.maximum(low, np.floor(-limits / self.tile_size).astype(np.int64))
+            high = np.minimum(high, np.ceil(limits / self.tile_size).astype(np.int64) - 1)
+        return low, high
+
+    #tile keys within the view distance, nearest first
+    def wanted_tiles(self, position):
+        center = np.array([position[0], position[2]], dtype=np.float64)
+        low, high = self._tile_range(center, self.view_distance)
+        if np.any(high < low):
+            return []
+        ix, iz = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1))
+        keys = np.stack([ix.reshape(-1), iz.reshape(-1)], axis=1)
+        distances = np.linalg.norm((keys + 0.5) * self.tile_size - center, axis=1)
+        keep = distances <= self.view_distance + self.tile_size * HALF_DIAGONAL
+        keys, distances = keys[keep], distances[keep]
+        return [tuple(key) for key in keys[np.argsort(distances, kind="stable")].tolist()]
+
+    def generate_tile_arrays(self, key):
+        ix, iz = key
+        x0, z0 = ix * self.tile_size, iz * self.tile_size
+        x1, z1 = x0 + self.tile_size, z0 + self.tile_size
+        if self.width is not None:
+            x0, x1 = max(x0, -self.width / 2), min(x1, self.width / 2)
+            z0, z1 = max(z0, -self.length / 2), min(z1, self.length / 2)
+        x = np.linspace(x0, x1, self.tile_resolution)
+        z = np.linspace(z0, z1, self.tile_resolution)
+        #one extra sample around the tile keeps the normals continuous across tile borders
+        x_outer = np.concatenate([[2 * x[0] - x[1]], x, [2 * x[-1] - x[-2]]])
+        z_outer = np.concatenate([[2 * z[0] - z[1]], z, [2 * z[-1] - z[-2]]])
+        heights = sample_heights(self.height_function, *np.meshgrid(x_outer, z_outer))
+        if self.width is not None:
+            uv_origin, uv_size = (-self.width / 2, -self.length / 2), (self.width, self.length)
+        else:
+            uv_origin, uv_size = (0.0, 0.0), (self.tile_size, self.tile_size)
+        return grid_arrays(x, z, heights, uv_origin, uv_size)
+
+    def _load_tile(self, key):
+        vertices, indices = self.generate_tile_arrays(key)
+        model = Model(mesh=Mesh(vertices=vertices, indices=indices))
+        model.set_color(self.color)
+        model.set_shininess(self.shininess)
+        self.tiles[key] = model
+        if self.scene is not None:
+            self.scene.add_model(model)
+
+    def _unload_tile(self, key):
+        model = self.tiles.pop(key)
+        if self.scene is not None and model in self.scene.models:
+            self.scene.remove_model(model)
+        for mesh in model.meshes:
+            mesh.delete()
+
+    #loads missing tiles near the camera and unloads far ones, called by the scene every frame
+    def update(self, position):
+        loaded = 0
+        for key in self.wanted_tiles(position):
+            if loaded >= self.max_tiles_per_update:
+                break
+            if key not in self.tiles:
+                self._load_tile(key)
+                loaded += 1
+
+        center = np.array([position[0], position[2]], dtype=np.float64)
+        limit = self.view_distance + self.unload_margin + self.tile_size * HALF_DIAGONAL
+        for key in list(self.tiles):
+            if np.linalg.norm((np.array(key) + 0.5) * self.tile_size - center) > limit:
+                self._unload_tile(key)
+        return loaded
+
+    #height at world x, z straight from the height function
+    def height_at(self, x, z):
+        return sample_heights(self.height_function, np.asarray(x, dtype=np.float64), np.asarray(z, dtype=np.float64))
+
+    def unload(self):
+        for key in list(self.tiles):
+            self._unload_tile(key)
+
+    #tiles are regular scene models, nothing extra to draw
+    def draw(self, camera, aspect_ratio, deferred=False):
+        pass
+
+
+#heightfield rendered as a camera centred quadtree of one shared grid patch (CDLOD).
+#Heights live in a float texture sampled by terrain.vert, the cpu only picks patches:
+#a node is split while it is within lod_distance node sizes of the camera, so the
+#triangle count depends on the view and not on the terrain size. Vertices morph into
+#the next coarser grid before a level ends, which keeps seams between levels closed
+class QuadtreeTerrain:
+    def __init__(self, height_function, width, length, resolution=1025, leaf_size=16.0,
+                 grid_resolution=32, lod_distance=4.0):
+        if grid_resolution % 4:
+            raise ValueError("grid_resolution must be a multiple of 4")
+        if callable(height_function):
+            x = np.linspace(-width / 2, width / 2, resolution)
+            z = np.linspace(-length / 2, length / 2, resolution)
+            heights = sample_heights(height_function, *np.meshgrid(x, z))
+        else:
+            heights = height_function
+        self.heights = np.ascontiguousarray(heights, dtype=np.float32)
+        self.width = width
+        self.length = length
+        self.origin = np.array([-width / 2, -length / 2], dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.grid_resolution = grid_resolution
+        self.color = np.array([0.8, 0.8, 0.8])
+        self.shininess = 32.0
+        self.scene = None
+
+        self.levels = int(np.ceil(np.log2(max(width, length) / leaf_size))) + 1
+        self.levels = min(max(self.levels, 1), MAX_LOD_LEVELS)
+        self.node_sizes = leaf_size * 2.0 ** np.arange(self.levels)
+        #a node is split while the camera is closer than the range of the level below it
+        self.lod_ranges = lod_distance * self.node_sizes
+        self.morph_ranges = np.full((MAX_LOD_LEVELS, 2), [1e30, 2e30], dtype=np.float32)
+        self.morph_ranges[:self.levels - 1, 0] = self.lod_ranges[:-1] * MORPH_START
+        self.morph_ranges[:self.levels - 1, 1] = self.lod_ranges[:-1]
+        self._build_height_bounds()
+
+        #full patches cover a node, half patches a quarter of one at the parents level
+        self.patch_meshes = [self._create_patch_mesh(grid_resolution), self._create_patch_mesh(grid_resolution // 2)]
+        self.patch_count = 0
+        self.triangle_count = 0
+        self.patch_VBO = glGenBuffers(1)
+        self._patch_capacity = 0
+        self._create_height_texture()
+
+        shaders_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
+        self.shader = Shader(os.path.join(shaders_dir, "terrain.vert"), os.path.join(shaders_dir, "phong.frag"))
+        #compiled on the first deferred frame
+        self.gbuffer_shader = None
+
+    def set_color(self, color):
+        self.color = np.array(color, dtype=np.float32)
+
+    @staticmethod
+    def _create_patch_mesh(resolution):
+        x = np.linspace(0.0, 1.0, resolution + 1)
+        vertices, indices = grid_arrays(x, x, np.zeros((resolution + 3, resolution + 3)))
+        return Mesh(vertices=vertices, indices=indices)
+
+    def _create_height_texture(self):
+        self.height_texture = glGenTextures(1)
+        gl_state.bind_texture(self.height_texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        rows, cols = self.heights.shape
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_R32F, cols, rows, 0, GL_RED, GL_FLOAT, self.heights)
+
+    #min / max height of every quadtree node, level 0 are the leaves. Each leaf takes
+    #the samples of its neighbour too, slightly loose but never too small for culling
+    def _build_height_bounds(self):
+        count = 2 ** (self.levels - 1)
+        rows, cols = self.heights.shape
+        edges = np.arange(count) * self.leaf_size
+        columns = np.clip(np.floor(edges / self.width * (cols - 1)), 0, cols - 1).astype(np.int64)
+        row_starts = np.clip(np.floor(edges / self.length * (rows - 1)), 0, rows - 1).astype(np.int64)
+
+        mins = np.minimum.reduceat(np.minimum.reduceat(self.heights, columns, axis=1), row_starts, axis=0)
+        maxs = np.maximum.reduceat(np.maximum.reduceat(self.heights, columns, axis=1), row_starts, axis=0)
+        mins[:, :-1] = np.minimum(mins[:, :-1], mins[:, 1:])
+        mins[:-1, :] = np.minimum(mins[:-1, :], mins[1:, :])
+        maxs[:, :-1] = np.maximum(maxs[:, :-1], maxs[:, 1:])
+        maxs[:-1, :] = np.maximum(maxs[:-1, :], maxs[1:, :])
+        #leaves past the end of the terrain hold nothing
+        mins[:, edges >= self.width] = np.inf
+        maxs[:, edges >= self.width] = -np.inf
+        mins[edges >= self.length, :] = np.inf
+        maxs[edges >= self.length, :] = -np.inf
+
+        self.min_heights = [mins]
+        self.max_heights = [maxs]
+        for _ in range(1, self.levels):
+            half = len(mins) // 2
+            mins = mins.reshape(half, 2, half, 2).min(axis=(1, 3))
+            maxs = maxs.reshape(half, 2, half, 2).max(axis=(1, 3))
+            self.min_heights.append(mins)
+            self.max_heights.append(maxs)
+
+    #nodes are (ix, iz) rows, returns their boxes as (center, half extents)
+    def _node_boxes(self, nodes, level):
+        size = self.node_sizes[level]
+        mins = self.min_heights[level][nodes[:, 1], nodes[:, 0]]
+        maxs = self.max_heights[level][nodes[:, 1], nodes[:, 0]]
+        corner = self.origin + nodes * size
+        centers = np.column_stack([corner[:, 0] + size * 0.5, (mins + maxs) * 0.5, corner[:, 1] + size * 0.5])
+        extents = np.column_stack([np.full(len(nodes), size * 0.5), (maxs - mins) * 0.5,
+                                   np.full(len(nodes), size * 0.5)])
+        return centers, extents, mins <= maxs
+
+    def _visible(self, nodes, level, planes):
+        centers, extents, valid = self._node_boxes(nodes, level)
+        return valid & boxes_in_frustum(planes, centers, extents)
+
+    def _near(self, nodes, level, eye, radius):
+        centers, extents, _ = self._node_boxes(nodes, level)
+        closest = np.clip(eye, centers - extents, centers + extents)
+        return ((closest - eye) ** 2).sum(axis=1) <= radius * radius
+
+    def _patches(self, nodes, node_level, lod_level):
+        size = self.node_sizes[node_level]
+        patches = np.empty((len(nodes), 4), dtype=np.float32)
+        patches[:, 0:2] = self.origin + nodes * size
+        patches[:, 2] = size
+        patches[:, 3] = lod_level
+        return patches
+
+    #walks the quadtree one level at a time, every level is one vectorized test.
+    #Returns (full patches, half patches) as (x, z, size, lod level) rows
+    def select_patches(self, camera, aspect_ratio):
+        planes = extract_frustum_planes(camera.get_view_matrix(), camera.get_projection_matrix(aspect_ratio))
+        eye = np.asarray(camera.position, dtype=np.float64)
+        full, half = [], []
+        nodes = np.zeros((1, 2), dtype=np.int64)
+        for level in range(self.levels - 1, -1, -1):
+            nodes = nodes[self._visible(nodes, level, planes)]
+            if level == 0:
+                full.append(self._patches(nodes, 0, 0))
+                break
+            near = self._near(nodes, level, eye, self.lod_ranges[level - 1])
+            full.append(self._patches(nodes[~near], level, level))
+
+            children = (nodes[near][:, np.newaxis, :] * 2 + _CHILD_OFFSETS).reshape(-1, 2)
+            children = children[self._visible(children, level - 1, planes)]
+            child_near = self._near(children, level - 1, eye, self.lod_ranges[level - 1])
+            #children outside the finer range keep the parents level at the parents density
+            half.append(self._patches(children[~child_near], level - 1, level))
+            nodes = children[child_near]
+        return np.concatenate(full), np.concatenate(half) if half else np.zeros((0, 4), dtype=np.float32)
+
+    def update(self, position):
+        pass
+
+    def _get_gbuffer_shader(self):
+        if self.gbuffer_shader is None:
+            shaders_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
+            self.gbuffer_shader = Shader(os.path.join(shaders_dir, "terrain.vert"),
+                                         os.path.join(shaders_dir, "gbuffer.frag"))
+        return self.gbuffer_shader
+
+    def draw(self, camera, aspect_ratio, deferred=False):
+        full, half = self.select_patches(camera, aspect_ratio)
+        patches = np.concatenate([full, half])
+        self.patch_count = len(patches)
+        if not len(patches):
+            self.triangle_count = 0
+            return
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.patch_VBO)
+        if len(patches) > self._patch_capacity:
+            self._patch_capacity = max(len(patches), self._patch_capacity * 2)
+        #orphan so the driver does not wait on last frames draws
+        glBufferData(GL_ARRAY_BUFFER, self._patch_capacity * 16, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, patches.nbytes, patches)
+
+        shader = self._get_gbuffer_shader() if deferred else self.shader
+        shader.use()
+        gl_state.bind_texture(self.height_texture, unit=0)
+        shader.set_int("heightMap", 0)
+        shader.set_vec2("terrainOrigin", self.origin)
+        shader.set_vec2("terrainSize", np.array([self.width, self.length]))
+        shader.set_vec2("heightMapSize", np.array(self.heights.shape[::-1]))
+        glUniform2fv(shader.get_uniform_location("morphRanges"), MAX_LOD_LEVELS, self.morph_ranges)
+        shader.set_vec3("objectColor", self.color)
+        shader.set_float("material.shininess", self.shininess)
+        shader.set_bool("hasTexture", False)
+
+        self.triangle_count = 0
+        first = 0
+        for mesh, resolution, count in ((self.patch_meshes[0], self.grid_resolution, len(full)),
+                                        (self.patch_meshes[1], self.grid_resolution // 2, len(half))):
+            if count:
+                allocation = mesh.allocation
+                allocation.bind()
+                glBindBuffer(GL_ARRAY_BUFFER, self.patch_VBO)
+                glVertexAttribPointer(PATCH_LOCATION, 4, GL_FLOAT, GL_FALSE, 16, ctypes.c_void_p(first * 16))
+                glEnableVertexAttribArray(PATCH_LOCATION)
+                glVertexAttribDivisor(PATCH_LOCATION, 1)
+                shader.set_float("gridResolution", resolution)
+                glDrawElementsInstancedBaseVertex(GL_TRIANGLES, allocation.index_count, GL_UNSIGNED_INT,
+                                                  allocation.index_pointer, count, allocation.vertex_offset)
+                glDisableVertexAttribArray(PATCH_LOCATION)
+                self.triangle_count += allocation.index_count // 3 * count
+                _profiler.count("draw_calls")
+            first += count
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        _profiler.count("triangles", self.triangle_count)
+        _profiler.count("instances", self.patch_count)
+
+    def unload(self):
+        pass
+
+    def delete(self):
+        for mesh in self.patch_meshes:
+            mesh.delete()
+        glDeleteBuffers(1, [self.patch_VBO])
+        gl_state.delete_textures([self.height_texture])
+        glDeleteProgram(self.shader.program)
+        if self.gbuffer_shader is not None:
+            glDeleteProgram(self.gbuffer_shader.program)
+            self.gbuffer_shader = None
+        self.patch_VBO = self.height_texture = 0
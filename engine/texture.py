@@ -1,30 +1,131 @@
 from OpenGL.GL import *
+import copy
 from PIL import Image
 import numpy as np
+from . import gl_state
+from .texture_container import GL_FORMATS, TextureContainer, decompress_container, load_container
+
+#PIL mode -> (pixel format, sized internal format, swizzle so single and two
+#channel images still sample as grey / grey + alpha)
+_IMAGE_FORMATS = {
+    "L": (GL_RED, GL_R8, (GL_RED, GL_RED, GL_RED, GL_ONE)),
+    "LA": (GL_RG, GL_RG8, (GL_RED, GL_RED, GL_RED, GL_GREEN)),
+    "RGB": (GL_RGB, GL_RGB8, None),
+    "RGBA": (GL_RGBA, GL_RGBA8, None),
+}
 
 
 class Texture:
-    def __init__(self, path, type_name="texture_diffuse"):
+    #image_data is the result of Texture.decode, pass it when the file was decoded elsewhere
+    def __init__(self, path, type_name="texture_diffuse", image_data=None):
         self.id = glGenTextures(1)
         self.type = type_name
         self.path = path
-        image = Image.open(path)
-        image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        img_data = np.array(list(image.getdata()), np.uint8)
-        if image.mode == "RGB":
-            img_format = GL_RGB
-        elif image.mode == "RGBA":
-            img_format = GL_RGBA
+        #set when the texture is shared through a TextureManager
+        self.manager = None
+        self.key = None
+        if image_data is None:
+            image_data = Texture.decode(path)
+        if isinstance(image_data, TextureContainer):
+            self._upload_container(image_data)
+        else:
+            self._upload(*image_data)
+
+    #cpu side only, safe to call from worker threads. Returns a contiguous uint8
+    #(height, width, channels) array read through the buffer protocol, never per pixel.
+    #.ptex files come back as a TextureContainer with their prebuilt mip chain
+    @staticmethod
+    def decode(path):
+        if path.lower().endswith(".ptex"):
+            return load_container(path)
+        with Image.open(path) as image:
+            image = Texture._convert_mode(image)
+            image = image.transpose(Image.FLIP_TOP_BOTTOM)
+            pixels = np.asarray(image, dtype=np.uint8)
+            mode = image.mode
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, np.newaxis]
+        return np.ascontiguousarray(pixels), pixels.shape[1], pixels.shape[0], mode
+
+    @staticmethod
+    def _convert_mode(image):
+        if image.mode in _IMAGE_FORMATS:
+            return image
+        if image.mode == "1":
+            return image.convert("L")
+        #I;16 variants, I and F, PIL would clip them at 255 converting to L
+        if image.mode.startswith("I") or image.mode == "F":
+            return Image.fromarray(Texture._normalize(np.asarray(image)))
+        #palette, CMYK, YCbCr and friends, keep alpha if the image has any. Band names
+        #are no help here, LAB has an A band that is not alpha
+        if image.mode in ("La", "PA", "RGBa") or "transparency" in image.info:
+            return image.convert("RGBA")
+        return image.convert("RGB")
+
+    #rescales high precision grey values to 0..255: 16 bit images by their full range,
+    #32 bit integer and float ones by their own range
+    @staticmethod
+    def _normalize(values):
+        if values.dtype.kind == "u" and values.dtype.itemsize == 2:
+            scaled = values / 65535.0
         else:
-            raise ValueError(f"Unsupported image format: {image.mode}")
-        glBindTexture(GL_TEXTURE_2D, self.id)
+            values = values.astype(np.float64)
+            low, high = min(values.min(), 0.0), values.max()
+            scaled = (values - low) / (high - low) if high > low else np.zeros_like(values)
+        return np.round(scaled * 255.0).astype(np.uint8)
+
+    #the same GL texture under another type name, handed out by TextureManager
+    def as_type(self, type_name):
+        handle = copy.copy(self)
+        handle.type = type_name
+        return handle
+
+    def _set_parameters(self):
+        gl_state.bind_texture(self.id)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+
+    def _upload(self, pixels, width, height, mode):
+        img_format, internal_format, swizzle = _IMAGE_FORMATS[mode]
+        self._set_parameters()
+        if swizzle:
+            glTexParameteriv(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_RGBA, swizzle)
+
+        #rows are tightly packed, GL assumes 4 byte aligned rows by default
+        row_bytes = width * pixels.shape[2]
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4 if row_bytes % 4 == 0 else 1)
         glTexImage2D(
-            GL_TEXTURE_2D, 0, img_format, image.width, image.height, 0,
-            img_format, GL_UNSIGNED_BYTE, img_data
+            GL_TEXTURE_2D, 0, internal_format, width, height, 0,
+            img_format, GL_UNSIGNED_BYTE, pixels
         )
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
         glGenerateMipmap(GL_TEXTURE_2D)
-        image.close()
\ No newline at end of file
+        #base level plus roughly a third for the mip chain
+        self.nbytes = pixels.nbytes * 4 // 3
+
+    #uploads every stored level as is, no decoding and no glGenerateMipmap. S3TC is an
+    #extension in every GL version, without it block compressed levels are decoded to rgba8
+    def _upload_container(self, container):
+        if container.compressed and not gl_state.context_supports(None, "GL_EXT_texture_compression_s3tc"):
+            container = decompress_container(container)
+        internal_format, img_format, _ = GL_FORMATS[container.format]
+        self._set_parameters()
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, 0)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(container.levels) - 1)
+
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, (width, height, data) in enumerate(container.levels):
+            if container.compressed:
+                glCompressedTexImage2D(GL_TEXTURE_2D, level, internal_format, width, height, 0, data)
+            else:
+                glTexImage2D(GL_TEXTURE_2D, level, internal_format, width, height, 0,
+                             img_format, GL_UNSIGNED_BYTE, data)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        self.nbytes = container.nbytes
+
+    def delete(self):
+        if self.id:
+            gl_state.delete_textures([self.id])
+            self.id = 0
\ No newline at end of file
@@ -0,0 +1,261 @@
+import argparse
+import struct
+import numpy as np
+from OpenGL.GL import GL_RGB, GL_RGBA, GL_RGB8, GL_RGBA8
+from OpenGL.GL.EXT.texture_compression_s3tc import (
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT)
+from PIL import Image
+
+#.ptex: a small project container holding a full, precomputed mip chain,
+#either raw or block compressed, ready to hand to glCompressedTexImage2D
+MAGIC = b"PTEX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIII")  # magic, version, format, width, height, mip count
+LEVEL_HEADER = struct.Struct("<III")  # width, height, byte size
+
+FORMAT_RGB8 = 0
+FORMAT_RGBA8 = 1
+FORMAT_BC1 = 2
+FORMAT_BC3 = 3
+
+#format -> (internal format, pixel format or None when compressed, bytes per pixel or per 4x4 block)
+GL_FORMATS = {
+    FORMAT_RGB8: (GL_RGB8, GL_RGB, 3),
+    FORMAT_RGBA8: (GL_RGBA8, GL_RGBA, 4),
+    FORMAT_BC1: (GL_COMPRESSED_RGB_S3TC_DXT1_EXT, None, 8),
+    FORMAT_BC3: (GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, None, 16),
+}
+
+COMPRESSION_FORMATS = {
+    None: None,
+    "bc1": FORMAT_BC1,
+    "bc3": FORMAT_BC3,
+}
+
+
+class TextureContainer:
+    def __init__(self, format, width, height, levels):
+        self.format = format
+        self.width = width
+        self.height = height
+        #(width, height, bytes) for every mip level, largest first
+        self.levels = levels
+
+    @property
+    def compressed(self):
+        return GL_FORMATS[self.format][1] is None
+
+    @property
+    def nbytes(self):
+        return sum(len(data) for _, _, data in self.levels)
+
+
+def load_container(path):
+    with open(path, "rb") as file:
+        magic, version, format, width, height, mip_count = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a texture container: {path}")
+        if version != VERSION or format not in GL_FORMATS:
+            raise ValueError(f"Unsupported texture container version {version} or format {format}: {path}")
+        levels = []
+        for _ in range(mip_count):
+            level_width, level_height, size = LEVEL_HEADER.unpack(file.read(LEVEL_HEADER.size))
+            levels.append((level_width, level_height, file.read(size)))
+    return TextureContainer(format, width, height, levels)
+
+
+def save_container(path, container):
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, container.format, container.width, container.height,
+                               len(container.levels)))
+        for width, height, data in container.levels:
+            file.write(LEVEL_HEADER.pack(width, height, len(data)))
+            file.write(data)
+
+
+def _blocks(pixels):
+    #pads to whole 4x4 blocks by repeating the edge and returns (blocks, 16, channels)
+    height, width, channels = pixels.shape
+    pad_y, pad_x = -height % 4, -width % 4
+    if pad_y or pad_x:
+        pixels = np.pad(pixels, ((0, pad_y), (0, pad_x), (0, 0)), mode="edge")
+        height, width = pixels.shape[0:2]
+    return pixels.reshape(height // 4, 4, width // 4, 4, channels).transpose(0, 2, 1, 3, 4).reshape(-1, 16, channels)
+
+
+def _pack_565(colors):
+    colors = np.clip(np.round(colors * np.array([31.0, 63.0, 31.0]) / 255.0), 0, [31, 63, 31]).astype(np.uint16)
+    return (colors[:, 0] << 11) | (colors[:, 1] << 5) | colors[:, 2]
+
+
+def _unpack_565(packed):
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.float32)
+
+
+def _encode_color_blocks(blocks):
+    colors = blocks[:, :, 0:3].astype(np.float32)
+    count = len(colors)
+
+    #endpoints are the extreme pixels along the main axis of the color distribution
+    centered = colors - colors.mean(axis=1, keepdims=True)
+    covariance = np.einsum("bni,bnj->bij", centered, centered)
+    axis = np.ones((count, 3), dtype=np.float32)
+    for _ in range(4):
+        axis = np.einsum("bij,bj->bi", covariance, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-8)
+    projection = np.einsum("bni,bi->bn", centered, axis)
+    rows = np.arange(count)
+    color0 = _pack_565(colors[rows, projection.argmax(axis=1)])
+    color1 = _pack_565(colors[rows, projection.argmin(axis=1)])
+
+    #color0 > color1 selects the four color mode
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+    end0 = _unpack_565(color0)
+    end1 = _unpack_565(color1)
+    palette = np.stack([end0, end1, (2.0 * end0 + end1) / 3.0, (end0 + 2.0 * end1) / 3.0], axis=1)
+
+    distances = ((colors[:, :, np.newaxis, :] - palette[:, np.newaxis, :, :]) ** 2).sum(axis=-1)
+    indices = distances.argmin(axis=-1).astype(np.uint64)
+    indices[color0 == color1] = 0
+    bits = (indices << (2 * np.arange(16, dtype=np.uint64))).sum(axis=1).astype(np.uint32)
+
+    encoded = np.empty(count, dtype=[("color0", "<u2"), ("color1", "<u2"), ("indices", "<u4")])
+    encoded["color0"] = color0
+    encoded["color1"] = color1
+    encoded["indices"] = bits
+    return encoded
+
+
+def _encode_alpha_blocks(blocks):
+    alpha = blocks[:, :, 3].astype(np.float32)
+    alpha0 = alpha.max(axis=1)
+    alpha1 = alpha.min(axis=1)
+    #alpha0 > alpha1 selects six interpolated values between the endpoints
+    weights = np.array([0, 7, 1, 2, 3, 4, 5, 6], dtype=np.float32) / 7.0
+    palette = np.round(alpha0[:, np.newaxis] * (1.0 - weights) + alpha1[:, np.newaxis] * weights)
+
+    indices = np.abs(alpha[:, :, np.newaxis] - palette[:, np.newaxis, :]).argmin(axis=-1).astype(np.uint64)
+    indices[alpha0 == alpha1] = 0
+    bits = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1)
+
+    encoded = np.empty((len(alpha), 8), dtype=np.uint8)
+    encoded[:, 0] = alpha0
+    encoded[:, 1] = alpha1
+    encoded[:, 2:8] = bits[:, np.newaxis].view(np.uint8).reshape(-1, 8)[:, 0:6]
+    return encoded
+
+
+#encodes in chunks so a 4k texture does not need gigabytes of temporaries
+def compress_pixels(pixels, format, chunk_blocks=1 << 16):
+    blocks = _blocks(pixels)
+    encoded = []
+    for start in range(0, len(blocks), chunk_blocks):
+        chunk = blocks[start:start + chunk_blocks]
+        color = _encode_color_blocks(chunk).view(np.uint8).reshape(-1, 8)
+        if format == FORMAT_BC3:
+            color = np.concatenate([_encode_alpha_blocks(chunk), color], axis=1)
+        encoded.append(color)
+    return np.concatenate(encoded).tobytes()
+
+
+def _decode_color_blocks(data, four_color):
+    encoded = np.frombuffer(data, dtype=[("color0", "<u2"), ("color1", "<u2"), ("indices", "<u4")])
+    color0, color1 = encoded["color0"], encoded["color1"]
+    end0 = _unpack_565(color0)
+    end1 = _unpack_565(color1)
+    #bc1 blocks with color0 <= color1 have three colors and transparent black
+    four = (color0 > color1) | four_color
+    third = np.where(four[:, np.newaxis], (2.0 * end0 + end1) / 3.0, (end0 + end1) / 2.0)
+    fourth = np.where(four[:, np.newaxis], (end0 + 2.0 * end1) / 3.0, 0.0)
+    palette = np.concatenate([np.stack([end0, end1, third, fourth], axis=1),
+                              np.full((len(encoded), 4, 1), 255.0, dtype=np.float32)], axis=2)
+    palette[~four, 3, 3] = 0.0
+    indices = (encoded["indices"][:, np.newaxis] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    return palette[np.arange(len(encoded))[:, np.newaxis], indices]
+
+
+def _decode_alpha_blocks(data):
+    alpha0, alpha1 = data[:, 0].astype(np.float32), data[:, 1].astype(np.float32)
+    weights = np.arange(1, 7, dtype=np.float32) / 7.0
+    eight = alpha0[:, np.newaxis] * (1.0 - weights) + alpha1[:, np.newaxis] * weights
+    #alpha0 <= alpha1 has four steps between the endpoints plus 0 and 255
+    weights = np.arange(1, 5, dtype=np.float32) / 5.0
+    six = np.concatenate([alpha0[:, np.newaxis] * (1.0 - weights) + alpha1[:, np.newaxis] * weights,
+                          np.zeros((len(data), 1)), np.full((len(data), 1), 255.0)], axis=1)
+    palette = np.concatenate([alpha0[:, np.newaxis], alpha1[:, np.newaxis],
+                              np.where((alpha0 > alpha1)[:, np.newaxis], eight, six)], axis=1)
+    bits = np.zeros((len(data), 8), dtype=np.uint8)
+    bits[:, 0:6] = data[:, 2:8]
+    indices = (bits.view("<u8") >> (3 * np.arange(16, dtype=np.uint64))) & 7
+    return palette[np.arange(len(data))[:, np.newaxis], indices.astype(np.intp)]
+
+
+#decodes one block compressed level to (height, width, 4) uint8 rgba
+def decompress_pixels(data, width, height, format):
+    blocks_x, blocks_y = (width + 3) // 4, (height + 3) // 4
+    data = np.frombuffer(data, dtype=np.uint8).reshape(blocks_x * blocks_y, -1)
+    if format == FORMAT_BC3:
+        pixels = _decode_color_blocks(data[:, 8:16].tobytes(), True)
+        pixels[:, :, 3] = _decode_alpha_blocks(data[:, 0:8])
+    else:
+        pixels = _decode_color_blocks(data.tobytes(), False)
+    pixels = np.clip(np.round(pixels), 0, 255).astype(np.uint8)
+    pixels = pixels.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return pixels.reshape(blocks_y * 4, blocks_x * 4, 4)[:height, :width]
+
+
+#rgba8 copy of a block compressed container, for contexts without s3tc
+def decompress_container(container):
+    levels = [(width, height, decompress_pixels(data, width, height, container.format).tobytes())
+              for width, height, data in container.levels]
+    return TextureContainer(FORMAT_RGBA8, container.width, container.height, levels)
+
+
+def build_container(image, compression=None):
+    format = COMPRESSION_FORMATS[compression]
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha or format == FORMAT_BC3 else "RGB")
+    if format is None:
+        format = FORMAT_RGBA8 if image.mode == "RGBA" else FORMAT_RGB8
+    #same orientation as Texture.decode
+    image = image.transpose(Image.FLIP_TOP_BOTTOM)
+
+    levels = []
+    width, height = image.size
+    while True:
+        pixels = np.asarray(image, dtype=np.uint8)
+        if GL_FORMATS[format][1] is None:
+            data = compress_pixels(pixels, format)
+        else:
+            data = pixels.tobytes()
+        levels.append((width, height, data))
+        if width == 1 and height == 1:
+            break
+        width, height = max(1, width // 2), max(1, height // 2)
+        image = image.resize((width, height), Image.BOX)
+    return TextureContainer(format, levels[0][0], levels[0][1], levels)
+
+
+def convert_image(source_path, target_path, compression=None):
+    with Image.open(source_path) as image:
+        container = build_container(image, compression)
+    save_container(target_path, container)
+    return container
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert images into .ptex mip chains")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--compression", choices=["bc1", "bc3"], default=None)
+    args = parser.parse_args()
+    container = convert_image(args.source, args.target, args.compression)
+    print(f"{args.target}: {len(container.levels)} levels, {container.nbytes} bytes")
+
+
+if __name__ == "__main__":
+    main()
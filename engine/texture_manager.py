@@ -0,0 +1,99 @@
+import os
+from collections import OrderedDict
+from .texture import Texture
+
+
+#hands out shared, reference counted textures. Textures nobody uses stay
+#resident until the VRAM budget is exceeded, then the least recently used go first.
+#One file is one GL texture whatever it is used as, every type name gets its own
+#handle onto it and all handles share the reference count
+class TextureManager:
+    def __init__(self, budget_bytes=512 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._textures = {}
+        #(key, type name) -> handle
+        self._handles = {}
+        self._ref_counts = {}
+        self._unused = OrderedDict()
+
+    #decoding only depends on the file, so the path alone names the GL texture
+    @staticmethod
+    def make_key(path):
+        return os.path.realpath(path)
+
+    def __contains__(self, key):
+        return key in self._textures
+
+    def __len__(self):
+        return len(self._textures)
+
+    #image_data from Texture.decode skips decoding when the texture is not resident yet
+    def acquire(self, path, type_name="texture_diffuse", image_data=None):
+        key = self.make_key(path)
+        texture = self._textures.get(key)
+        if texture is None:
+            texture = Texture(path, type_name, image_data)
+            texture.manager = self
+            texture.key = key
+            self._textures[key] = texture
+            self._handles[key, type_name] = texture
+            self._ref_counts[key] = 0
+            self.used_bytes += texture.nbytes
+        handle = self._handles.get((key, type_name))
+        if handle is None:
+            handle = self._handles[key, type_name] = texture.as_type(type_name)
+        self.retain(handle)
+        self._evict()
+        return handle
+
+    def retain(self, texture):
+        self._ref_counts[texture.key] += 1
+        self._unused.pop(texture.key, None)
+
+    def release(self, texture):
+        key = texture.key
+        if key not in self._ref_counts:
+            return
+        self._ref_counts[key] -= 1
+        if self._ref_counts[key] <= 0:
+            self._ref_counts[key] = 0
+            self._unused[key] = None
+            self._unused.move_to_end(key)
+            self._evict()
+
+    def set_budget(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._evict()
+
+    def _evict(self):
+        while self.used_bytes > self.budget_bytes and self._unused:
+            key, _ = self._unused.popitem(last=False)
+            self._remove(key)
+
+    def _remove(self, key):
+        texture = self._textures.pop(key)
+        del self._ref_counts[key]
+        self._unused.pop(key, None)
+        self.used_bytes -= texture.nbytes
+        for handle_key in [handle_key for handle_key in self._handles if handle_key[0] == key]:
+            handle = self._handles.pop(handle_key)
+            handle.manager = None
+            if handle is not texture:
+                handle.id = 0
+        texture.delete()
+
+    #frees every unused texture right away, regardless of the budget
+    def purge(self):
+        for key in list(self._unused):
+            self._remove(key)
+
+
+_texture_manager = None
+
+
+def get_texture_manager():
+    global _texture_manager
+    if _texture_manager is None:
+        _texture_manager = TextureManager()
+    return _texture_manager
@@ -0,0 +1,40 @@
+import numpy as np
+
+#a transform is stored as 9 floats: position xyz, rotation xyz in degrees, scale xyz
+TRANSFORM_SIZE = 9
+
+
+def compose_model_matrices(transforms):
+    #builds scale * rot_x * rot_y * rot_z * translation for every row at once,
+    #same (row vector) convention as pyrr.matrix44
+    transforms = np.asarray(transforms, dtype=np.float32).reshape(-1, TRANSFORM_SIZE)
+    position = transforms[:, 0:3]
+    angles = np.radians(transforms[:, 3:6])
+    scale = transforms[:, 6:9]
+
+    cx, cy, cz = np.cos(angles).T
+    sx, sy, sz = np.sin(angles).T
+
+    matrices = np.zeros((len(transforms), 4, 4), dtype=np.float32)
+    matrices[:, 0, 0] = cy * cz
+    matrices[:, 0, 1] = -cy * sz
+    matrices[:, 0, 2] = sy
+    matrices[:, 1, 0] = sx * sy * cz + cx * sz
+    matrices[:, 1, 1] = -sx * sy * sz + cx * cz
+    matrices[:, 1, 2] = -sx * cy
+    matrices[:, 2, 0] = -cx * sy * cz + sx * sz
+    matrices[:, 2, 1] = cx * sy * sz + sx * cz
+    matrices[:, 2, 2] = cx * cy
+    matrices[:, 0:3, 0:3] *= scale[:, :, np.newaxis]
+    matrices[:, 3, 0:3] = position
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def transform_bounds(centers, extents, matrices):
+    #moves local axis aligned boxes (center, half extents) into world space,
+    #the result is the box around the transformed box
+    linear = matrices[:, 0:3, 0:3]
+    world_centers = np.einsum("ni,nij->nj", centers, linear) + matrices[:, 3, 0:3]
+    world_extents = np.einsum("ni,nij->nj", extents, np.abs(linear))
+    return world_centers, world_extents
@@ -0,0 +1,36 @@
+from OpenGL.GL import *
+from .profiler import get_profiler
+
+#binding points shared by every shader that declares these std140 blocks
+UNIFORM_BLOCK_BINDINGS = {
+    "Frame": 0,
+    "Lights": 1,
+}
+
+#Frame block: mat4 view, mat4 projection, vec4 viewPos, vec4 viewport (width, height, near, far)
+FRAME_BLOCK_FLOATS = 16 + 16 + 4 + 4
+
+_profiler = get_profiler()
+
+
+class UniformBuffer:
+    def __init__(self, block_name, size):
+        self.binding = UNIFORM_BLOCK_BINDINGS[block_name]
+        self.size = size
+        self.UBO = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.UBO)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.binding, self.UBO)
+
+    #data is a float32 array laid out by the caller following std140 rules
+    def update(self, data):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.UBO)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        _profiler.count("uniform_uploads")
+        _profiler.count("uniform_bytes", data.nbytes)
+
+    def delete(self):
+        glDeleteBuffers(1, [self.UBO])
+        self.UBO = 0
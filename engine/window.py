@@ -1,5 +1,7 @@
 import glfw
 from OpenGL.GL import *
+from . import gl_state
+from .offscreen import read_framebuffer
 
 
 class Window:
@@ -16,14 +18,20 @@ class Window:
             raise Exception("Failed to create GLFW window")
         glfw.make_context_current(self.window)
         glfw.set_framebuffer_size_callback(self.window, self._framebuffer_size_callback)
-        glEnable(GL_DEPTH_TEST)
+        #a new context, nothing cached so far is valid
+        gl_state.reset()
+        gl_state.set_capability(GL_DEPTH_TEST, True)
 
-        glEnable(GL_CULL_FACE)
-        glCullFace(GL_BACK)
+        gl_state.set_capability(GL_CULL_FACE, True)
+        gl_state.cull_face(GL_BACK)
 
-        self.width = width
-        self.height = height
+        #framebuffer pixels, on HiDPI displays these are more than the window size asked for.
+        #The viewport, cluster lookup and G-buffer all work in them
+        self.width, self.height = glfw.get_framebuffer_size(self.window)
+        #default framebuffer, offscreen windows render into their own
+        self.framebuffer = 0
 
+        #the cursor is in window coordinates
         self.last_x = width / 2
         self.last_y = height / 2
         self.first_mouse = True
@@ -106,6 +114,10 @@ class Window:
         glClearColor(r, g, b, a)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
+    #call before swap_buffers, the back buffer is undefined afterwards
+    def read_pixels(self, alpha=False):
+        return read_framebuffer(self.framebuffer, self.width, self.height, alpha)
+
     def swap_buffers(self):
         glfw.swap_buffers(self.window)
 
@@ -115,5 +127,8 @@ class Window:
     def get_aspect_ratio(self):
         return self.width / self.height
 
+    def set_title(self, title):
+        glfw.set_window_title(self.window, title)
+
     def set_cursor_mode(self, mode):
         glfw.set_input_mode(self.window, glfw.CURSOR, mode)
\ No newline at end of file
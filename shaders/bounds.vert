@@ -0,0 +1,20 @@
+#version 330 core
+layout (location = 0) in vec3 aPos;
+
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
+};
+
+// World space box, aPos runs over the corners of the -1..1 cube
+uniform vec3 boxCenter;
+uniform vec3 boxExtents;
+
+void main()
+{
+    gl_Position = projection * view * vec4(boxCenter + aPos * boxExtents, 1.0);
+}
@@ -0,0 +1,81 @@
+#version 330 core
+out vec4 FragColor;
+
+// Light structs follow std140 rules, so every member is a vec4
+struct DirLight {
+    vec4 direction;
+
+    vec4 ambient;
+    vec4 diffuse;
+    vec4 specular;
+};
+
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
+};
+
+layout (std140) uniform Lights
+{
+    DirLight dirLight;
+    // x = point and spot light count, y = has dir light
+    ivec4 lightCounts;
+    // cluster grid: screen tiles in x and y, depth slices in z
+    ivec4 clusterSize;
+    // x = scale, y = bias turning log(view depth) into a depth slice
+    vec4 clusterDepth;
+};
+
+// G-buffer: normal + shininess, albedo and depth
+uniform sampler2D gNormal;
+uniform sampler2D gAlbedo;
+uniform sampler2D gDepth;
+uniform mat4 inverseViewProjection;
+
+// Function prototypes
+vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, float shininess);
+
+void main()
+{
+    ivec2 texel = ivec2(gl_FragCoord.xy);
+    vec4 albedo = texelFetch(gAlbedo, texel, 0);
+    // Nothing was drawn here, keep the clear color
+    if (albedo.a == 0.0)
+        discard;
+
+    float depth = texelFetch(gDepth, texel, 0).r;
+    vec4 position = inverseViewProjection * vec4(vec3(gl_FragCoord.xy / viewport.xy, depth) * 2.0 - 1.0, 1.0);
+    vec3 fragPos = position.xyz / position.w;
+    vec4 normal = texelFetch(gNormal, texel, 0);
+    vec3 viewDir = normalize(viewPos.xyz - fragPos);
+
+    vec3 result = vec3(0.0);
+    if (lightCounts.y != 0)
+        result += CalcDirLight(dirLight, normal.xyz, viewDir, normal.w);
+
+    FragColor = vec4(result, 1.0) * albedo;
+}
+
+// Calculates the color when using a directional light
+vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, float shininess)
+{
+    vec3 lightDir = normalize(-light.direction.xyz);
+
+    // Diffuse shading
+    float diff = max(dot(normal, lightDir), 0.0);
+
+    // Specular shading
+    vec3 reflectDir = reflect(-lightDir, normal);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), shininess);
+
+    // Combine results
+    vec3 ambient = light.ambient.rgb;
+    vec3 diffuse = light.diffuse.rgb * diff;
+    vec3 specular = light.specular.rgb * spec;
+
+    return (ambient + diffuse + specular);
+}
@@ -0,0 +1,15 @@
+#version 330 core
+out vec4 FragColor;
+
+uniform sampler2D gAlbedo;
+uniform sampler2D lightAccumulation;
+
+void main()
+{
+    ivec2 texel = ivec2(gl_FragCoord.xy);
+    // Nothing was drawn here, keep the clear color
+    if (texelFetch(gAlbedo, texel, 0).a == 0.0)
+        discard;
+
+    FragColor = vec4(texelFetch(lightAccumulation, texel, 0).rgb, 1.0);
+}
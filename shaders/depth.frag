@@ -0,0 +1,6 @@
+#version 330 core
+// Writes depth only, for the depth pre-pass and the occlusion query boxes
+
+void main()
+{
+}
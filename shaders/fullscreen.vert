@@ -0,0 +1,8 @@
+#version 330 core
+// One triangle covering the screen, built from gl_VertexID without any vertex buffer
+
+void main()
+{
+    vec2 position = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+    gl_Position = vec4(position * 2.0 - 1.0, 0.0, 1.0);
+}
@@ -0,0 +1,25 @@
+#version 330 core
+// Normal and shininess, albedo with alpha marking covered pixels; the lighting passes
+// rebuild the position from depth
+layout (location = 0) out vec4 gNormal;
+layout (location = 1) out vec4 gAlbedo;
+
+struct Material {
+    sampler2D texture_diffuse1;
+    sampler2D texture_specular1;
+    float shininess;
+};
+
+in vec3 FragPos;
+in vec3 Normal;
+in vec2 TexCoords;
+in vec3 ObjectColor;
+
+uniform Material material;
+
+void main()
+{
+    gNormal = vec4(normalize(Normal), material.shininess);
+    // If no texture is bound, use the object color
+    gAlbedo = vec4(ObjectColor, 1.0);
+}
@@ -0,0 +1,95 @@
+#version 330 core
+out vec4 FragColor;
+
+// Point and spot lights are LOCAL_LIGHT_TEXELS texels each in lightData:
+// position + radius, direction + isSpot, ambient + cutOff, diffuse + outerCutOff,
+// specular, attenuation (x = constant, y = linear, z = quadratic)
+#define LOCAL_LIGHT_TEXELS 6
+
+flat in int LightIndex;
+
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
+};
+
+uniform samplerBuffer lightData;
+
+// G-buffer: normal + shininess, albedo and depth
+uniform sampler2D gNormal;
+uniform sampler2D gAlbedo;
+uniform sampler2D gDepth;
+uniform mat4 inverseViewProjection;
+
+// Function prototypes
+vec3 CalcLocalLight(int index, vec3 normal, vec3 fragPos, vec3 viewDir, float shininess);
+
+void main()
+{
+    ivec2 texel = ivec2(gl_FragCoord.xy);
+    float depth = texelFetch(gDepth, texel, 0).r;
+    vec4 albedo = texelFetch(gAlbedo, texel, 0);
+    // Only the back faces are drawn, the scene has to lie in front of them
+    if (albedo.a == 0.0 || depth >= gl_FragCoord.z)
+        discard;
+
+    vec4 position = inverseViewProjection * vec4(vec3(gl_FragCoord.xy / viewport.xy, depth) * 2.0 - 1.0, 1.0);
+    vec3 fragPos = position.xyz / position.w;
+    // Covered by the volume on screen but out of the light's reach
+    vec4 light = texelFetch(lightData, LightIndex * LOCAL_LIGHT_TEXELS);
+    if (distance(light.xyz, fragPos) >= light.w)
+        discard;
+
+    vec4 normal = texelFetch(gNormal, texel, 0);
+    vec3 viewDir = normalize(viewPos.xyz - fragPos);
+    vec3 result = CalcLocalLight(LightIndex, normal.xyz, fragPos, viewDir, normal.w);
+
+    FragColor = vec4(result, 1.0) * albedo;
+}
+
+// Calculates the color of a point or spot light from its texels in lightData
+vec3 CalcLocalLight(int index, vec3 normal, vec3 fragPos, vec3 viewDir, float shininess)
+{
+    int base = index * LOCAL_LIGHT_TEXELS;
+    vec4 position = texelFetch(lightData, base);
+    vec4 direction = texelFetch(lightData, base + 1);
+    vec4 ambientColor = texelFetch(lightData, base + 2);
+    vec4 diffuseColor = texelFetch(lightData, base + 3);
+    vec3 specularColor = texelFetch(lightData, base + 4).rgb;
+    vec3 factors = texelFetch(lightData, base + 5).xyz;
+
+    vec3 lightDir = normalize(position.xyz - fragPos);
+
+    // Diffuse shading
+    float diff = max(dot(normal, lightDir), 0.0);
+
+    // Specular shading
+    vec3 reflectDir = reflect(-lightDir, normal);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), shininess);
+
+    // Attenuation
+    float distance = length(position.xyz - fragPos);
+    float attenuation = 1.0 / (factors.x + factors.y * distance + factors.z * (distance * distance));
+    // Fades to zero at the radius, the volume only has to cover the radius
+    float falloff = clamp(1.0 - pow(distance / position.w, 4.0), 0.0, 1.0);
+    attenuation *= falloff * falloff;
+
+    // Spot lights fade out between the inner and outer cone
+    if (direction.w != 0.0)
+    {
+        float theta = dot(lightDir, normalize(-direction.xyz));
+        float epsilon = ambientColor.w - diffuseColor.w;
+        attenuation *= clamp((theta - diffuseColor.w) / epsilon, 0.0, 1.0);
+    }
+
+    // Combine results
+    vec3 ambient = ambientColor.rgb;
+    vec3 diffuse = diffuseColor.rgb * diff;
+    vec3 specular = specularColor * spec;
+
+    return (ambient + diffuse + specular) * attenuation;
+}
@@ -0,0 +1,22 @@
+#version 330 core
+layout (location = 0) in vec3 aPos;
+// Per light: bounding sphere (center, radius) and index into lightData
+layout (location = 3) in vec4 aLightSphere;
+layout (location = 4) in float aLightIndex;
+
+flat out int LightIndex;
+
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
+};
+
+void main()
+{
+    LightIndex = int(aLightIndex + 0.5);
+    gl_Position = projection * view * vec4(aLightSphere.xyz + aPos * aLightSphere.w, 1.0);
+}
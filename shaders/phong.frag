@@ -7,105 +7,150 @@ struct Material {
     float shininess;
 }; 
 
+// Light structs follow std140 rules, so every member is a vec4
 struct DirLight {
-    vec3 direction;
+    vec4 direction;
 
-    vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
+    vec4 ambient;
+    vec4 diffuse;
+    vec4 specular;
 };
 
-struct PointLight {
-    vec3 position;
+// Point and spot lights are LOCAL_LIGHT_TEXELS texels each in lightData:
+// position + radius, direction + isSpot, ambient + cutOff, diffuse + outerCutOff,
+// specular, attenuation (x = constant, y = linear, z = quadratic)
+#define LOCAL_LIGHT_TEXELS 6
 
-    float constant;
-    float linear;
-    float quadratic;
+in vec3 FragPos;
+in vec3 Normal;
+in vec2 TexCoords;
+in vec3 ObjectColor;
 
-    vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
 };
 
-#define MAX_POINT_LIGHTS 4
+layout (std140) uniform Lights
+{
+    DirLight dirLight;
+    // x = point and spot light count, y = has dir light
+    ivec4 lightCounts;
+    // cluster grid: screen tiles in x and y, depth slices in z
+    ivec4 clusterSize;
+    // x = scale, y = bias turning log(view depth) into a depth slice
+    vec4 clusterDepth;
+};
 
-in vec3 FragPos;
-in vec3 Normal;
-in vec2 TexCoords;
+uniform samplerBuffer lightData;
+// x = offset into lightIndices, y = light count, one texel per cluster
+uniform usamplerBuffer clusterLights;
+uniform usamplerBuffer lightIndices;
 
-uniform vec3 viewPos;
 uniform Material material;
-uniform DirLight dirLight;
-uniform PointLight pointLights[MAX_POINT_LIGHTS];
-uniform int numPointLights;
+// Below 1.0 the scene draws the model blended, after everything opaque
+uniform float opacity = 1.0;
 
 // Function prototypes
 vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir);
-vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
+int FindCluster(vec3 fragPos);
+vec3 CalcLocalLight(int index, vec3 normal, vec3 fragPos, vec3 viewDir);
 
 void main()
 {    
     // Properties
     vec3 norm = normalize(Normal);
-    vec3 viewDir = normalize(viewPos - FragPos);
+    vec3 viewDir = normalize(viewPos.xyz - FragPos);
 
     // Phase 1: Directional lighting
-    vec3 result = CalcDirLight(dirLight, norm, viewDir);
+    vec3 result = vec3(0.0);
+    if (lightCounts.y != 0)
+        result += CalcDirLight(dirLight, norm, viewDir);
 
-    // Phase 2: Point lights
-    for(int i = 0; i < 1; i++)
-        result += CalcPointLight(pointLights[i], norm, FragPos, viewDir);    
+    // Phase 2: Point and spot lights binned into this fragment's cluster
+    uvec2 cluster = texelFetch(clusterLights, FindCluster(FragPos)).xy;
+    for(uint i = 0u; i < cluster.y; i++)
+        result += CalcLocalLight(int(texelFetch(lightIndices, int(cluster.x + i)).r), norm, FragPos, viewDir);
 
-    // If no texture is bound, use a default color
-    vec4 texColor = vec4(0.8, 0.8, 0.8, 1.0);
+    // If no texture is bound, use the object color
+    vec4 texColor = vec4(ObjectColor, 1.0);
 
-    FragColor = vec4(result, 1.0) * texColor;
+    FragColor = vec4(result, opacity) * texColor;
 }
 
 // Calculates the color when using a directional light
 vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir)
 {
-    vec3 lightDir = normalize(-light.direction);
+    vec3 lightDir = normalize(-light.direction.xyz);
 
     // Diffuse shading
     float diff = max(dot(normal, lightDir), 0.0);
 
     // Specular shading
     vec3 reflectDir = reflect(-lightDir, normal);
-    float spec = pow(max(dot(viewDir, reflectDir), 0.0), 32.0);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), material.shininess);
 
     // Combine results
-    vec3 ambient = light.ambient;
-    vec3 diffuse = light.diffuse * diff;
-    vec3 specular = light.specular * spec;
+    vec3 ambient = light.ambient.rgb;
+    vec3 diffuse = light.diffuse.rgb * diff;
+    vec3 specular = light.specular.rgb * spec;
 
     return (ambient + diffuse + specular);
 }
 
-// Calculates the color when using a point light
-vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
+// Index of the cluster holding this fragment, same binning as LightClusters.assign
+int FindCluster(vec3 fragPos)
+{
+    float viewDepth = -(view * vec4(fragPos, 1.0)).z;
+    ivec3 cell = ivec3(gl_FragCoord.xy / viewport.xy * vec2(clusterSize.xy),
+                       floor(log(max(viewDepth, viewport.z)) * clusterDepth.x + clusterDepth.y));
+    cell = clamp(cell, ivec3(0), clusterSize.xyz - 1);
+    return (cell.z * clusterSize.y + cell.y) * clusterSize.x + cell.x;
+}
+
+// Calculates the color of a point or spot light from its texels in lightData
+vec3 CalcLocalLight(int index, vec3 normal, vec3 fragPos, vec3 viewDir)
 {
-    vec3 lightDir = normalize(light.position - fragPos);
+    int base = index * LOCAL_LIGHT_TEXELS;
+    vec4 position = texelFetch(lightData, base);
+    vec4 direction = texelFetch(lightData, base + 1);
+    vec4 ambientColor = texelFetch(lightData, base + 2);
+    vec4 diffuseColor = texelFetch(lightData, base + 3);
+    vec3 specularColor = texelFetch(lightData, base + 4).rgb;
+    vec3 factors = texelFetch(lightData, base + 5).xyz;
+
+    vec3 lightDir = normalize(position.xyz - fragPos);
 
     // Diffuse shading
     float diff = max(dot(normal, lightDir), 0.0);
 
     // Specular shading
     vec3 reflectDir = reflect(-lightDir, normal);
-    float spec = pow(max(dot(viewDir, reflectDir), 0.0), 32.0);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), material.shininess);
 
     // Attenuation
-    float distance = length(light.position - fragPos);
-    float attenuation = 1.0 / (light.constant + light.linear * distance + light.quadratic * (distance * distance));    
+    float distance = length(position.xyz - fragPos);
+    float attenuation = 1.0 / (factors.x + factors.y * distance + factors.z * (distance * distance));
+    // Fades to zero at the radius so lights left out of a cluster add nothing there
+    float falloff = clamp(1.0 - pow(distance / position.w, 4.0), 0.0, 1.0);
+    attenuation *= falloff * falloff;
+
+    // Spot lights fade out between the inner and outer cone
+    if (direction.w != 0.0)
+    {
+        float theta = dot(lightDir, normalize(-direction.xyz));
+        float epsilon = ambientColor.w - diffuseColor.w;
+        attenuation *= clamp((theta - diffuseColor.w) / epsilon, 0.0, 1.0);
+    }
 
     // Combine results
-    vec3 ambient = light.ambient;
-    vec3 diffuse = light.diffuse * diff;
-    vec3 specular = light.specular * spec;
-
-    ambient *= attenuation;
-    diffuse *= attenuation;
-    specular *= attenuation;
+    vec3 ambient = ambientColor.rgb;
+    vec3 diffuse = diffuseColor.rgb * diff;
+    vec3 specular = specularColor * spec;
 
-    return (ambient + diffuse + specular);
+    return (ambient + diffuse + specular) * attenuation;
 }
\ No newline at end of file
@@ -2,19 +2,38 @@
 layout (location = 0) in vec3 aPos;
 layout (location = 1) in vec3 aNormal;
 layout (location = 2) in vec2 aTexCoords;
+// Per instance attributes, only read when useInstancing is set
+layout (location = 3) in mat4 aInstanceModel;
+layout (location = 7) in vec3 aInstanceColor;
 
 out vec3 FragPos;
 out vec3 Normal;
 out vec2 TexCoords;
+out vec3 ObjectColor;
+
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
+};
+
+// The depth pre-pass runs this shader in another program, both have to agree on depth
+invariant gl_Position;
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+uniform vec3 objectColor;
+uniform bool useInstancing;
 
 void main()
 {
-    FragPos = vec3(model * vec4(aPos, 1.0));
-    Normal = mat3(transpose(inverse(model))) * aNormal;  
+    mat4 modelMatrix = useInstancing ? aInstanceModel : model;
+    ObjectColor = useInstancing ? aInstanceColor : objectColor;
+
+    FragPos = vec3(modelMatrix * vec4(aPos, 1.0));
+    Normal = mat3(transpose(inverse(modelMatrix))) * aNormal;  
     TexCoords = aTexCoords;
 
     gl_Position = projection * view * vec4(FragPos, 1.0);
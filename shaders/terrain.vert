@@ -0,0 +1,72 @@
+#version 330 core
+// Grid patch corner in [0, 1] on x and z, shared by every patch
+layout (location = 0) in vec3 aPos;
+// Per patch: x, z of the patch corner, patch size, lod level
+layout (location = 3) in vec4 aPatch;
+
+out vec3 FragPos;
+out vec3 Normal;
+out vec2 TexCoords;
+out vec3 ObjectColor;
+
+layout (std140) uniform Frame
+{
+    mat4 view;
+    mat4 projection;
+    vec4 viewPos;
+    // xy = framebuffer size in pixels, z = near plane, w = far plane
+    vec4 viewport;
+};
+
+#define MAX_LOD_LEVELS 16
+
+uniform sampler2D heightMap;
+uniform vec2 terrainOrigin;
+uniform vec2 terrainSize;
+uniform vec2 heightMapSize;
+// cells per patch side of the grid being drawn
+uniform float gridResolution;
+// per lod level: distance where morphing to the next level starts and ends
+uniform vec2 morphRanges[MAX_LOD_LEVELS];
+uniform vec3 objectColor;
+
+vec2 terrainUV(vec2 world)
+{
+    vec2 uv = (world - terrainOrigin) / terrainSize;
+    // texel centres, so the corners of the terrain hit the corner samples
+    return (uv * (heightMapSize - 1.0) + 0.5) / heightMapSize;
+}
+
+float sampleHeight(vec2 world)
+{
+    return textureLod(heightMap, terrainUV(world), 0.0).r;
+}
+
+void main()
+{
+    vec2 grid = aPos.xz * gridResolution;
+    vec2 world = clamp(aPatch.xy + aPos.xz * aPatch.z, terrainOrigin, terrainOrigin + terrainSize);
+    float height = sampleHeight(world);
+
+    // odd grid vertices slide onto their even neighbours as the patch nears the
+    // next coarser level, so neighbouring levels meet without cracks
+    vec2 range = morphRanges[int(aPatch.w)];
+    float morph = clamp((distance(viewPos.xyz, vec3(world.x, height, world.y)) - range.x) / (range.y - range.x), 0.0, 1.0);
+    grid -= fract(grid * 0.5) * 2.0 * morph;
+
+    world = clamp(aPatch.xy + grid / gridResolution * aPatch.z, terrainOrigin, terrainOrigin + terrainSize);
+    height = sampleHeight(world);
+
+    vec2 texel = terrainSize / (heightMapSize - 1.0);
+    float left = sampleHeight(world - vec2(texel.x, 0.0));
+    float right = sampleHeight(world + vec2(texel.x, 0.0));
+    float down = sampleHeight(world - vec2(0.0, texel.y));
+    float up = sampleHeight(world + vec2(0.0, texel.y));
+
+    FragPos = vec3(world.x, height, world.y);
+    Normal = normalize(vec3((left - right) / (2.0 * texel.x), 1.0, (down - up) / (2.0 * texel.y)));
+    TexCoords = (world - terrainOrigin) / terrainSize;
+    ObjectColor = objectColor;
+
+    gl_Position = projection * view * vec4(FragPos, 1.0);
+}
\ No newline at end of file